@@ -1,7 +1,12 @@
 """
 Provides an adapter for extraction-related information in MongoDB.
 """
-from classes.mongo import DBInterface, Schema
+from pymongo import UpdateOne
+from classes.mongo import DBInterface, Schema, BulkWriter, DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL
+
+# A flush is forced before the buffered text of a batch exceeds this many characters,
+# so that a coalesced update stays well below the 16 MB document limit.
+MAX_BATCH_CHARS = 2_000_000
 
 class ExtractAdapter(DBInterface):
     """
@@ -12,12 +17,17 @@ class ExtractAdapter(DBInterface):
             extract_adapter = ExtractAdapter()
             extract_adapter.insert_extracted_data(
                 extracted_data, url, company_id, timestamp, methods)
+
+            with extract_adapter.buffered_writer() as writer:
+                writer.insert_extracted_data(
+                    extracted_data, url, company_id, timestamp, methods)
             ```
     """
 
     def __init__(self):
         super().__init__()
         self.mongo_client[Schema.DB][Schema.EXTRACTED_DATA].create_index('scraped_id')
+        self.mongo_client[Schema.DB][Schema.EXTRACTED_DATA].create_index([('company_id', 1), ('_id', -1)])
 
     def fetch_company_extracted_data(self, id):
         """
@@ -33,6 +43,38 @@ class ExtractAdapter(DBInterface):
             return None
         return company[0]
     
+    def fetch_latest_extracted_data(self, ids):
+        """
+        Fetch the latest extracted data for several companies with a single query.
+        params:
+        ids: list of MongoDB ObjectIds
+        returns:
+        a dictionary {company id: latest extracted data},
+        companies without extracted data are left out
+        """
+        aggregate = self.mongo_client[Schema.DB][Schema.EXTRACTED_DATA].aggregate(
+            [{
+                    '$match': {
+                        'company_id': {
+                            '$in': ids
+                        }
+                    }
+                }, {
+                    '$sort': {
+                        'company_id': 1,
+                        '_id': -1
+                    }
+                }, {
+                    '$group': {
+                        '_id': '$company_id',
+                        'latest': {
+                            '$first': '$$ROOT'
+                        }
+                    }
+                }],
+            allowDiskUse=True)
+        return {group['_id']: group['latest'] for group in aggregate}
+
     def insert_extracted_data(self, extracted_data, url, company_id, timestamp, methods):
         """
         Inserts extracted data into the database.
@@ -56,4 +98,70 @@ class ExtractAdapter(DBInterface):
                     }
                 } 
             ,
-            upsert=True)
\ No newline at end of file
+            upsert=True)
+
+    def buffered_writer(self, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        Creates a writer that buffers extracted data and inserts it with bulk writes.
+
+        :param batch_size (int): Number of buffered pages that triggers a write.
+        :param flush_interval (float): Maximum number of seconds between writes.
+        :return (ExtractedDataWriter): a writer, to be used as a context manager.
+        """
+        return ExtractedDataWriter(
+            self.mongo_client[Schema.DB][Schema.EXTRACTED_DATA],
+            batch_size, flush_interval)
+
+class ExtractedDataWriter(BulkWriter):
+    """
+    Buffered version of ExtractAdapter.insert_extracted_data.
+        The pages that are pushed to the same document (same company and timestamp)
+        are coalesced into one upsert with $push/$each, so a batch has at most
+        one operation per document and the pages keep their insertion order.
+    """
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super().__init__(collection, batch_size, flush_interval)
+        self._pushes = {}
+        self._pages = 0
+        self._chars = 0
+
+    def __len__(self):
+        return self._pages
+
+    def insert_extracted_data(self, extracted_data, url, company_id, timestamp, methods):
+        """
+        Buffers extracted data for insertion.
+
+        :param extracted_data (str): The extracted data.
+        :param url (str): The URL of the extracted data.
+        :param company_id: The object id of the company.
+        :param timestamp:
+        :param methods: A list of booleans [extract_meta,extract_body,p_only]
+        """
+        if self._chars + len(extracted_data) > MAX_BATCH_CHARS:
+            self.flush()
+        self._pushes.setdefault((company_id, timestamp), []).append(
+            {'url':url,'method':methods,'data':extracted_data})
+        self._pages += 1
+        self._chars += len(extracted_data)
+        self._flush_if_due()
+
+    def _drain(self):
+        operations = [
+            UpdateOne(
+                {
+                    'company_id':company_id,
+                    'date':timestamp
+                },
+                {
+                    "$push":
+                    {
+                        "data" : {"$each": data}
+                    }
+                },
+                upsert=True)
+            for (company_id, timestamp), data in self._pushes.items()]
+        self._pushes = {}
+        self._pages = 0
+        self._chars = 0
+        return operations
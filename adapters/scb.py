@@ -2,15 +2,80 @@
 Provides an adapter for SCB-related information in MongoDB
 """
 
+import hashlib
 import json
 import logging
 import os
 import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from itertools import islice
 import tldextract
+from pymongo import ASCENDING, DeleteOne, UpdateMany, UpdateOne
 
 from definitions import ROOT_DIR
-from classes.mongo import DBInterface, Schema
-from classes.scb_api_wrapper import SCBapi
+from classes.cache import PersistentCache
+from classes.mongo import DBInterface, Schema, BulkWriter, DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL
+from classes.rate_limiter import TokenBucket
+from classes.scb_api_wrapper import SCBapi, CACHE_PATH, CACHE_TTL, CACHE_MAX_ENTRIES
+
+REFERENCE_SNAPSHOT_PATH = os.path.join(ROOT_DIR, "cache", "scb_reference_tables.json")
+READ_BATCH_SIZE = 1000
+
+def _url_fields(url):
+    """
+    The url of a company, together with the normalized fields that are derived from it,
+        so that companies can be found with exact matches on indexed fields.
+
+    :param url: a url (or an empty string)
+    :returns a dict: {'url':..., 'domain':..., 'fqdn':..., 'has_url':...}
+        domain is the registered domain (i.e. bdx.se), fqdn is the full domain (i.e. www.bdx.se),
+        and has_url is True if the url is not empty and doesn't contain whitespace.
+    """
+    url = url or ""
+    if re.fullmatch(r"\S+", url) is None:
+        return {"url": url, "domain": "", "fqdn": "", "has_url": False}
+    url_components = tldextract.extract(url)
+    domain = f"{url_components.domain}.{url_components.suffix}" if url_components.domain and url_components.suffix else ""
+    return {
+        "url": url,
+        "domain": domain.lower(),
+        "fqdn": url_components.fqdn.lower(),
+        "has_url": True
+    }
+
+def _reference_snapshot_key():
+    """
+    :returns: the key of this database's reference tables in the on-disk snapshot:
+        the database name and a hash of the connection string (so no credentials are written to disk).
+    """
+    connection = hashlib.sha256(os.getenv("MONGO_CONNECTION", "").encode("utf-8")).hexdigest()[:16]
+    return f"{Schema.DB}@{connection}"
+
+def _has_url_query(has_url):
+    """
+    :param has_url: "BOTH", "ONLY" or "NO" (see fetch_all_companies_from_db)
+    :returns a dict: the part of a company query that matches has_url.
+    """
+    match has_url.upper():
+        case "ONLY":
+            return {"has_url": True}
+        case "NO":
+            # Equality, so the has_url indexes also give the _id order (the field is a bool once migrated)
+            return {"has_url": False}
+        case _: # BOTH is default
+            return {}
+
+class CompaniesNotMigrated(Exception):
+    """
+    Raised by the company queries that need the normalized url fields (has_url, domain and fqdn)
+        when the companies collection has companies without them, which the queries would silently skip.
+    """
+    def __init__(self):
+        super().__init__("The companies collection hasn't been migrated to the normalized url fields, "
+                         "run 'spacy project run migrate' first")
 
 class SCBAdapter(DBInterface):
     """
@@ -25,13 +90,25 @@ class SCBAdapter(DBInterface):
                 fetch_limit=10)
             ```
     """
-    def __init__(self, init_api = False):
+    # Reference tables (SNI codes, municipalities and legal forms) as {collection: {code: description}},
+    # shared by all adapters in the process
+    _reference_tables = {}
+    _reference_lock = threading.Lock()
+    # Set when the companies collection is known to have the normalized url fields (see _require_migrated)
+    _migrated = False
+
+    def __init__(self, init_api = False, use_cache = True, cache_ttl = CACHE_TTL):
         """
         :param init_api: if True, then will call the initialization 
             scripts for the api wrapper. 
             Requires SCB credentials!
+        :param use_cache: if True, then the responses to count and fetch requests
+            are cached on disk, and identical requests are answered from the cache.
+        :param cache_ttl: number of seconds that a cached response stays valid.
         """
         super().__init__()
+        self.use_cache = use_cache
+        self.cache_ttl = cache_ttl
         if init_api:
             self.init_api()
 
@@ -45,10 +122,12 @@ class SCBAdapter(DBInterface):
 
             Requires SCB credentials! 
         """
-        self.wrapper = SCBapi()
+        self.cache = PersistentCache(CACHE_PATH, self.cache_ttl, CACHE_MAX_ENTRIES) if self.use_cache else None
+        self.wrapper = SCBapi(cache=self.cache)
         self._init_collection(Schema.SNI, self._store_codes)
         self._init_collection(Schema.MUNICIPALITIES, self._store_municipalities)
         self._init_collection(Schema.LEGAL_FORMS, self._store_legal_forms)
+        self._init_collection(Schema.COMPANIES, self.create_company_indexes)
 
     def _store_codes(self):
         """
@@ -61,6 +140,7 @@ class SCBAdapter(DBInterface):
         
         self.mongo_client[Schema.DB][Schema.SNI].insert_many(sni)
         self.mongo_client[Schema.DB][Schema.SNI].create_index('sni_code')
+        self._invalidate_reference_table(Schema.SNI)
 
     def _store_municipalities(self):
         """
@@ -78,18 +158,16 @@ class SCBAdapter(DBInterface):
 
         self.mongo_client[Schema.DB][Schema.MUNICIPALITIES].insert_many(municipalities)
         self.mongo_client[Schema.DB][Schema.SNI].create_index('code')
+        self._invalidate_reference_table(Schema.MUNICIPALITIES)
 
     def _fetch_municipalities(self):
         """
-        Fetch the list of all municipalities from the mongodb database.
+        Fetch the list of all municipalities from the mongodb database
+            (or from the in-process memo or on-disk snapshot, see _reference_table).
         
         :returns a dict: {code: name}
         """
-        mun_list = self.mongo_client[Schema.DB][Schema.MUNICIPALITIES].find()
-        municipalities = {}
-        for m in mun_list:
-            municipalities[m['code']] = m['name']
-        return municipalities
+        return self._reference_table(Schema.MUNICIPALITIES, 'code', 'name')
 
     def _store_legal_forms(self):
         """
@@ -116,18 +194,107 @@ class SCBAdapter(DBInterface):
         
         self.mongo_client[Schema.DB][Schema.LEGAL_FORMS].insert_many(legal_forms)
         self.mongo_client[Schema.DB][Schema.LEGAL_FORMS].create_index('code')
+        self._invalidate_reference_table(Schema.LEGAL_FORMS)
         
     def _fetch_legal_forms(self):
         """
-        Fetch the list of all legal forms from the mongodb database.
+        Fetch the list of all legal forms from the mongodb database
+            (or from the in-process memo or on-disk snapshot, see _reference_table).
 
         :returns a dict: {code: name}
         """
-        forms = self.mongo_client[Schema.DB][Schema.LEGAL_FORMS].find()
-        legal_forms = {}
-        for form in forms:
-            legal_forms[form['code']] = form['description']
-        return legal_forms
+        return self._reference_table(Schema.LEGAL_FORMS, 'code', 'description')
+
+    def _reference_table(self, collection, key, value, trust_snapshot=False):
+        """
+        Fetch a reference table, from the first of these that has it:
+            the in-process memo, the on-disk snapshot, or the mongodb database.
+            A table that is read from the database is saved to the snapshot,
+            and the _store_* methods invalidate both.
+            The snapshot is kept per database (and server), and a snapshot of a table is only used
+            if the collection still has as many documents as when it was taken
+            (an estimated count, which is read from the collection metadata),
+            so a snapshot of another or a changed database isn't used.
+
+        params:
+        collection: the collection name
+        key: the field used as key
+        value: the field used as value
+        trust_snapshot: if True, a snapshot is used without comparing it with the database,
+            so no database connection is needed when there is one
+        returns:
+        a dict {key: value}
+        """
+        with SCBAdapter._reference_lock:
+            table = SCBAdapter._reference_tables.get(collection)
+            stored = self._read_reference_snapshot().get(collection) if table is None else None
+            if stored is not None and trust_snapshot:
+                table = stored.get('table')
+            if table is None:
+                count = self.mongo_client[Schema.DB][collection].estimated_document_count()
+                if stored is not None and stored.get('count') == count:
+                    table = stored.get('table')
+            if table is None:
+                table = {doc[key]: doc[value] for doc in self.mongo_client[Schema.DB][collection].find()}
+                if table:
+                    snapshot = self._read_reference_snapshot()
+                    snapshot[collection] = {'count': count, 'table': table}
+                    self._write_reference_snapshot(snapshot)
+            if table:
+                SCBAdapter._reference_tables[collection] = table
+            return dict(table)
+
+    def _invalidate_reference_table(self, collection):
+        """
+        Removes a reference table from the in-process memo and the on-disk snapshot.
+
+        params:
+        collection: the collection name
+        """
+        with SCBAdapter._reference_lock:
+            SCBAdapter._reference_tables.pop(collection, None)
+            snapshot = self._read_reference_snapshot()
+            if snapshot.pop(collection, None) is not None:
+                self._write_reference_snapshot(snapshot)
+
+    def _read_reference_snapshot(self):
+        """
+        returns:
+        the on-disk snapshot of the reference tables of this database
+        {collection: {'count': number of documents, 'table': {key: value}}},
+        or an empty dict if there is no (readable) snapshot
+        """
+        try:
+            with open(REFERENCE_SNAPSHOT_PATH, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        tables = snapshot.get(_reference_snapshot_key()) if isinstance(snapshot, dict) else None
+        if not isinstance(tables, dict):
+            return {}
+        return {collection: table for collection, table in tables.items() if isinstance(table, dict)}
+
+    def _write_reference_snapshot(self, snapshot):
+        """
+        Atomically replaces the on-disk snapshot of the reference tables of this database
+            (the snapshots of other databases are kept).
+
+        params:
+        snapshot: the reference tables {collection: {'count': number of documents, 'table': {key: value}}}
+        """
+        os.makedirs(os.path.dirname(REFERENCE_SNAPSHOT_PATH), exist_ok=True)
+        try:
+            with open(REFERENCE_SNAPSHOT_PATH, 'r', encoding='utf-8') as f:
+                snapshots = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            snapshots = {}
+        if not isinstance(snapshots, dict):
+            snapshots = {}
+        snapshots[_reference_snapshot_key()] = snapshot
+        tmp_path = f"{REFERENCE_SNAPSHOT_PATH}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshots, f, ensure_ascii=False)
+        os.replace(tmp_path, REFERENCE_SNAPSHOT_PATH)
 
     def _last_code_checked(self):
         """
@@ -158,7 +325,7 @@ class SCBAdapter(DBInterface):
         for company in companies:
             filtered_company = {}
             filtered_company["branch_codes"] = []
-            filtered_company["url"] = ""
+            filtered_company.update(_url_fields(""))
             for key, value in company.items():
                 match key:
                     case "Företagsnamn":
@@ -183,19 +350,27 @@ class SCBAdapter(DBInterface):
                     
         return filtered_companies
 
-    def _fetch_companies_by_municipality(self, sni_code: str, fetch_limit = 50):
+    def _fetch_companies_by_municipality(self, sni_code: str, fetch_limit = 50, wrapper = None):
         """
         Function for fetching companies by SNI code from random municipalities.
+            Starts with a single query for all municipalities. A query with more companies
+            than there is room for is split in half, first by municipality and then
+            (for a single municipality) by legal form, until the parts fit.
+            Parts without companies are never fetched, so the number of requests grows
+            with the number of municipalities that have companies, not with the number of municipalities.
         
         params:
         sni_code: SNI code
         fetch_limit: maximum number of companies to fetch
+        wrapper: the SCBapi to send the requests with (defaults to self.wrapper)
         returns:
         list of companies
         """
-        
+        if wrapper is None:
+            wrapper = self.wrapper
         total_fetched = 0
         comp_arr = []
+        requests_before = wrapper.requests_sent + wrapper.cache_hits
         logging.debug(f"Fetching from SNI: {sni_code}")
 
         mun_codes = list(self._fetch_municipalities().keys())
@@ -203,21 +378,36 @@ class SCBAdapter(DBInterface):
 
         legal_forms = list(self._fetch_legal_forms().keys())
 
-        while (total_fetched < fetch_limit) and (mun_codes):
+        queries = [(mun_codes, legal_forms)]
+        while (total_fetched < fetch_limit) and (queries):
 
-            mun_code = mun_codes.pop()
-            found_count = self.wrapper.sni([sni_code]).category([mun_code]).category(legal_forms, "Juridisk form").count(False)
-            logging.debug(f"Municipality: {mun_code} - Companies: {found_count}")
+            muns, forms = queries.pop()
+            found_count = wrapper.sni([sni_code]).category(muns).category(forms, "Juridisk form").count(False)
+            logging.debug(f"Municipalities: {len(muns)} - Legal forms: {len(forms)} - Companies: {found_count}")
+
+            if found_count == 0:
+                continue
 
             if found_count+total_fetched > fetch_limit:
-                logging.debug(f"Skipping {mun_code} too many companies!")
+                # Split the query, the first half is counted next
+                if len(muns) > 1:
+                    half = len(muns) // 2
+                    queries.append((muns[half:], forms))
+                    queries.append((muns[:half], forms))
+                elif len(forms) > 1:
+                    half = len(forms) // 2
+                    queries.append((muns, forms[half:]))
+                    queries.append((muns, forms[:half]))
+                else:
+                    logging.debug(f"Skipping {muns[0]} ({forms[0]}) too many companies!")
                 continue
 
             total_fetched += found_count
-            companies = self.wrapper.sni([sni_code]).category([mun_code]).category(legal_forms, "Juridisk form").fetch().json()
+            companies = wrapper.sni([sni_code]).category(muns).category(forms, "Juridisk form").fetch().json()
             comp_arr.extend(self._filter_companies(companies))
 
-        logging.debug(f"Total companies fetched: {total_fetched}")
+        api_calls = wrapper.requests_sent + wrapper.cache_hits - requests_before
+        logging.debug(f"Total companies fetched: {total_fetched} with {api_calls} API calls")
         logging.debug(f"----> Stopping fetching from SNI {sni_code}")
         self._update_api_request_count(total_fetched)
         return comp_arr
@@ -235,27 +425,133 @@ class SCBAdapter(DBInterface):
         docs = self.mongo_client[Schema.DB][Schema.SNI].find({"sni_code": { "$ne": last_code }}).sort([("sni_code")])
         if (last_code is not None) and (last_code > start_sni):
             start_sni = last_code
+        collected = 0
         for doc in docs:
             if (doc["sni_code"] >= start_sni) and not (doc["sni_code"] > stop_sni):
                 companies = self._fetch_companies_by_municipality(
                     doc["sni_code"], 
                     fetch_limit=fetch_limit)
-                if len(companies) > 0:
-                    self.mongo_client[Schema.DB][Schema.COMPANIES].insert_many(companies)
+                self._upsert_companies(companies)
+                collected += len(companies)
+        self._log_requests([self.wrapper], collected)
         self.wrapper.session.close()
 
-    def fetch_codes(self):
+    def _log_requests(self, wrappers, collected):
         """
-        Fetch the list of all 5 digit codes from the mongodb database.
+        Logs the number of requests that were sent to the API, and answered from the cache.
+
+        params:
+        wrappers: the SCBapi objects used for the harvest
+        collected: the number of companies collected by the harvest
+        """
+        requests_sent = sum(wrapper.requests_sent for wrapper in wrappers)
+        cache_hits = sum(wrapper.cache_hits for wrapper in wrappers)
+        logging.info("Sent %s requests to the SCB API, %s requests were answered from the cache",
+                     requests_sent, cache_hits)
+        logging.info("Collected %s companies with %.2f API calls per company",
+                     collected, (requests_sent + cache_hits) / collected if collected else 0)
+
+    def _upsert_companies(self, companies):
+        """
+        Saves companies that are not already in the database (by organization number).
+
+        params:
+        companies: list of filtered companies
+        """
+        if len(companies) > 0:
+            self.mongo_client[Schema.DB][Schema.COMPANIES].bulk_write(
+                [UpdateOne({"org_nr": company["org_nr"]}, {"$setOnInsert": company}, upsert=True) for company in companies],
+                ordered=False)
+
+    def _checked_codes(self):
+        """
+        SNI codes that were completely harvested by the concurrent harvest.
+
+        returns:
+        a set of SNI codes
+        """
+        progress = self.mongo_client[Schema.DB][Schema.SNI_PROGRESS].find({}, {"sni_code": 1})
+        return {doc["sni_code"] for doc in progress}
+
+    def _store_harvested_companies(self, sni_code, companies):
+        """
+        Saves the companies fetched for an SNI code, and then marks the code as checked.
+            The companies are upserted by organization number, so an SNI code that is
+            harvested again (i.e. after a crash before it was marked) doesn't add duplicates.
+
+        params:
+        sni_code: SNI code
+        companies: list of filtered companies
+        """
+        self._upsert_companies(companies)
+        self.mongo_client[Schema.DB][Schema.SNI_PROGRESS].update_one(
+            {"sni_code": sni_code},
+            {"$set": {"companies": len(companies), "timestamp": datetime.now().strftime('%Y-%m-%dT%H%M%S')}},
+            upsert=True)
+
+    def _fetch_companies_from_api_concurrently(self, start_sni, stop_sni, fetch_limit=50, workers=4, rate_limit=1.0, burst=10):
+        """
+        Fetch companies from the SCB API from random municipalities in the specified SNI code range,
+            harvesting several SNI codes at the same time.
+            Every worker thread has its own SCBapi (and client-certificate session),
+            and all requests share one token bucket. Every finished SNI code is checkpointed,
+            so a restarted harvest continues with the remaining codes.
+
+        params:
+        start_sni: start SNI code
+        stop_sni: stop SNI code
+        fetch_limit: maximum number of companies to fetch per SNI code
+        workers: number of SNI codes harvested at the same time
+        rate_limit: maximum average number of requests per second (for all workers)
+        burst: maximum number of requests sent at once
+        """
+        rate_limiter = TokenBucket(rate_limit, burst)
+        local = threading.local()
+        wrappers = []
+        wrappers_lock = threading.Lock()
+
+        def harvest(sni_code):
+            if not hasattr(local, "wrapper"):
+                local.wrapper = SCBapi(rate_limiter=rate_limiter, cache=self.cache)
+                with wrappers_lock:
+                    wrappers.append(local.wrapper)
+            companies = self._fetch_companies_by_municipality(sni_code, fetch_limit=fetch_limit, wrapper=local.wrapper)
+            self._store_harvested_companies(sni_code, companies)
+            return len(companies)
+
+        checked_codes = self._checked_codes()
+        codes = [code for code in sorted(self.fetch_codes())
+                 if start_sni <= code <= stop_sni and code not in checked_codes]
+        logging.info("Harvesting %s SNI codes with %s workers (%s already checked)",
+                     len(codes), workers, len(checked_codes))
+
+        collected = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(harvest, code): code for code in codes}
+            try:
+                for done, future in enumerate(as_completed(futures), start=1):
+                    collected += future.result()
+                    logging.info("SNI %s: %s companies (%s/%s)", futures[future], future.result(), done, len(codes))
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+            finally:
+                for wrapper in wrappers:
+                    wrapper.session.close()
+        logging.info("Waited %.1f seconds for the rate limit", rate_limiter.waited)
+        self._log_requests([self.wrapper, *wrappers], collected)
+        self.wrapper.session.close()
+
+    def fetch_codes(self, trust_snapshot=False):
+        """
+        Fetch the list of all 5 digit codes from the mongodb database
+            (or from the in-process memo or on-disk snapshot, see _reference_table).
         
+        :param trust_snapshot: if True, the on-disk snapshot is used without a database round trip
+            (for when the database may be unreachable, i.e. predict).
         :returns a dict: {sni_code: description}
         """
-        
-        codes = self.mongo_client[Schema.DB][Schema.SNI].find()
-        sni_codes = {}
-        for code in codes:
-            sni_codes[code['sni_code']] = code['description']
-        return sni_codes
+        return self._reference_table(Schema.SNI, 'sni_code', 'description', trust_snapshot)
 
     def fetch_all_companies_from_api(self, fetch_limit=50):
         """
@@ -269,6 +565,24 @@ class SCBAdapter(DBInterface):
         
         self._fetch_companies_from_api(start_sni, stop_sni, fetch_limit=fetch_limit)
 
+    def fetch_all_companies_from_api_concurrently(self, fetch_limit=50, workers=4, rate_limit=1.0, burst=10):
+        """
+        Concurrent version of fetch_all_companies_from_api,
+            resumes from the SNI codes that were checkpointed by an earlier run.
+
+        params:
+        fetch_limit: maximum number of companies to fetch per SNI code
+        workers: number of SNI codes harvested at the same time
+        rate_limit: maximum average number of requests per second (for all workers)
+        burst: maximum number of requests sent at once
+        """
+        start_sni="01120"
+        stop_sni="95290"
+
+        self._fetch_companies_from_api_concurrently(
+            start_sni, stop_sni, fetch_limit=fetch_limit,
+            workers=workers, rate_limit=rate_limit, burst=burst)
+
     def _update_api_request_count(self, num_requests=1):
         """
         Updates the count of API requests made to the SCB API.
@@ -277,6 +591,42 @@ class SCBAdapter(DBInterface):
         """
         self.mongo_client[Schema.DB][Schema.API_COUNT].update_one({}, {"$inc": {"count": num_requests}}, upsert=True)
         
+    def _iter_companies(self, query, projection=None, batch_size=READ_BATCH_SIZE):
+        """
+        Streams the companies that match a query, batch_size companies at a time.
+            Every batch is a separate query that continues after the last _id of the previous batch,
+            so no cursor is kept open (and timed out) while the caller works through a batch,
+            and companies can be updated or deleted during the iteration.
+        :param query: a MongoDB query
+        :param projection: the fields to return (all fields if None). The _id is always returned.
+        :param batch_size: number of companies fetched per query
+        :returns a generator of companies, in _id order:
+        """
+        collection = self.mongo_client[Schema.DB][Schema.COMPANIES]
+        last_id = None
+        while True:
+            page_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+            batch = list(collection.find(page_query, projection).sort("_id", ASCENDING).limit(batch_size))
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1]["_id"]
+
+    def iter_companies_from_db_by_sni(self, sni_code, has_url="BOTH", projection=None, batch_size=READ_BATCH_SIZE):
+        """
+        Streams companies from the database based on the SNI code.
+        :param sni_code:
+        :param has_url: "BOTH", "ONLY" or "NO" (see fetch_companies_from_db_by_sni)
+        :param projection: the fields to return (all fields if None)
+        :param batch_size: number of companies fetched per query
+        :returns a generator of companies:
+        :raises CompaniesNotMigrated: if has_url isn't "BOTH" and the collection hasn't been migrated.
+        """
+        query = _has_url_query(has_url)
+        if query:
+            self._require_migrated()
+        return self._iter_companies({"branch_codes": sni_code, **query}, projection, batch_size)
+
     def fetch_companies_from_db_by_sni(self, sni_code, has_url="BOTH"):
         """
         Fetch companies from the database based on the SNI code.
@@ -290,22 +640,21 @@ class SCBAdapter(DBInterface):
             will be returned.
         returns a list of companies:
         """
-        match has_url.upper():
-            case "ONLY":
-                query = {"branch_codes": sni_code, "url": {"$regex": r"^\S+$"}}
-            case "NO":
-                query = {
-                    "branch_codes": sni_code,
-                    "$or":[
-                        {"url": {"$exists": False}},
-                        {"url": {"$regex": r"^\s*$"}}
-                    ]
-                }
-            case _: # BOTH is default
-                query = {"branch_codes": sni_code}
-
-        companies = self.mongo_client[Schema.DB][Schema.COMPANIES].find(query)
-        return list(companies)
+        return list(self.iter_companies_from_db_by_sni(sni_code, has_url))
+
+    def iter_all_companies_from_db(self, has_url="BOTH", projection=None, batch_size=READ_BATCH_SIZE):
+        """
+        Streams all companies from the database.
+        :param has_url: "BOTH", "ONLY" or "NO" (see fetch_all_companies_from_db)
+        :param projection: the fields to return (all fields if None)
+        :param batch_size: number of companies fetched per query
+        :returns a generator of companies:
+        :raises CompaniesNotMigrated: if has_url isn't "BOTH" and the collection hasn't been migrated.
+        """
+        query = _has_url_query(has_url)
+        if query:
+            self._require_migrated()
+        return self._iter_companies(query, projection, batch_size)
 
     def fetch_all_companies_from_db(self, has_url="BOTH"):
         """
@@ -319,21 +668,7 @@ class SCBAdapter(DBInterface):
             will be returned.
         :returns a list of companies:
         """
-        match has_url.upper():
-            case "ONLY":
-                query = {"url": {"$regex": r"^\S+$"}}
-            case "NO":
-                query = {
-                    "$or":[
-                        {"url": {"$exists": False}},
-                        {"url": {"$regex": r"^\s*$"}}
-                    ]
-                }
-            case _: # BOTH is default
-                query = {}
-
-        companies = self.mongo_client[Schema.DB][Schema.COMPANIES].find(query)
-        return list(companies)
+        return list(self.iter_all_companies_from_db(has_url))
 
     def update_url_for_company(self, org_nr, url):
         """
@@ -342,17 +677,30 @@ class SCBAdapter(DBInterface):
         org_nr: organization number
         url: URL to update
         """
-        self.mongo_client[Schema.DB][Schema.COMPANIES].update_one({"org_nr": org_nr}, {"$set": {"url": url}})
+        self.mongo_client[Schema.DB][Schema.COMPANIES].update_one({"org_nr": org_nr}, {"$set": _url_fields(url)})
 
-    def _get_company_by_url(self, url):
+    def buffered_company_writer(self, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
         """
-        Get company by URL.
+        Creates a writer that buffers url updates and deletions of companies,
+            and sends them with bulk writes.
         params:
-        url: URL
+        batch_size: number of buffered companies that triggers a write
+        flush_interval: maximum number of seconds between writes
+        returns:
+        a CompanyWriter, to be used as a context manager
+        """
+        return CompanyWriter(self.mongo_client[Schema.DB][Schema.COMPANIES], batch_size, flush_interval)
+
+    def _get_company_by_url(self, field, domain):
+        """
+        Get company by an exact match on one of its normalized url fields.
+        params:
+        field: "fqdn" or "domain"
+        domain: the (lowercase) domain to match
         returns:
         company
         """
-        return self.mongo_client[Schema.DB][Schema.COMPANIES].find_one({"url": {"$regex": url}})
+        return self.mongo_client[Schema.DB][Schema.COMPANIES].find_one({field: domain})
 
     def get_company_by_url(self, url, try_base_domain = True):
         """
@@ -362,15 +710,16 @@ class SCBAdapter(DBInterface):
         :try_base_domain: will search for the base domain if True and can't find the FQDN.
 
         :returns a PyMongo result object or None:
+        :raises CompaniesNotMigrated: if the collection hasn't been migrated.
         """
-        url_components = tldextract.extract(url)
+        self._require_migrated()
+        fields = _url_fields(url)
         # Try to find the company using the full domain subdomain.domain.tld
-        company = self._get_company_by_url(url_components.fqdn)
+        company = self._get_company_by_url("fqdn", fields["fqdn"]) if fields["fqdn"] else None
 
         # If not found, try using the base domain domain.tld
-        if company is None and try_base_domain:
-            base_domain = f"{url_components.domain}.{url_components.suffix}"
-            company = self._get_company_by_url(base_domain)
+        if company is None and try_base_domain and fields["domain"]:
+            company = self._get_company_by_url("domain", fields["domain"])
 
         return company
 
@@ -401,13 +750,13 @@ class SCBAdapter(DBInterface):
                 - _id: SNI code
                 - companies: list of company ids (MongoDB ObjectIds)
                 - count: number of companies
+        Raises CompaniesNotMigrated if the collection hasn't been migrated.
         """
+        self._require_migrated()
         aggregate = self.mongo_client[Schema.DB][Schema.COMPANIES].aggregate(
             [{
                     '$match': {
-                        'url': {
-                        '$regex': '\\S'
-                        }
+                        'has_url': True
                     }
                 }, {
                     '$group': {
@@ -426,6 +775,45 @@ class SCBAdapter(DBInterface):
                 }])
         return list(aggregate)
 
+    def iter_companies_by_sni(self, batch_size=READ_BATCH_SIZE):
+        """
+        Streaming variant of aggregate_companies_by_sni.
+            The counts are aggregated up front (one small document per SNI code),
+            while the company ids of each SNI code are streamed when they are iterated.
+        :param batch_size: number of company ids fetched per query
+        :returns a generator of dictionaries with the following keys:
+                - _id: SNI code
+                - companies: a generator of company ids (MongoDB ObjectIds)
+                - count: number of companies
+        :raises CompaniesNotMigrated: if the collection hasn't been migrated.
+        """
+        self._require_migrated()
+        counts = self.mongo_client[Schema.DB][Schema.COMPANIES].aggregate(
+            [{
+                    '$match': {
+                        'has_url': True
+                    }
+                }, {
+                    '$group': {
+                        '_id': {
+                            '$arrayElemAt': [
+                                '$branch_codes', 0
+                            ]
+                        }, 
+                        'count': {
+                            '$sum': 1
+                        }
+                    }
+                }])
+        for sni in list(counts):
+            query = {"branch_codes": sni["_id"], "has_url": True, "branch_codes.0": sni["_id"]}
+            companies = self._iter_companies(query, {"_id": 1}, batch_size)
+            yield {
+                "_id": sni["_id"],
+                "companies": (company["_id"] for company in companies),
+                "count": sni["count"]
+            }
+
     def fetch_company_by_id(self, id):
         """
         Fetch company from the database by MongoDB ObjectId.
@@ -433,3 +821,156 @@ class SCBAdapter(DBInterface):
         :returns company:
         """
         return self.mongo_client[Schema.DB][Schema.COMPANIES].find_one({"_id": id})
+
+    def fetch_companies_by_ids(self, ids, projection=None):
+        """
+        Fetch several companies from the database with a single query.
+        :param ids: list of MongoDB ObjectIds
+        :param projection: the fields to return (all fields if None)
+        :returns: a dictionary {company id: company}
+        """
+        companies = self.mongo_client[Schema.DB][Schema.COMPANIES].find({"_id": {"$in": ids}}, projection)
+        return {company["_id"]: company for company in companies}
+
+    def _require_migrated(self):
+        """
+        Checks (once per process) that every company has the normalized url fields.
+        raises:
+        CompaniesNotMigrated if a company doesn't have them
+        """
+        if SCBAdapter._migrated:
+            return
+        if self.mongo_client[Schema.DB][Schema.COMPANIES].find_one({"has_url": {"$exists": False}}, {"_id": 1}) is not None:
+            raise CompaniesNotMigrated()
+        SCBAdapter._migrated = True
+
+    def create_company_indexes(self):
+        """
+        Creates the indexes of the companies collection:
+            a unique index on the organization number, and indexes for
+            the exact-match url lookups and the has_url filters.
+            The has_url indexes end with the _id, so the batches of _iter_companies
+            (a range and a sort on the _id) are read in index order instead of sorted in memory.
+            The indexes that they replace are dropped.
+            The unique index can't be created while there are duplicate
+            organization numbers, see migrate_companies.
+        """
+        companies = self.mongo_client[Schema.DB][Schema.COMPANIES]
+        companies.create_index("org_nr", unique=True)
+        companies.create_index("fqdn")
+        companies.create_index("domain")
+        companies.create_index([("has_url", ASCENDING), ("_id", ASCENDING)])
+        companies.create_index([("branch_codes", ASCENDING), ("has_url", ASCENDING), ("_id", ASCENDING)])
+        existing = companies.index_information()
+        for name in ("has_url_1", "branch_codes_1_has_url_1"):
+            if name in existing:
+                companies.drop_index(name)
+
+    def migrate_companies(self, batch_size=1000):
+        """
+        Migrates the companies collection to the normalized url fields:
+            removes companies with duplicate organization numbers (keeping the one with a url,
+            or else the first one inserted) and moves their extracted data to the kept company,
+            adds the domain, fqdn and has_url fields to the companies that don't have them,
+            and then creates the indexes.
+            Once the unique org_nr index exists, there are no duplicates to look for,
+            so running it again only costs an indexed query.
+
+        params:
+        batch_size: number of companies updated with one bulk write
+        returns:
+        a dict {'duplicates': number of removed companies, 'updated': number of updated companies}
+        """
+        companies = self.mongo_client[Schema.DB][Schema.COMPANIES]
+        removed = 0
+        if not any(index.get('unique') and index['key'] == [('org_nr', 1)] for index in companies.index_information().values()):
+            removed = self._remove_duplicate_companies(batch_size)
+
+        with BulkWriter(companies, batch_size) as writer:
+            for company in companies.find({'has_url': {'$exists': False}}, {'url': 1}, batch_size=batch_size):
+                writer.add(UpdateOne({'_id': company['_id']}, {'$set': _url_fields(company.get('url'))}))
+        logging.info("Added the normalized url fields to %s companies", writer.written)
+
+        self.create_company_indexes()
+        SCBAdapter._migrated = True
+        return {'duplicates': removed, 'updated': writer.written}
+
+    def _remove_duplicate_companies(self, batch_size):
+        """
+        Removes companies with duplicate organization numbers, keeping the one with a url
+            (or else the first one inserted). The extracted data of the removed companies
+            is moved to the kept company, so it isn't orphaned.
+
+        params:
+        batch_size: number of organization numbers handled with one bulk write
+        returns:
+        the number of removed companies
+        """
+        companies = self.mongo_client[Schema.DB][Schema.COMPANIES]
+        extracted_data = self.mongo_client[Schema.DB][Schema.EXTRACTED_DATA]
+        duplicates = companies.aggregate(
+            [{
+                    '$sort': {'_id': 1}
+                }, {
+                    '$group': {
+                        '_id': '$org_nr',
+                        'companies': {'$push': {'_id': '$_id', 'url': {'$ifNull': ['$url', '']}}},
+                        'count': {'$sum': 1}
+                    }
+                }, {
+                    '$match': {'count': {'$gt': 1}}
+                }],
+            allowDiskUse=True)
+        removed = 0
+        # The extracted data of a batch is moved before its companies are removed, so an interrupted migration orphans nothing
+        while groups := list(islice(duplicates, batch_size)):
+            moves = []
+            deletes = []
+            for group in groups:
+                with_url = [c for c in group['companies'] if _url_fields(c.get('url'))['has_url']]
+                keep = (with_url or group['companies'])[0]
+                removed_ids = [company['_id'] for company in group['companies'] if company['_id'] != keep['_id']]
+                moves.append(UpdateMany({'company_id': {'$in': removed_ids}}, {'$set': {'company_id': keep['_id']}}))
+                deletes.extend(DeleteOne({'_id': company_id}) for company_id in removed_ids)
+            extracted_data.bulk_write(moves, ordered=False)
+            companies.bulk_write(deletes, ordered=False)
+            removed += len(deletes)
+        logging.info("Removed %s companies with duplicate organization numbers", removed)
+        return removed
+
+class CompanyWriter(BulkWriter):
+    """
+    Buffered version of SCBAdapter.update_url_for_company and SCBAdapter.delete_company_from_db.
+        The operations are keyed on the organization number, so a batch has at most
+        one operation per company (the last one wins) and can be written unordered.
+    """
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super().__init__(collection, batch_size, flush_interval)
+        self._companies = {}
+
+    def __len__(self):
+        return len(self._companies)
+
+    def update_url_for_company(self, org_nr, url):
+        """
+        Buffers an update of the URL for a company.
+        params:
+        org_nr: organization number
+        url: URL to update
+        """
+        self._companies[org_nr] = UpdateOne({"org_nr": org_nr}, {"$set": _url_fields(url)})
+        self._flush_if_due()
+
+    def delete_company_from_db(self, org_nr):
+        """
+        Buffers the deletion of a company.
+        params:
+        org_nr: organization number
+        """
+        self._companies[org_nr] = DeleteOne({"org_nr": org_nr})
+        self._flush_if_due()
+
+    def _drain(self):
+        operations = list(self._companies.values())
+        self._companies = {}
+        return operations
@@ -51,32 +51,80 @@ class TrainAdapter(DBInterface):
         """
         self.mongo_client[Schema.DB][Schema.TEST_SET].insert_one(data)
     
-    def fetch_train_set(self):
+    def insert_many_to_train_set(self, data):
+        """
+        Inserts a list of documents into the train set collection with a single bulk insert.
+
+        Parameters:
+            data (list): The documents to be inserted into the train set collection.
+
+        Returns:
+            None
+        """
+        if data:
+            self.mongo_client[Schema.DB][Schema.TRAIN_SET].insert_many(data, ordered=False)
+
+    def insert_many_to_dev_set(self, data):
+        """
+        Inserts a list of documents into the development set collection with a single bulk insert.
+
+        Parameters:
+            data (list): The documents to be inserted into the development set.
+
+        Returns:
+            None
+        """
+        if data:
+            self.mongo_client[Schema.DB][Schema.DEV_SET].insert_many(data, ordered=False)
+
+    def insert_many_to_test_set(self, data):
+        """
+        Inserts a list of documents into the test set collection with a single bulk insert.
+
+        Parameters:
+            data (list): The documents to be inserted into the test set.
+
+        Returns:
+            None
+        """
+        if data:
+            self.mongo_client[Schema.DB][Schema.TEST_SET].insert_many(data, ordered=False)
+
+    def fetch_train_set(self, projection=None):
         """
         Fetch the training set from the database.
 
+        Parameters:
+            projection (dict): The fields to return (all fields if None).
+
         returns:
-            the training set
+            the training set, as a cursor
         """
-        return self.mongo_client[Schema.DB][Schema.TRAIN_SET].find()
+        return self.mongo_client[Schema.DB][Schema.TRAIN_SET].find({}, projection)
     
-    def fetch_dev_set(self):
+    def fetch_dev_set(self, projection=None):
         """
         Fetch the dev set from the database.
 
+        Parameters:
+            projection (dict): The fields to return (all fields if None).
+
         returns:
-            the development set
+            the development set, as a cursor
         """
-        return self.mongo_client[Schema.DB][Schema.DEV_SET].find()
+        return self.mongo_client[Schema.DB][Schema.DEV_SET].find({}, projection)
     
-    def fetch_test_set(self):
+    def fetch_test_set(self, projection=None):
         """
         Fetch the test set from the database.
 
+        Parameters:
+            projection (dict): The fields to return (all fields if None).
+
         returns:
-            the test set
+            the test set, as a cursor
         """
-        return self.mongo_client[Schema.DB][Schema.TEST_SET].find()
+        return self.mongo_client[Schema.DB][Schema.TEST_SET].find({}, projection)
 
     def delete_train_set(self):
         """
@@ -0,0 +1,172 @@
+"""
+Persistent, content-addressed cache for responses and other derived data.
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+# Number of cache hits whose access times are buffered before they are written
+ACCESS_BATCH_SIZE = 1000
+
+class PersistentCache():
+    """
+    An SQLite-backed key-value cache with a time to live and least-recently-used eviction.
+        Keys are content addresses (see make_key), values are bytes.
+        The cache can be shared between threads.
+        A hit doesn't write to the cache file: the access times are buffered,
+        and written in batches (and before entries are evicted, and on close).
+
+    Example usage:
+            cache = PersistentCache("cache/responses.sqlite", ttl=3600, max_entries=10000)
+            key = cache.make_key("api/Je/RaknaForetag", body)
+            value = cache.get(key)
+            if value is None:
+                value = send(body)
+                cache.set(key, value)
+    """
+    def __init__(self, path, ttl=None, max_entries=None):
+        """
+        :param path: path to the cache file (created if it doesn't exist).
+        :param ttl: number of seconds that an entry stays valid, or None to never expire.
+        :param max_entries: the least recently used entries are evicted
+            when the cache holds more than this many entries, or None for no limit.
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # {key: access time} of the hits that haven't been written yet
+        self._accessed = {}
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key         TEXT PRIMARY KEY,
+                value       BLOB,
+                created     REAL,
+                accessed    REAL
+            )
+            """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.connection.commit()
+        self._size = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Creates a content address from json-serializable parts
+            (dictionary keys are sorted, so equal dictionaries give equal keys).
+        :returns: a hex sha256 digest.
+        """
+        normalized = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        """
+        Checks if a key is cached, without marking the entry as used.
+        """
+        now = time.time()
+        with self._lock:
+            row = self.connection.execute("SELECT created FROM entries WHERE key = ?", (key,)).fetchone()
+        return row is not None and (self.ttl is None or now - row[0] <= self.ttl)
+
+    def get(self, key):
+        """
+        :param key: a key created by make_key.
+        :returns: the cached value, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self.connection.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.connection.commit()
+                self._size -= 1
+                self.misses += 1
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= ACCESS_BATCH_SIZE:
+                self._write_accessed()
+                self.connection.commit()
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Stores a value, and evicts the least recently used entries if the cache is full.
+        :param key: a key created by make_key.
+        :param value: bytes
+        """
+        now = time.time()
+        with self._lock:
+            if self.connection.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is None:
+                self._size += 1
+            self._accessed.pop(key, None)
+            self.connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, value, now, now))
+            if self.max_entries is not None and self._size > self.max_entries:
+                self._write_accessed()
+                self.connection.execute(
+                    """
+                    DELETE FROM entries WHERE key IN (
+                        SELECT key FROM entries ORDER BY accessed LIMIT ?
+                    )
+                    """, (self._size - self.max_entries,))
+                self._size = self.max_entries
+            self.connection.commit()
+
+    def evict_unused(self, since):
+        """
+        Removes the entries that haven't been read or written since the given time.
+        :param since: a time.time() timestamp.
+        :returns: the number of removed entries.
+        """
+        with self._lock:
+            self._write_accessed()
+            removed = self.connection.execute("DELETE FROM entries WHERE accessed < ?", (since,)).rowcount
+            self.connection.commit()
+            self._size -= removed
+        return removed
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self._lock:
+            self._accessed = {}
+            self.connection.execute("DELETE FROM entries")
+            self.connection.commit()
+            self._size = 0
+
+    def close(self):
+        """
+        Writes the buffered access times and closes the connection to the cache file.
+        """
+        with self._lock:
+            self._write_accessed()
+            self.connection.commit()
+            self.connection.close()
+
+    def _write_accessed(self):
+        """
+        Writes the buffered access times, without committing (the caller holds the lock).
+        """
+        if self._accessed:
+            self.connection.executemany(
+                "UPDATE entries SET accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed = {}
@@ -0,0 +1,60 @@
+"""
+A spaCy corpus reader for docs with sparse (positive-only) category labels.
+    Used by spacy train with --code classes/corpus_reader.py
+"""
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+import srsly
+from spacy import registry
+from spacy.language import Language
+from spacy.training import Corpus, Example
+
+LABELS_FILENAME = "labels.json"
+
+def read_labels(path) -> list:
+    """
+    :param path: the label index, a json list of all labels.
+    :returns: the list of labels.
+    """
+    return srsly.read_json(path)
+
+def write_labels(path, labels) -> None:
+    """
+    Writes the label index shared by the corpus files.
+    :param path: the output json file.
+    :param labels: an iterable of all labels, in the order of the dense cats.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    srsly.write_json(path, list(labels))
+
+def densify_cats(cats: dict, labels: list) -> dict:
+    """
+    :param cats: the positive labels of a doc, i.e. {"62010": 1}
+    :param labels: all labels.
+    :returns: the cats with a 0 for every missing label, in the order of the labels.
+    """
+    return {label: cats.get(label, 0) for label in labels}
+
+@registry.readers("sni.DenseCatsCorpus.v1")
+def create_dense_cats_corpus(
+        path: Optional[Path],
+        labels_path: Path,
+        max_length: int = 0,
+        gold_preproc: bool = False,
+        limit: int = 0,
+        augmenter: Optional[Callable] = None) -> Callable[[Language], Iterable[Example]]:
+    """
+    Reads a corpus (a .spacy file or a directory of them) like spacy.Corpus.v1,
+        and fills in the labels that the docs don't have with 0,
+        so the textcat components see the same dense cats as if they had been stored.
+        Without this, the missing labels would be ignored in the loss instead of counted as negatives.
+    :param labels_path: the label index written by the preprocessing (see write_labels).
+    """
+    corpus = Corpus(path, max_length=max_length, gold_preproc=gold_preproc, limit=limit, augmenter=augmenter)
+    labels = read_labels(labels_path)
+
+    def read(nlp: Language) -> Iterable[Example]:
+        for example in corpus(nlp):
+            example.reference.cats = densify_cats(example.reference.cats, labels)
+            yield example
+    return read
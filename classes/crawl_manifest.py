@@ -0,0 +1,152 @@
+"""
+Persistent manifest of crawled pages, which doubles as a resumable crawl frontier.
+"""
+import sqlite3
+import threading
+from datetime import datetime
+from enum import StrEnum
+
+MANIFEST_FILENAME = "manifest.sqlite"
+
+class CrawlStatus(StrEnum):
+    """
+    The status of a url in the manifest.
+    """
+    QUEUED      = "queued"
+    SCRAPED     = "scraped"
+    FAILED      = "failed"
+    FILTERED    = "filtered"
+    REJECTED    = "rejected"
+
+class CrawlManifest():
+    """
+    An SQLite-backed index over the pages of a scrape output folder.
+        Every url that the scraper queues, saves or gives up on is recorded
+        together with its label, depth, status, timestamp and output file,
+        so that a restarted crawl can load the already scraped urls
+        (and the urls that were queued but never fetched) without
+        opening the scraped files.
+
+    Example usage:
+            manifest = CrawlManifest("scraped_data/manifest.sqlite")
+            manifest.queue([{'label': '5560000000', 'url': 'http://bdx.se', 'depth': 0}])
+            manifest.update({'label': '5560000000', 'url': 'http://bdx.se', 'depth': 0},
+                CrawlStatus.SCRAPED, "bdx_se_2024-01-01T000000.json")
+    """
+    def __init__(self, path):
+        """
+        :param path: path to the manifest file (created if it doesn't exist).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url         TEXT PRIMARY KEY,
+                label       TEXT,
+                depth       INTEGER,
+                status      TEXT,
+                timestamp   TEXT,
+                output_file TEXT
+            )
+            """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_status ON pages (status)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_output_file ON pages (output_file)")
+        self.connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def queue(self, urls):
+        """
+        Adds urls to the frontier. Urls that are already in the manifest keep their status.
+        :param urls: a list of dictionaries {'label':..., 'url':..., 'depth':...}
+        """
+        timestamp = datetime.now().strftime('%Y-%m-%dT%H%M%S')
+        with self._lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO pages VALUES (?, ?, ?, ?, ?, NULL)",
+                [(url['url'], url['label'], url['depth'], CrawlStatus.QUEUED, timestamp) for url in urls])
+            self.connection.commit()
+
+    def update(self, url, status, output_file=None):
+        """
+        Sets the status (and output file) of a url.
+        :param url: a dictionary {'label':..., 'url':..., 'depth':...}
+        :param status: a CrawlStatus.
+        :param output_file: the file the page was saved to, if any.
+        """
+        timestamp = datetime.now().strftime('%Y-%m-%dT%H%M%S')
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (url['url'], url['label'], url['depth'], status, timestamp, output_file))
+            self.connection.commit()
+
+    def set_status(self, urls, status):
+        """
+        Sets the status of urls that are already in the manifest.
+        :param urls: an iterable of url strings.
+        :param status: a CrawlStatus.
+        """
+        timestamp = datetime.now().strftime('%Y-%m-%dT%H%M%S')
+        with self._lock:
+            self.connection.executemany(
+                "UPDATE pages SET status = ?, timestamp = ? WHERE url = ?",
+                [(status, timestamp, url) for url in urls])
+            self.connection.commit()
+
+    def relocate(self, moved):
+        """
+        Updates the output file of pages that were moved by the page store.
+        :param moved: a dictionary {old output file: new output file},
+            in the order that the pages appear in the store.
+        """
+        with self._lock:
+            self.connection.executemany(
+                "UPDATE pages SET output_file = ? WHERE output_file = ?",
+                [(new, old) for old, new in moved.items() if old != new])
+            self.connection.commit()
+
+    def urls(self, status):
+        """
+        :param status: a CrawlStatus.
+        :returns: a set of all urls with the given status.
+        """
+        with self._lock:
+            rows = self.connection.execute("SELECT url FROM pages WHERE status = ?", (status,))
+            return {row[0] for row in rows}
+
+    def last_rowid(self):
+        """
+        :returns: the rowid of the most recently added url (0 if the manifest is empty),
+            which marks the end of the frontier of the previous crawls.
+        """
+        with self._lock:
+            return self.connection.execute("SELECT COALESCE(MAX(rowid), 0) FROM pages").fetchone()[0]
+
+    def frontier(self, until=None):
+        """
+        :param until: if given, only the urls added up to this rowid (see last_rowid).
+        :returns: a list of the urls that were queued but never fetched,
+            as dictionaries {'label':..., 'url':..., 'depth':...}
+        """
+        query = "SELECT url, label, depth FROM pages WHERE status = ?"
+        params = (CrawlStatus.QUEUED,)
+        if until is not None:
+            query += " AND rowid <= ?"
+            params += (until,)
+        with self._lock:
+            rows = self.connection.execute(query + " ORDER BY rowid", params)
+            return [{'label': label, 'url': url, 'depth': depth} for url, label, depth in rows]
+
+    def close(self):
+        """
+        Closes the connection to the manifest file.
+        """
+        with self._lock:
+            self.connection.close()
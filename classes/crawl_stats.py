@@ -0,0 +1,142 @@
+"""
+Connection and latency statistics of a crawl.
+"""
+import logging
+import threading
+import time
+import weakref
+from collections import Counter
+import aiohttp
+
+def _response_socket(response):
+    """
+    :returns: the socket that a requests response came on, or None.
+        A connection lets go of its socket when the response closes it (Connection: close),
+        but the response body is still read from the socket.
+    """
+    sock = getattr(response.raw.connection, "sock", None)
+    if sock is None:
+        fp = getattr(getattr(response.raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    return sock
+
+class CrawlStats():
+    """
+    Counts the fetched pages and the connections that were opened for them,
+        and records the time to first byte of every page: from when the request got a connection
+        (or started to open one) until the response headers were received.
+        Both the synchronous session (see session_hook) and the aiohttp session
+        (see trace_config) can report to it. Pages that are rejected or can't be fetched
+        are counted per reason (see record_failure).
+
+    Example usage:
+            stats = CrawlStats()
+            session.hooks['response'].append(stats.session_hook)
+            ...
+            stats.log()
+    """
+    def __init__(self):
+        self.pages = 0
+        self.connections = 0
+        self.ttfb = []
+        self.failures = Counter()
+        self._seen_sockets = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def record(self, ttfb, new_connection):
+        """
+        Records a fetched page.
+        :param ttfb: the time to first byte in seconds.
+        :param new_connection: True if a connection was opened for the page.
+        """
+        with self._lock:
+            self.pages += 1
+            self.ttfb.append(ttfb)
+            if new_connection:
+                self.connections += 1
+
+    def record_failure(self, reason):
+        """
+        Records a page that was rejected or couldn't be fetched.
+        :param reason: i.e. "not_html", "too_large", "timeout" or "error".
+        """
+        with self._lock:
+            self.failures[reason] += 1
+
+    def session_hook(self, response, *args, **kwargs):
+        """
+        A requests response hook. It runs before the body is read,
+            so the connection that the response came on is still attached to it.
+            Pooled connection objects are reconnected when the server closes them,
+            so a new connection is recognized by its socket.
+        """
+        sock = _response_socket(response)
+        with self._lock:
+            new_connection = sock is not None and sock not in self._seen_sockets
+            if new_connection:
+                self._seen_sockets.add(sock)
+        self.record(response.elapsed.total_seconds(), new_connection)
+        return response
+
+    def trace_config(self):
+        """
+        :returns: an aiohttp.TraceConfig that reports the pages and connections of a ClientSession.
+        """
+        async def on_request_start(session, context, params):
+            context.start = time.perf_counter()
+            context.new_connection = False
+
+        async def on_connection_queued_end(session, context, params):
+            # The time spent waiting for a free connection isn't part of the time to first byte
+            context.start = time.perf_counter()
+
+        async def on_connection_create_end(session, context, params):
+            context.new_connection = True
+
+        async def on_request_end(session, context, params):
+            self.record(time.perf_counter() - context.start, context.new_connection)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_queued_end.append(on_connection_queued_end)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+
+    def summary(self):
+        """
+        :returns: a dictionary with the number of pages and connections, the connections per page,
+            the 50th, 90th and 99th percentile (and maximum) time to first byte in milliseconds,
+            and the number of failed pages per reason.
+        """
+        with self._lock:
+            ttfb = sorted(self.ttfb)
+            pages, connections = self.pages, self.connections
+            failures = dict(self.failures)
+
+        def percentile(p):
+            return round(1000 * ttfb[min(len(ttfb) - 1, int(p / 100 * len(ttfb)))], 1) if ttfb else 0.0
+
+        return {
+            "pages": pages,
+            "connections": connections,
+            "connections_per_page": round(connections / pages, 3) if pages else 0.0,
+            "ttfb_p50_ms": percentile(50),
+            "ttfb_p90_ms": percentile(90),
+            "ttfb_p99_ms": percentile(99),
+            "ttfb_max_ms": percentile(100),
+            "failures": failures,
+        }
+
+    def log(self):
+        """
+        Logs the summary.
+        """
+        summary = self.summary()
+        logging.info("Fetched %s pages over %s connections (%.3f connections per page)",
+                     summary["pages"], summary["connections"], summary["connections_per_page"])
+        logging.info("Time to first byte: p50 %s ms, p90 %s ms, p99 %s ms, max %s ms",
+                     summary["ttfb_p50_ms"], summary["ttfb_p90_ms"], summary["ttfb_p99_ms"], summary["ttfb_max_ms"])
+        if summary["failures"]:
+            logging.info("Rejected or failed pages: %s",
+                         ", ".join(f"{reason}: {count}" for reason, count in sorted(summary["failures"].items())))
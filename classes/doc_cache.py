@@ -0,0 +1,104 @@
+"""
+Cache of tokenized docs, so that unchanged texts aren't tokenized again.
+"""
+import json
+import time
+import zlib
+import hashlib
+import numpy
+import spacy
+from spacy.tokens import DocBin
+from classes.cache import PersistentCache
+
+class DocCache():
+    """
+    Stores the token data of docs (as DocBin stores it) in a PersistentCache.
+        The key is a hash of the text and of the tokenizer (its rules and the spaCy version),
+        so a changed text, or a changed tokenizer, is a cache miss.
+        The cats aren't cached, they are set when a doc is read from the cache.
+
+    Example usage:
+            cache = DocCache("cache/preprocess/train.sqlite", nlp)
+            key = cache.make_key(text)
+            if key in cache:
+                writer.merge(cache.get(key, cats))
+            else:
+                doc = nlp(text)
+                doc.cats = cats
+                writer.merge(cache.set(key, doc))
+            ...
+            cache.evict_unused()
+    """
+    def __init__(self, path, nlp):
+        """
+        :param path: path to the cache file (created if it doesn't exist).
+        :param nlp: the spacy.Language whose tokenizer creates the docs.
+        """
+        self.cache = PersistentCache(path)
+        self.attrs = DocBin().attrs
+        self.started = time.time()
+        tokenizer_hash = hashlib.sha256(nlp.tokenizer.to_bytes()).hexdigest()
+        self._tokenizer_key = PersistentCache.make_key(spacy.__version__, nlp.lang, tokenizer_hash, self.attrs)
+
+    def make_key(self, text):
+        """
+        :returns: the key of the doc of a text.
+        """
+        return PersistentCache.make_key("doc", self._tokenizer_key, hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def get(self, key, cats):
+        """
+        :param key: a key created by make_key.
+        :param cats: the cats of the doc.
+        :returns: a DocBin with the cached doc (see DocBinWriter.merge), or None if it isn't cached.
+        """
+        value = self.cache.get(key)
+        if value is None:
+            return None
+        header, _, body = zlib.decompress(value).partition(b"\0")
+        header = json.loads(header)
+        length = header["length"]
+        tokens = numpy.frombuffer(body, dtype=numpy.uint64, count=length * len(self.attrs))
+        offset = tokens.nbytes
+        doc_bin = DocBin()
+        doc_bin.tokens.append(tokens.reshape((length, len(self.attrs))))
+        doc_bin.spaces.append(numpy.frombuffer(body, dtype=bool, count=length, offset=offset).reshape((length, 1)))
+        doc_bin.span_groups.append(body[offset + length:])
+        doc_bin.strings.update(header["strings"])
+        doc_bin.flags.append(header["flags"])
+        doc_bin.cats.append(cats)
+        return doc_bin
+
+    def set(self, key, doc):
+        """
+        Caches the tokens of a doc (but not its cats).
+        :param key: a key created by make_key.
+        :param doc: a spacy.Doc
+        :returns: a DocBin with the doc (and its cats), so the doc doesn't have to be serialized again.
+        """
+        doc_bin = DocBin(docs=[doc])
+        tokens = doc_bin.tokens[0]
+        # The json header never has a null byte (control characters are escaped)
+        header = json.dumps({"length": len(tokens), "strings": sorted(doc_bin.strings), "flags": doc_bin.flags[0]},
+                            ensure_ascii=False).encode("utf-8")
+        body = tokens.tobytes("C") + doc_bin.spaces[0].tobytes("C") + doc_bin.span_groups[0]
+        # Most of the token data is zeros, so the fastest compression level is almost as small
+        self.cache.set(key, zlib.compress(header + b"\0" + body, 1))
+        return doc_bin
+
+    def evict_unused(self):
+        """
+        Removes the docs that haven't been used since the cache was opened,
+            i.e. of companies that are no longer in the data set.
+        :returns: the number of removed docs.
+        """
+        return self.cache.evict_unused(self.started)
+
+    def close(self):
+        """
+        Closes the cache file.
+        """
+        self.cache.close()
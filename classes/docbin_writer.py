@@ -0,0 +1,77 @@
+"""
+Incremental writer for spaCy DocBin files.
+"""
+import shutil
+from pathlib import Path
+from spacy.tokens import DocBin
+
+class DocBinWriter():
+    """
+    Writes docs to a .spacy file, or to a directory of .spacy shards
+        (0000.spacy, 0001.spacy, ...) that are written as soon as they are full,
+        so only one shard is kept in memory. spaCy's corpus readers read a directory
+        of shards like a single file, in the same order.
+
+    Example usage:
+            with DocBinWriter("corpus/train.spacy", shard_size=10000) as writer:
+                for doc in nlp.pipe(texts):
+                    writer.add(doc)
+    """
+    def __init__(self, path, shard_size=0):
+        """
+        :param path: the output file, or the output directory if shard_size is above 0.
+            An existing file or directory at the path is removed.
+        :param shard_size: number of docs per shard, or 0 to write a single file.
+        """
+        self.path = Path(path)
+        self.shard_size = shard_size
+        self.shards = 0
+        self.docs = 0
+        self._doc_bin = DocBin()
+        if self.path.is_dir():
+            shutil.rmtree(self.path)
+        else:
+            self.path.unlink(missing_ok=True)
+        if shard_size > 0:
+            self.path.mkdir(parents=True)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, doc):
+        """
+        Adds a doc, and writes the current shard if it is full.
+        """
+        self._doc_bin.add(doc)
+        self.docs += 1
+        if self.shard_size > 0 and len(self._doc_bin) >= self.shard_size:
+            self._write_shard()
+
+    def merge(self, doc_bin):
+        """
+        Adds the docs of a DocBin (with the same attrs), and writes the current shard if it is full.
+        """
+        self._doc_bin.merge(doc_bin)
+        self.docs += len(doc_bin)
+        if self.shard_size > 0 and len(self._doc_bin) >= self.shard_size:
+            self._write_shard()
+
+    def close(self):
+        """
+        Writes the remaining docs.
+        """
+        if self.shard_size > 0:
+            if len(self._doc_bin) > 0:
+                self._write_shard()
+        else:
+            self._doc_bin.to_disk(self.path)
+
+    def _write_shard(self):
+        self._doc_bin.to_disk(self.path / f"{self.shards:04d}.spacy")
+        self.shards += 1
+        self._doc_bin = DocBin()
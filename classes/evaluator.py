@@ -0,0 +1,199 @@
+"""
+Vectorized evaluation of text classification predictions.
+"""
+import numpy
+
+CHUNK_SIZE = 4096
+
+class ScoreMatrixEvaluator():
+    """
+    Evaluates the predicted cats of documents against their true labels,
+        with the predictions stacked in (documents x labels) score matrices.
+        A prediction is ranked like a stable sort of the cats by descending score,
+        so labels with equal scores keep the order of the cats.
+
+        For every document the ranks of three labels are kept: the true label,
+        and the highest and lowest ranked labels of the true category (the first two digits),
+        which give the same label and category hits and weighted category score as a per document
+        evaluation of the sorted cats (see tests/test_evaluator.py).
+        The score matrices are only kept until a chunk of documents is ranked.
+
+    Example usage:
+            evaluator = ScoreMatrixEvaluator(top_n=5)
+            for doc, label in nlp.pipe(texts, as_tuples=True):
+                evaluator.add(doc.cats, label)
+            results = evaluator.label_results()
+    """
+    def __init__(self, top_n, labels=None, chunk_size=CHUNK_SIZE):
+        """
+        :param top_n: the number of top predictions to evaluate.
+        :param labels: the labels of the model, in the order of the cats,
+            or None to take them from the first added cats.
+        :param chunk_size: the number of documents that are ranked at a time.
+        """
+        self.top_n = top_n
+        self.labels = None
+        self.chunk_size = chunk_size
+        # The true labels, in the order they were first seen (they don't have to be labels of the model)
+        self.true_labels = {}
+        self.skipped = {}
+        self._chunk = None
+        self._chunk_true = []
+        self._true = []
+        self._true_rank = []
+        self._best_category_rank = []
+        self._worst_category_rank = []
+        self._predicted = []
+        if labels is not None:
+            self._set_labels(labels)
+
+    def _set_labels(self, labels):
+        self.labels = list(labels)
+        self._label_index = {label: i for i, label in enumerate(self.labels)}
+        categories = {}
+        self._label_category = numpy.array([categories.setdefault(label[:2], len(categories)) for label in self.labels])
+        self._categories = categories
+        self._category_labels = [numpy.flatnonzero(self._label_category == category) for category in range(len(categories))]
+        # _before[j, k] is True if label k comes before label j in the cats
+        self._before = numpy.tri(len(self.labels), len(self.labels), -1, dtype=bool)
+        self._chunk = numpy.empty((self.chunk_size, len(self.labels)))
+
+    def __len__(self):
+        return sum(len(ranks) for ranks in self._true_rank) + len(self._chunk_true)
+
+    def add(self, cats, true_label):
+        """
+        Adds the predictions for a document.
+        :param cats: the predicted doc.cats, with the labels in the same order for every document.
+        :param true_label: the true label of the document.
+        """
+        if self.labels is None:
+            self._set_labels(cats.keys())
+        self._chunk[len(self._chunk_true)] = numpy.fromiter(cats.values(), dtype=float, count=len(self.labels))
+        self._chunk_true.append(self.true_labels.setdefault(true_label, len(self.true_labels)))
+        if len(self._chunk_true) == self.chunk_size:
+            self._rank_chunk()
+
+    def add_skipped(self, true_label):
+        """
+        Counts a document that wasn't evaluated (i.e. its text was too short).
+        """
+        self.skipped[true_label] = self.skipped.get(true_label, 0) + 1
+
+    def _rank_chunk(self):
+        """
+        Ranks the labels of the documents in the current chunk.
+        """
+        count = len(self._chunk_true)
+        if count == 0:
+            return
+        scores = self._chunk[:count]
+        rows = numpy.arange(count)
+        true_labels = list(self.true_labels)
+        chunk_true = numpy.array(self._chunk_true)
+        # The model label and category of every true label, or -1 if the model doesn't have it
+        true_index = numpy.array([self._label_index.get(label, -1) for label in true_labels], dtype=int)[chunk_true]
+        true_category = numpy.array([self._categories.get(label[:2], -1) for label in true_labels], dtype=int)[chunk_true]
+
+        has_category = true_category >= 0
+        # The highest scoring label of the category (the first one if several have the same score),
+        # and the lowest scoring label (the last one if several have the same score)
+        best = numpy.zeros(count, dtype=int)
+        worst = numpy.zeros(count, dtype=int)
+        for category in numpy.unique(true_category[has_category]):
+            documents = numpy.flatnonzero(true_category == category)
+            labels = self._category_labels[category]
+            category_scores = scores[numpy.ix_(documents, labels)]
+            best[documents] = labels[category_scores.argmax(axis=1)]
+            worst[documents] = labels[len(labels) - 1 - category_scores[:, ::-1].argmin(axis=1)]
+
+        self._true.append(chunk_true)
+        self._true_rank.append(numpy.where(true_index >= 0, self._ranks(scores, rows, numpy.maximum(true_index, 0)), -1))
+        self._best_category_rank.append(numpy.where(has_category, self._ranks(scores, rows, best), -1))
+        self._worst_category_rank.append(numpy.where(has_category, self._ranks(scores, rows, worst), -1))
+        self._predicted.append(scores.argmax(axis=1))
+        self._chunk_true = []
+
+    def _ranks(self, scores, rows, index):
+        """
+        :returns: the rank of a label in every row: the number of labels with a higher score,
+            plus the number of labels before it with the same score.
+        """
+        score = scores[rows, index][:, None]
+        return numpy.count_nonzero(scores > score, axis=1) + numpy.count_nonzero((scores == score) & self._before[index], axis=1)
+
+    def _results(self):
+        """
+        :returns: the true label index, the rank of the true label, the ranks of the highest
+            and lowest ranked labels of the true category (-1 if the model has no such label)
+            and the top-1 predicted label index of every document.
+        """
+        self._rank_chunk()
+        arrays = (self._true, self._true_rank, self._best_category_rank, self._worst_category_rank, self._predicted)
+        return [numpy.concatenate(array) if array else numpy.zeros(0, dtype=int) for array in arrays]
+
+    def label_results(self):
+        """
+        :returns: the results per true label, in the format that evaluate.log_results logs:
+            the number of correct labels and categories (top 1 and top n), the sum of the
+            weighted category scores, the label count and the number of skipped documents.
+            Results that are 0 are left out.
+        """
+        true, true_rank, best_category_rank, worst_category_rank, _ = self._results()
+        label_count = len(self.true_labels)
+        has_category = worst_category_rank >= 0
+        counts = {
+            'correct_label': numpy.bincount(true[true_rank == 0], minlength=label_count),
+            f'top_{self.top_n}_label': numpy.bincount(true[(true_rank >= 0) & (true_rank < self.top_n)], minlength=label_count),
+            'correct_category': numpy.bincount(true[best_category_rank == 0], minlength=label_count),
+            f'top_{self.top_n}_category': numpy.bincount(true[has_category & (best_category_rank < self.top_n)], minlength=label_count),
+        }
+        category_count = numpy.bincount(true[has_category], minlength=label_count)
+        # bincount adds the scores of every label in document order, like the per document evaluation
+        weights = numpy.where(has_category, 1 / (numpy.maximum(worst_category_rank, 0) + 1), 0.0)
+        weighted_category_score = numpy.bincount(true, weights=weights, minlength=label_count)
+        documents = numpy.bincount(true, minlength=label_count)
+
+        results = {}
+        for label, i in self.true_labels.items():
+            label_results = {key: int(count[i]) for key, count in counts.items() if count[i] > 0}
+            if category_count[i] > 0:
+                label_results['weighted_category_score'] = float(weighted_category_score[i])
+            label_results['label_count'] = int(documents[i])
+            results[label] = label_results
+        for label, skipped in self.skipped.items():
+            results.setdefault(label, {})['skipped'] = skipped
+        return results
+
+    def confusion_matrix(self):
+        """
+        :returns: a (labels x labels) matrix with the number of documents of every true label (row)
+            that got each label (column) as the top prediction. Documents with a true label
+            that the model doesn't have are left out.
+        """
+        if self.labels is None:
+            return numpy.zeros((0, 0), dtype=int)
+        true, _, _, _, predicted = self._results()
+        label_count = len(self.labels)
+        # The model label of every true label, or -1 if the model doesn't have it
+        model_index = numpy.array([self._label_index.get(label, -1) for label in self.true_labels], dtype=int)
+        true_index = model_index[true]
+        known = true_index >= 0
+        return numpy.bincount(true_index[known] * label_count + predicted[known], minlength=label_count * label_count).reshape((label_count, label_count))
+
+    def precision_recall(self):
+        """
+        :returns: a dictionary with the precision and recall of the top prediction for every label
+            (None if the label was never predicted, or never the true label).
+        """
+        matrix = self.confusion_matrix()
+        correct = numpy.diag(matrix)
+        predicted = matrix.sum(axis=0)
+        true = matrix.sum(axis=1)
+        return {
+            label: {
+                'precision': float(correct[i] / predicted[i]) if predicted[i] > 0 else None,
+                'recall': float(correct[i] / true[i]) if true[i] > 0 else None,
+            }
+            for i, label in enumerate(self.labels or [])
+        }
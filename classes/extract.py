@@ -6,6 +6,10 @@ import logging
 
 import regex as re
 from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lxml_html
+
+PARSERS = ("html.parser", "lxml")
 
 
 class NoBeautifulSoupObject(Exception):
@@ -18,39 +22,34 @@ class DataExtractor:
     """
     Extracts information from scraped websites.
     """
+    # Emojis and other symbols. This is the union of the ranges that used to be listed
+    # one by one (\u2600-\u2B55, \U0001F600-\U0001F64F, ... are all inside \u24C2-\U0010FFFF),
+    # as a character class with few ranges is much faster to match.
+    _symbols = (u"\u200d"
+                u"\u231a"
+                u"\u23cf"
+                u"\u23e9"
+                u"\u24C2-\U0010ffff")
+    # Multiple spaces, pipes, newlines, tabs and carriage returns
+    _separators = r"\s{2,}|\|+|[\n\t\r]"
+
+    # Last filter, removes characters from strings in a single pass.
+    # Gives the same result as removing, one after the other: multiple spaces, pipes,
+    # newlines, tabs, carriage returns, hashtags and emojis. Since the separators were
+    # removed before the hashtags, a hashtag continues across them ("#ab|cd" is one hashtag),
+    # and an emoji run stops before a run of whitespace (some symbols are whitespace).
+    character_filter = re.compile(
+        rf"{_separators}"                                # Separators
+        rf"|#(?:{_separators})*\w(?:\w|{_separators})*"   # Hashtags
+        rf"|(?:(?!\s{{2}})[{_symbols}])+",                # Emojis and other symbols
+        flags=re.UNICODE)
+
     def __init__(self):
         self.soup = None
         self.string_filter_list = [ # Last filter, removes strings from lists.
             re.compile(r'\d\d\d\d') # Remove strings with years (i.e. a string containing '2013')
             ]
 
-        self.character_filter_list = [ # Last filter, removes characters from strings.
-            re.compile(r'\s{2,}'),  # Remove multiple spaces
-            re.compile(r'\|+'),     # Remove pipes
-            re.compile(r'\n+'),     # Remove newlines
-            re.compile(r'\t+'),     # Remove tabs
-            re.compile(r'\r+'),     # Remove carriage returns
-            re.compile(r"#\w+"),    # Remove hashtags
-            re.compile("["          # Remove emojis and other symbols
-                u"\U0001F600-\U0001F64F"  
-                u"\U0001F300-\U0001F5FF"  
-                u"\U0001F680-\U0001F6FF"  
-                u"\U0001F1E0-\U0001F1FF"  
-                u"\U00002702-\U000027B0"
-                u"\U000024C2-\U0001F251"
-                u"\U0001f926-\U0001f937"
-                u"\U00010000-\U0010ffff"
-                u"\u2640-\u2642" 
-                u"\u2600-\u2B55"
-                u"\u200d"
-                u"\u23cf"
-                u"\u23e9"
-                u"\u231a"
-                u"\ufe0f"
-                u"\u3030"
-                "]+", flags=re.UNICODE)
-        ]
-
 
     def __str__(self):
         return self.extract()
@@ -86,27 +85,31 @@ class DataExtractor:
         :param extract_body: if True, then body will be extracted. 
         :returns: a string
         """
-        s = ""
-        
+        s = "".join(item + " " for item in self._extract_strings(filter_, p_only, extract_meta, extract_body))
+        if filter_:
+            s = self._filter_chars(s)
+        return s
+
+    def _extract_strings(self, filter_, p_only, extract_meta, extract_body):
+        """
+        Yields the strings of the extracted text: first the body, then the meta.
+        If filter_ is True, the strings matching the filter list are removed from the body,
+        and duplicates are removed from the body and the meta (the first occurrence is kept,
+        so the output is the same on every run).
+        :returns: a generator of strings
+        """
         if (extract_body or p_only):
             body = self._extract_body(filter_, p_only)
             if filter_:
-                self._filter_list(body)
-                body = list(set(body))  # remove duplicates
-            for item in body:
-                s += item + " "
-            
+                body = dict.fromkeys(self._filter_list(body))  # remove duplicates
+            yield from body
+
         if extract_meta:
             meta = self._extract_meta(filter_)
             if filter_:
-                meta = list(set(meta))  # remove duplicates
-            for item in meta:
-                s += item + " "
-                
-        if filter_:
-            s = self._filter_chars(s)
-        return s
-    
+                meta = dict.fromkeys(meta)  # remove duplicates
+            yield from meta
+
     def extract_simple_data(self):
         """
         Find links for telephone numbers and e-mail addresses in a website.
@@ -206,21 +209,179 @@ class DataExtractor:
 
     def _filter_list(self, lst):
         """
-        Takes a list of strings and removes every string 
+        Takes an iterable of strings and removes every string 
         with a matching regex from the filter list.
-        :param lst: a list of strings
+        :param lst: an iterable of strings
+        :returns: a generator of the remaining strings
         """
-        for i,value in enumerate(lst):
-            for filt in self.string_filter_list:
-                if filt.match(value):
-                    lst.pop(i)
-                    
+        for value in lst:
+            if not any(filt.match(value) for filt in self.string_filter_list):
+                yield value
+
     def _filter_chars(self, text):
         """
         Takes a string and removes every character 
-        with a matching regex from the filter list.
+        matching the character filter.
         :param text: a string
         """
-        for filter in self.character_filter_list:
-            text = filter.sub('', text) 
-        return text
+        return self.character_filter.sub('', text)
+
+class LxmlDataExtractor(DataExtractor):
+    """
+    Extracts information from scraped websites, using lxml instead of BeautifulSoup.
+        Instead of decomposing the filtered tags and then walking the tree again,
+        the text is collected in a single traversal that skips the filtered subtrees.
+        Gives the same text as DataExtractor for well-formed pages.
+    """
+    # Strings inside these tags are not returned by BeautifulSoup's stripped_strings
+    text_containers = {'script', 'style', 'template', 'rt', 'rp'}
+    cookie_class = re.compile("cookie*.")
+
+    def __init__(self):
+        super().__init__()
+        self._dropped = set()
+
+    def create_soup_from_string(self, raw_html):
+        """
+        Creates an lxml tree from a raw HTML string or a file pointer.
+        :raw_html: raw HTML string or a file pointer.
+        """
+        self._dropped = set()
+        try:
+            if hasattr(raw_html, 'read'):
+                raw_html = raw_html.read()
+            if isinstance(raw_html, str):
+                raw_html = raw_html.encode('utf-8')
+            parser = lxml_html.HTMLParser(encoding='utf-8')
+            self.soup = lxml_html.document_fromstring(raw_html, parser=parser)
+        except etree.ParserError:
+            # Empty document
+            self.soup = lxml_html.Element('html')
+        except (TypeError, ValueError, AttributeError) as e:
+            logging.error(e)
+            self.soup = None
+
+    def _extract_from_href(self, keyword):
+        if self.soup is None:
+            raise NoBeautifulSoupObject
+        results = []
+        href_regex = re.compile(fr'{keyword}:(.*)')
+
+        for tag in self.soup.iter('a'):
+            href = tag.get('href')
+            if href and keyword in href and not self._is_dropped(tag):
+                match = href_regex.match(href)
+                if match:
+                    results.append(match.group(1))
+        return results
+
+    def _extract_meta(self, filter_=True):
+        if self.soup is None:
+            raise NoBeautifulSoupObject
+
+        allowed_tags = ['title','description']
+        metadata = []
+
+        for tag in self.soup.iter('meta'):
+            if 'name' in tag.attrib:
+                name = tag.attrib['name']
+            elif 'property' in tag.attrib:  # For OpenGraph metadata
+                name = tag.attrib['property']
+            else:
+                continue
+            if self._is_dropped(tag):
+                continue
+            if not filter_ or any(allowed_tag in name for allowed_tag in allowed_tags):
+                metadata.append(tag.attrib.get('content', ''))
+
+        return metadata
+
+    def _extract_body(self, filter_=True, p_only=False):
+        if self.soup is None:
+            raise NoBeautifulSoupObject
+
+        if p_only:
+            return [''.join(self._texts(p, filter_, skip_containers=False)) for p in self._paragraphs(filter_)]
+        return [text.strip() for text in self._texts(self.soup, filter_, skip_containers=True) if text.strip()]
+
+    def _is_filtered(self, element):
+        """
+        Returns True if the element is removed by the filter (links, cookie banners and scripts).
+        """
+        tag = element.tag
+        if tag in ('a', 'script'):
+            return True
+        if tag == 'div':
+            classes = element.get('class')
+            if classes and self.cookie_class.search(' '.join(classes.split())):
+                return True
+        return False
+
+    def _is_dropped(self, element):
+        """
+        Returns True if the element or any of its ancestors was removed by a filtered extraction.
+        """
+        if not self._dropped:
+            return False
+        if element in self._dropped:
+            return True
+        return any(ancestor in self._dropped for ancestor in element.iterancestors())
+
+    def _texts(self, root, filter_, skip_containers):
+        """
+        Yields all text nodes below root in document order, in a single traversal.
+        :param filter_: if True, skips (and remembers) the filtered subtrees.
+        :param skip_containers: if True, skips comments and text in script-like tags.
+        """
+        stack = [(root, False)]
+        while stack:
+            element, visited = stack.pop()
+            if visited:
+                if element is not root and element.tail:
+                    yield element.tail
+                continue
+            stack.append((element, True))
+
+            if not isinstance(element.tag, str):  # Comments and processing instructions
+                if not skip_containers and element.text:
+                    yield element.text
+                continue
+            if filter_ and self._is_filtered(element):
+                self._dropped.add(element)
+                continue
+            if skip_containers and element.tag in self.text_containers:
+                continue
+
+            if element.text:
+                yield element.text
+            stack.extend((child, False) for child in reversed(element))
+
+    def _paragraphs(self, filter_):
+        """
+        Yields all <p> tags that are not inside a filtered subtree.
+        """
+        stack = [self.soup]
+        while stack:
+            element = stack.pop()
+            if not isinstance(element.tag, str):
+                continue
+            if filter_ and self._is_filtered(element):
+                self._dropped.add(element)
+                continue
+            if element.tag == 'p':
+                yield element
+            stack.extend(reversed(element))
+
+def create_extractor(parser="html.parser"):
+    """
+    Creates a data extractor for the chosen parser backend.
+    :param parser: one of PARSERS ("html.parser" for BeautifulSoup, or "lxml").
+    :returns: a DataExtractor
+    """
+    match parser:
+        case "html.parser":
+            return DataExtractor()
+        case "lxml":
+            return LxmlDataExtractor()
+        case _:
+            raise ValueError(f"Unknown parser '{parser}', expected one of {PARSERS}")
@@ -3,62 +3,129 @@ This module provides a class that interacts with the Google Custom Search API to
 """
 import os
 import logging
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from definitions import ROOT_DIR
 
+CACHE_PATH = os.path.join(ROOT_DIR, "cache", "google_search.sqlite")
+MAX_RETRIES = 5
+BACKOFF_TIME = 4
+MAX_BACKOFF_TIME = 64
+# Quota exceeded, and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
 
 load_dotenv()
 
+def normalize_query(query):
+    """
+    Normalizes a search query (case and whitespace),
+        so that the same company name always gives the same query.
+    """
+    return " ".join(query.casefold().split())
+
 class GoogleSearchAPI:
     """
     A class that interacts with the Google Custom Search API to perform searches.
+        The search client is built once per thread, so one instance can be shared by several threads.
+
+    Example usage:
+            google = GoogleSearchAPI(rate_limiter=TokenBucket(1, 10), cache=PersistentCache(CACHE_PATH))
+            urls = google.batch_search(["bdx", "ssab"], workers=4)
+
+    :param rate_limiter: a TokenBucket shared by all threads that use the same quota, or None.
+    :param cache: a PersistentCache for the search results, or None.
+        Every (normalized) query is then only sent once, and searches without results are cached as well.
+    :param max_retries: number of times a query is retried when the quota is exceeded
+        (or the service fails), with exponential backoff.
+        A search that still fails returns None, which is never cached.
     """
 
-    def __init__(self):
+    def __init__(self, rate_limiter=None, cache=None, max_retries=MAX_RETRIES):
         self.api_key = os.environ.get('GOOGLE_SEARCH_API_KEY')
         self.search_engine_id = os.environ.get('GOOGLE_SEARCH_ENGINE_ID')
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.max_retries = max_retries
+        self.requests_sent = 0
+        self.cache_hits = 0
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
 
-    def search(self, query, backoff_time=4):
+    def _service(self):
+        """
+        :returns: the search client of the current thread (the clients aren't thread-safe).
+        """
+        if not hasattr(self._local, "service"):
+            self._local.service = build("customsearch", "v1", developerKey=self.api_key, cache_discovery=False)
+        return self._local.service
+
+    def search(self, query, backoff_time=BACKOFF_TIME):
         """
         Performs a search using the Google Custom Search API.
 
         Args:
             query (str): The search query.
+            backoff_time (float): The number of seconds to wait before the first retry.
+                The wait is doubled for every retry, up to MAX_BACKOFF_TIME.
 
         Returns:
-            str: The URL of the first search result.
+            str: The URL of the first search result, "" if there is no result,
+                or None if the search failed (i.e. the quota was still exceeded after all retries).
         """
-        service = build("customsearch", "v1", developerKey=self.api_key)
-        # hl: The language of the search results. gl: The country to search from. lr: The language to return results in. cr: The country to search in.
-        try:
-            res = service.cse().list(q=query, cx=self.search_engine_id, hl="sv", gl="sv", lr="lang_sv", cr="sv", num=1).execute()
-        except HttpError as e:
-            if e.status_code == 429:
-                logging.error("Quota exceeded, backing off and sleeping for %s seconds", backoff_time)
-                time.sleep(backoff_time)
-                backoff_time *= 2
-                return self.search(query, backoff_time)
-            else:
-                logging.error("HttpError %s", e)
-                return ""
-        if "items" in res.keys() and len(res["items"]) > 0:
-            return res["items"][0]["link"]
-        return ""
-    
-    def batch_search(self, query_list: list[str]):
+        query = normalize_query(query)
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key("customsearch", query)
+            cached = self.cache.get(key)
+            if cached is not None:
+                with self._counter_lock:
+                    self.cache_hits += 1
+                return cached.decode("utf-8")
+
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            with self._counter_lock:
+                self.requests_sent += 1
+            # hl: The language of the search results. gl: The country to search from. lr: The language to return results in. cr: The country to search in.
+            try:
+                res = self._service().cse().list(q=query, cx=self.search_engine_id, hl="sv", gl="sv", lr="lang_sv", cr="sv", num=1).execute()
+                break
+            except HttpError as e:
+                if e.status_code not in RETRY_STATUS_CODES:
+                    logging.error("HttpError %s", e)
+                    return None
+                if attempt == self.max_retries:
+                    logging.error("Giving up on %s after %s retries (HttpError %s)", query, self.max_retries, e.status_code)
+                    return None
+                # Full jitter, so that the threads don't retry in lockstep
+                wait = random.uniform(0, min(MAX_BACKOFF_TIME, backoff_time * 2 ** attempt))
+                logging.error("HttpError %s, backing off and sleeping for %.1f seconds", e.status_code, wait)
+                time.sleep(wait)
+
+        url = res["items"][0]["link"] if "items" in res.keys() and len(res["items"]) > 0 else ""
+        if key is not None:
+            self.cache.set(key, url.encode("utf-8"))
+        return url
+
+    def batch_search(self, query_list: list[str], workers: int = 1):
         """
         Performs a batch search using the Google Custom Search API.
 
         Args:
             query_list (list[str]): A list of search queries.
+            workers (int): The number of queries that are sent at the same time.
 
         Returns:
-            list[str]: A list of URLs corresponding to the first search result for each query.
+            list[str]: A list of URLs corresponding to the first search result for each query
+                ("" if there is no result, None if the search failed).
         """
-        results: list[str] = []
-        for query in query_list:
-            results.append(self.search(query))
-        return results
-    
\ No newline at end of file
+        if workers <= 1:
+            return [self.search(query) for query in query_list]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.search, query_list))
@@ -2,6 +2,7 @@
 Methods for abstracting communication with Mongodb
 """
 import os
+import time
 import bson
 from abc import ABC
 from enum import StrEnum
@@ -12,6 +13,8 @@ from definitions import ROOT_DIR
 
 
 BACKUP_PATH = os.path.join(ROOT_DIR, "backup")
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 5.0
 load_dotenv(os.path.join(ROOT_DIR, '.env'), override=True)
 
 class Schema(StrEnum):
@@ -33,6 +36,7 @@ class Schema(StrEnum):
     DEV_SET         = "dev_set"
     TRAIN_SET       = "train_set"
     TEST_SET        = "test_set"
+    SNI_PROGRESS    = "sni_progress"
 
 def get_client():
     """
@@ -90,3 +94,81 @@ class DBInterface(ABC):
         """
         if self.mongo_client[Schema.DB][collection].count_documents({}) == 0:
             callback()
+
+class BulkWriter():
+    """
+    Buffers write operations for a collection and sends them in unordered bulk_write batches,
+        instead of one round trip per operation. The buffer is flushed when it holds batch_size
+        operations, when an operation is added more than flush_interval seconds after the
+        last flush, and when the writer is closed (or the with-block is exited).
+
+    Example usage:
+            ```
+            with BulkWriter(collection) as writer:
+                writer.add(UpdateOne({'_id': id}, {'$set': {'url': url}}))
+            ```
+    """
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        :param collection: a pymongo Collection.
+        :param batch_size: number of buffered operations that triggers a flush.
+        :param flush_interval: maximum number of seconds between flushes (checked when adding).
+        """
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.round_trips = 0
+        self.written = 0
+        self._operations = []
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        """
+        :returns: the number of buffered writes.
+        """
+        return len(self._operations)
+
+    def add(self, operation):
+        """
+        Buffers a write operation.
+        :param operation: a pymongo write operation (InsertOne, UpdateOne, DeleteOne, ...).
+        """
+        self._operations.append(operation)
+        self._flush_if_due()
+
+    def flush(self):
+        """
+        Sends the buffered operations to the database.
+        """
+        written = len(self)
+        operations = self._drain()
+        self._last_flush = time.monotonic()
+        if not operations:
+            return
+        self.collection.bulk_write(operations, ordered=False)
+        self.round_trips += 1
+        self.written += written
+
+    def close(self):
+        """
+        Flushes the remaining operations.
+        """
+        self.flush()
+
+    def _flush_if_due(self):
+        if len(self) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _drain(self):
+        """
+        Empties the buffer.
+        :returns: the list of operations to send.
+        """
+        operations, self._operations = self._operations, []
+        return operations
@@ -0,0 +1,288 @@
+"""
+Storage backends for scraped pages.
+"""
+import os
+import json
+import gzip
+import zlib
+import logging
+from abc import ABC, abstractmethod
+from enum import StrEnum
+from pathlib import Path
+
+SHARD_PREFIX = "pages-"
+SHARD_SUFFIX = ".jsonl.gz"
+DEFAULT_SHARD_SIZE = 64 * 1024 * 1024
+READ_SIZE = 64 * 1024
+# The start of a gzip member header (magic number and the deflate method)
+GZIP_HEADER = b"\x1f\x8b\x08"
+
+class StorageFormat(StrEnum):
+    """
+    The available page storage formats.
+    """
+    JSON    = "json"
+    SHARDED = "sharded"
+
+class PageStore(ABC):
+    """
+    Abstract class for storing scraped pages in a folder.
+        Every saved page gets a location (a string), which can be stored
+        (i.e. in the crawl manifest) and used to read the page back.
+    """
+    def __init__(self, folder):
+        """
+        :param folder: the folder that holds the pages.
+        """
+        self.folder = folder
+
+    @abstractmethod
+    def save(self, data, name):
+        """
+        Saves a page.
+        :param data: a dictionary {'label':..., 'url':..., 'raw_html':...}
+        :param name: a suggested name for the page (without extension).
+        :returns: the location of the saved page.
+        """
+
+    @abstractmethod
+    def read(self, location):
+        """
+        Reads a single page.
+        :param location: a location returned by save.
+        :returns: a dictionary {'label':..., 'url':..., 'raw_html':...}
+        """
+
+    @abstractmethod
+    def __iter__(self):
+        """
+        Sequentially reads all pages.
+        :returns: a generator of (location, data) tuples.
+        """
+
+    @abstractmethod
+    def remove(self, locations):
+        """
+        Removes pages.
+        :param locations: a set of locations to remove.
+        :returns: a dictionary {old location: new location} for the pages that were moved.
+        """
+
+    def close(self):
+        """
+        Closes any open files.
+        """
+
+class JSONPageStore(PageStore):
+    """
+    Stores every page in its own json file, named {name}.json.
+    """
+    def save(self, data, name):
+        Path(self.folder).mkdir(parents=True, exist_ok=True)
+        filename = f"{name}.json"
+        # Pages with the same name (i.e. same domain and second) get a counter
+        n = 1
+        while os.path.exists(os.path.join(self.folder, filename)):
+            filename = f"{name}_{n}.json"
+            n += 1
+        with open(os.path.join(self.folder, filename), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        return filename
+
+    def read(self, location):
+        with open(os.path.join(self.folder, location), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def __iter__(self):
+        for file_path in sorted(Path(self.folder).glob('*.json')):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                yield file_path.name, json.load(f)
+
+    def remove(self, locations):
+        for location in locations:
+            Path(self.folder, location).unlink(missing_ok=True)
+        return {}
+
+class ShardedPageStore(PageStore):
+    """
+    Appends pages as gzip-compressed json lines to rolling shard files
+        (pages-00000.jsonl.gz, pages-00001.jsonl.gz, ...).
+        Every page is its own gzip member, so a shard can be read sequentially
+        with any gzip reader, and a single page can be read with a seek,
+        using the location "{shard}:{offset}:{length}".
+
+        A corrupt member is skipped when the shards are read, and a truncated member
+        at the end of the last shard (i.e. after a crash) is cut off before more pages are appended.
+    """
+    def __init__(self, folder, shard_size=DEFAULT_SHARD_SIZE):
+        """
+        :param folder: the folder that holds the shards.
+        :param shard_size: a new shard is started when the current one exceeds this many bytes.
+        """
+        super().__init__(folder)
+        self.shard_size = shard_size
+        self._file = None
+        self._shard = None
+
+    def _shards(self):
+        return sorted(Path(self.folder).glob(f'{SHARD_PREFIX}*{SHARD_SUFFIX}'))
+
+    def _open_shard(self):
+        """
+        Opens the last shard for appending, or starts a new one if it is full.
+        """
+        Path(self.folder).mkdir(parents=True, exist_ok=True)
+        shards = self._shards()
+        if shards and shards[-1].stat().st_size < self.shard_size:
+            shard = shards[-1].name
+            _truncate_tail(shards[-1])
+        else:
+            number = int(shards[-1].name[len(SHARD_PREFIX):-len(SHARD_SUFFIX)]) + 1 if shards else 0
+            shard = f"{SHARD_PREFIX}{number:05d}{SHARD_SUFFIX}"
+        self._shard = shard
+        self._file = open(os.path.join(self.folder, shard), 'ab')
+
+    def save(self, data, name):
+        if self._file is None or self._file.tell() >= self.shard_size:
+            self.close()
+            self._open_shard()
+        record = gzip.compress((json.dumps(data, ensure_ascii=False) + "\n").encode('utf-8'))
+        offset = self._file.tell()
+        self._file.write(record)
+        self._file.flush()
+        return f"{self._shard}:{offset}:{len(record)}"
+
+    def read(self, location):
+        shard, offset, length = location.rsplit(':', 2)
+        with open(os.path.join(self.folder, shard), 'rb') as f:
+            f.seek(int(offset))
+            return json.loads(gzip.decompress(f.read(int(length))))
+
+    def __iter__(self):
+        for shard in self._shards():
+            with open(shard, 'rb') as f:
+                for offset, length, line in _gzip_members(f, shard.name):
+                    yield f"{shard.name}:{offset}:{length}", json.loads(line)
+
+    def remove(self, locations):
+        """
+        Rewrites every shard that contains a removed page (corrupt records are dropped).
+        """
+        self.close()
+        by_shard = {}
+        for location in locations:
+            shard, offset, _ = location.rsplit(':', 2)
+            by_shard.setdefault(shard, set()).add(int(offset))
+
+        moved = {}
+        for shard, offsets in by_shard.items():
+            path = Path(self.folder, shard)
+            if not path.exists():
+                continue
+            tmp_path = path.with_name(path.name + ".tmp")
+            with open(path, 'rb') as f, open(path, 'rb') as source, open(tmp_path, 'wb') as out:
+                for offset, length, _ in _gzip_members(f, shard):
+                    if offset not in offsets:
+                        moved[f"{shard}:{offset}:{length}"] = f"{shard}:{out.tell()}:{length}"
+                        source.seek(offset)
+                        out.write(source.read(length))
+            os.replace(tmp_path, path)
+        return moved
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def _gzip_members(f, name):
+    """
+    Reads the concatenated gzip members of a shard, READ_SIZE bytes at a time.
+        A corrupt or truncated member is logged and skipped,
+        and reading continues at the next gzip header after it.
+    :param f: the shard, opened for reading in binary mode.
+    :param name: the name of the shard (for the log).
+    :returns: a generator of (offset, length, decompressed data) tuples.
+    """
+    offset = 0
+    block = f.read(READ_SIZE)
+    while block:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        chunks = []
+        length = 0
+        try:
+            while True:
+                chunks.append(decompressor.decompress(block))
+                if decompressor.eof:
+                    length += len(block) - len(decompressor.unused_data)
+                    block = decompressor.unused_data
+                    break
+                length += len(block)
+                block = f.read(READ_SIZE)
+                if not block:
+                    raise EOFError("the record is truncated")
+        except (zlib.error, EOFError) as e:
+            next_offset = _next_gzip_header(f, offset + 1)
+            if next_offset is None:
+                logging.error("Skipped a corrupt record at the end of %s, at offset %s: %s", name, offset, e)
+                return
+            logging.error("Skipped a corrupt record in %s, at offset %s (%s bytes): %s", name, offset, next_offset - offset, e)
+            offset = next_offset
+            f.seek(offset)
+            block = f.read(READ_SIZE)
+            continue
+        yield offset, length, b"".join(chunks)
+        offset += length
+        if not block:
+            block = f.read(READ_SIZE)
+
+def _next_gzip_header(f, start):
+    """
+    :returns: the offset of the next gzip header in a file, from start, or None if there is none.
+    """
+    f.seek(start)
+    position = start
+    # The end of the previous block, in case a header is split between two blocks
+    tail = b""
+    while block := f.read(READ_SIZE):
+        index = (tail + block).find(GZIP_HEADER)
+        if index >= 0:
+            return position - len(tail) + index
+        tail = block[-(len(GZIP_HEADER) - 1):]
+        position += len(block)
+    return None
+
+def _truncate_tail(path):
+    """
+    Cuts off anything after the last complete gzip member of a shard,
+        i.e. a record that was only partly written when the crawler crashed.
+    """
+    with open(path, 'r+b') as f:
+        end = 0
+        for offset, length, _ in _gzip_members(f, path.name):
+            end = offset + length
+        size = f.seek(0, os.SEEK_END)
+        if end < size:
+            logging.warning("Truncated %s bytes of incomplete records at the end of %s", size - end, path.name)
+            f.truncate(end)
+
+def open_page_store(folder, storage_format=StorageFormat.JSON):
+    """
+    Creates a page store.
+    :param folder: the folder that holds the pages.
+    :param storage_format: a StorageFormat (or its string value).
+    :returns: a PageStore.
+    """
+    match StorageFormat(storage_format):
+        case StorageFormat.SHARDED:
+            return ShardedPageStore(folder)
+        case _:
+            return JSONPageStore(folder)
+
+def read_pages(folder):
+    """
+    Sequentially reads all pages in a folder, regardless of their storage format.
+    :param folder: the folder that holds the pages.
+    :returns: a generator of (location, data) tuples.
+    """
+    for storage_format in StorageFormat:
+        yield from open_page_store(folder, storage_format)
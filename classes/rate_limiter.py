@@ -0,0 +1,48 @@
+"""
+A thread-safe token bucket, for staying inside API quotas with concurrent workers.
+"""
+import time
+import threading
+
+class TokenBucket():
+    """
+    Allows on average `rate` requests per second, with bursts of up to `capacity` requests.
+        The bucket is shared between threads: every request takes a token,
+        and blocks until one is available.
+
+    Example usage:
+            bucket = TokenBucket(rate=2, capacity=10)
+            bucket.acquire()    # Blocks until the request is allowed
+            requests.get(...)
+    """
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate: number of tokens added per second.
+        :param capacity: maximum number of tokens (the largest burst).
+        """
+        if rate <= 0:
+            raise ValueError("The rate must be positive")
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.waited = 0.0
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Takes tokens from the bucket, waiting until enough tokens are available.
+        :param tokens: number of tokens to take (at most the capacity).
+        """
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
@@ -7,11 +7,14 @@ import logging
 import copy
 import json
 from dotenv import load_dotenv
-from requests import Session
+from requests import Response, Session
 from requests_pkcs12 import Pkcs12Adapter
 from definitions import ROOT_DIR
 
 CERT_PATH = os.path.join(ROOT_DIR, "key.pfx")
+CACHE_PATH = os.path.join(ROOT_DIR, "cache", "scb_responses.sqlite")
+CACHE_TTL = 30 * 24 * 3600
+CACHE_MAX_ENTRIES = 1_000_000
 
 load_dotenv(os.path.join(ROOT_DIR, '.env'))
 
@@ -41,11 +44,18 @@ class SCBapi():
     ```
     
     :param cert_path: the path to the certificate file.
+    :param rate_limiter: a TokenBucket shared by all wrappers that use the same quota, or None.
+    :param cache: a PersistentCache for the responses to POST requests (count and fetch), or None.
+        Requests with the same address and body are then only sent once (per TTL).
     """
-    def __init__(self, cert_path=CERT_PATH) -> None:
+    def __init__(self, cert_path=CERT_PATH, rate_limiter=None, cache=None) -> None:
         self.api_base = 'https://privateapi.scb.se/nv0101/v1/sokpavar'
         self.api_pass = os.getenv("SCB_API_PASS")
         self.cert_path = cert_path
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.requests_sent = 0
+        self.cache_hits = 0
         self.owned_vars_from_api = {}
         self.variables_from_api = {}
         self.operator_map = {
@@ -377,7 +387,18 @@ class SCBapi():
         :param retries: the number of retries to be made if the request fails.
         :returns: a response object
         """
-        
+        key = None
+        if body is not None and self.cache is not None:
+            key = self.cache.make_key(r_address, body)
+            content = self.cache.get(key)
+            if content is not None:
+                self.cache_hits += 1
+                return self._cached_response(r_address, content)
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        self.requests_sent += 1
         if (body is None):   
             r = self.session.get(f'{self.api_base}/{r_address}') # En request
         else :
@@ -394,9 +415,26 @@ class SCBapi():
             logging.error("Retrying request...")
             self.get_session()
             r = self.fetch_data(r_address, body=body, retries=(retries - 1))
+        elif key is not None:
+            self.cache.set(key, r.content)
         
         return r
 
+    def _cached_response(self, r_address, content):
+        """
+        Creates a response object from a cached response body.
+
+        :param r_address: the suffix of the address of the request.
+        :param content: the cached body (bytes).
+        :returns: a response object
+        """
+        r = Response()
+        r.status_code = 200
+        r.url = f'{self.api_base}/{r_address}'
+        r.encoding = 'utf-8'
+        r._content = content
+        return r
+
     def _post_request(self, r_address, body):
         """
         Method for creating a POST request against SCB API.
@@ -1,33 +1,150 @@
 """
 """
+import asyncio
+import codecs
+import re
 import requests
 import json
 import os
+import time
+import aiohttp
 import tldextract
+from collections import defaultdict, deque
 from datetime import datetime
 import logging
 import tempfile
-from urllib.parse import urlparse
-from requests_html import HTMLSession
+from itertools import chain, islice
+from urllib.parse import urlparse, urljoin
+from lxml import html as lxml_html
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from classes.crawl_manifest import CrawlManifest, CrawlStatus, MANIFEST_FILENAME
+from classes.crawl_stats import CrawlStats
+from classes.page_store import StorageFormat, open_page_store, read_pages
+
+# Number of start urls that are read (and queued in the manifest) at a time
+FRONTIER_BATCH_SIZE = 1000
+# Number of kept-alive connections per host, and number of hosts that the synchronous session keeps pools for
+POOL_SIZE = 10
+POOL_HOSTS = 100
+# Number of seconds that resolved host names are cached by the concurrent crawler
+DNS_CACHE_TTL = 300
+# Downloads are aborted past MAX_PAGE_BYTES (decoded) bytes,
+# after CONNECT_TIMEOUT seconds without a connection, READ_TIMEOUT seconds without data,
+# or DOWNLOAD_TIMEOUT seconds in total
+MAX_PAGE_BYTES = 5 * 1024 * 1024
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+DOWNLOAD_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+HTML_CONTENT_TYPES = {"text/html", "application/xhtml+xml"}
+BINARY_EXTENSIONS = {".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".ico", ".mp3", ".mp4",
+                     ".avi", ".mov", ".zip", ".gz", ".rar", ".7z", ".exe", ".dmg", ".iso",
+                     ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx"}
+
+# Where a page declares its encoding, if the Content-Type header doesn't (i.e. <meta charset="utf-8">)
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+META_CHARSET_BYTES = 2048
+
+class PageRejected(Exception):
+    """
+    A page that isn't downloaded (or whose download is aborted), with the reason:
+        "binary_extension", "not_html", "too_large" or "timeout".
+    """
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+def _decode_body(body, charset=None):
+    """
+    Decodes a downloaded page with the charset of its Content-Type header,
+        or the charset that the page declares in a meta tag, or else as utf-8.
+        Bytes that can't be decoded are replaced.
+    :param body: the page (bytes).
+    :param charset: the charset of the Content-Type header, or None.
+    """
+    for encoding in (charset, _meta_charset(body)):
+        if encoding:
+            try:
+                return body.decode(codecs.lookup(encoding).name, errors='replace')
+            except LookupError:
+                continue
+    return body.decode('utf-8', errors='replace')
+
+def _header_charset(content_type):
+    """
+    :returns: the charset of a Content-Type header (i.e. "text/html; charset=utf-8"), or None.
+    """
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset":
+            return value.strip().strip('"\'') or None
+    return None
+
+def _meta_charset(body):
+    """
+    :returns: the charset declared in a meta tag at the start of a page, or None.
+    """
+    match = META_CHARSET.search(body, 0, META_CHARSET_BYTES)
+    return match.group(1).decode('ascii') if match else None
+
+def _accept_encoding():
+    """
+    :returns: the content encodings that the http clients can decode
+        (brotli needs the optional brotli package).
+    """
+    try:
+        import brotli  # noqa: F401
+        return "gzip, deflate, br"
+    except ImportError:
+        return "gzip, deflate"
 
 class Scraper():
     """
-    A simple synchronous crawler that crawls sites while propagating labels,
-        and saves the results to json files.
+    A simple crawler that crawls sites while propagating labels,
+        and saves the results to json files (or compressed shards, see page_store).
+        Sites can either be crawled synchronously (scrape_all)
+        or concurrently with asyncio (scrape_all_async).
+        Every queued, saved or failed url is recorded in a manifest
+        (scrape_output_folder/manifest.sqlite), so an interrupted crawl
+        resumes without re-reading the scraped files.
     Can also scrape single pages and save them as temporary files.
     Example usage:
             scraper = SimpleScraper(['http://bdx.se','http://ssab.se'])
             scraper.scrape_all()
     """
-    def __init__(self, scrape_output_folder):
+    def __init__(self, scrape_output_folder, storage_format=StorageFormat.JSON,
+                 pool_size=POOL_SIZE, dns_cache_ttl=DNS_CACHE_TTL, max_page_bytes=MAX_PAGE_BYTES,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, download_timeout=DOWNLOAD_TIMEOUT):
         """
         :param scrape_output_folder: where to save scraped sites
+        :param storage_format: "json" for one file per page,
+            or "sharded" for gzip-compressed shards.
+        :param pool_size: number of connections per host that are kept alive and reused,
+            or 0 to open a new connection for every request.
+        :param dns_cache_ttl: number of seconds that resolved host names are cached
+            by the concurrent crawler (the synchronous crawler reuses its connections instead).
+        :param max_page_bytes: pages larger than this are rejected (or their download is aborted).
+        :param connect_timeout: maximum number of seconds to wait for a connection.
+        :param read_timeout: maximum number of seconds to wait for the next data from the server.
+        :param download_timeout: maximum number of seconds that a download may take in total.
         """
         self.scrape_output_folder = scrape_output_folder
-        self.urls = []
+        self.store = open_page_store(scrape_output_folder, storage_format)
+        self.urls = deque()
         self.follow_queries = {"/om", "/about"}
-        self.headers = {"Accept-Language": "sv-SE,sv;"}
+        self.headers = {"Accept-Language": "sv-SE,sv;", "Accept-Encoding": _accept_encoding()}
+        if pool_size <= 0:
+            self.headers["Connection"] = "close"
+        self.pool_size = pool_size
+        self.dns_cache_ttl = dns_cache_ttl
+        self.max_page_bytes = max_page_bytes
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.download_timeout = download_timeout
+        self.stats = CrawlStats()
+        self.session = self._create_session()
         self.filter = {"/en/", "/en-US", "/en-GB", "lang=en", "in-english", ".pdf", ".jpg", ".png",
                        ".jpeg", ".gif", ".svg", ".doc", ".docx", ".ppt", ".pptx",
                        "cookie-","cookies", "integritet","privacy", "policy", "terms",
@@ -54,25 +171,19 @@ class Scraper():
                        "gdpr"
                        }
         self.already_scraped = set()
+        self.manifest = None
 
     def scrape_all(self, labeled_urls, follow_links=False, filter_=False):
         """
         Crawls all urls from start_urls and saves each page in a json file.
-        :param labled_urls: a dictionary 
+        :param labeled_urls: an iterable (i.e. a generator) of dictionaries {'label':..., 'url':...}
         """
-        self.urls = [
-            {
-                "label":item['label'], 
-                "url": item['url'], 
-                "depth": 0
-            } 
-                for item in labeled_urls]
+        frontier = self._init_frontier(labeled_urls)
 
-        self._get_already_scraped()
-
-        for url in self.urls:
+        for url in frontier:
             if filter_:
                 if self._check_filter(url):
+                    self.manifest.update(url, CrawlStatus.FILTERED)
                     continue
 
             if url['url'] in self.already_scraped:
@@ -81,31 +192,157 @@ class Scraper():
 
             logging.debug('Scraping %s', url['url'])
             try:
-                request = self._request(url['url'])
+                text, final_url = self._request(url['url'])
             except Exception as e:
-                logging.error('Failed to fetch %s: %s', url['url'], e)
+                self._fetch_failed(url, e)
                 continue
 
-            tld_extractor = tldextract.extract(url['url'])
-            domain = f"{tld_extractor.domain}.{tld_extractor.suffix}"
-            data = {'label':url['label'],'url':url['url'], 'raw_html':request.text}
-            timestamp = datetime.now().strftime('%Y-%m-%dT%H%M%S')
-            self._save_to_json(data, f"{tld_extractor.domain}_{tld_extractor.suffix}_{timestamp}.json")
+            domain = self._save_page(url, text)
 
             if url["depth"] < 1 and follow_links:
-                self._follow_links(request, domain, url)
+                self.urls.extend(self._follow_links(text, final_url, domain, url))
+
+        self.stats.log()
+        self.store.close()
+        self.manifest.close()
+
+    def scrape_all_async(self, labeled_urls, follow_links=False, filter_=False,
+                         max_concurrency=50, per_domain_limit=2):
+        """
+        Crawls all urls from start_urls concurrently and saves each page in a json file.
+            Behaves like scrape_all (same labels, depth, dedup and output files),
+            but keeps up to max_concurrency requests in flight at the same time.
+        :param labeled_urls: an iterable (i.e. a generator) of dictionaries {'label':..., 'url':...}
+        :param follow_links: if True, follows the follow_queries links on the start pages.
+        :param filter_: if True, skips urls that match the filter.
+        :param max_concurrency: maximum number of requests in flight in total.
+        :param per_domain_limit: maximum number of requests in flight per domain.
+        """
+        frontier = self._init_frontier(labeled_urls)
+
+        start = time.perf_counter()
+        scraped = asyncio.run(self._crawl(frontier, follow_links, filter_, max_concurrency, per_domain_limit))
+        elapsed = time.perf_counter() - start
+        logging.info("Scraped %s pages in %.1f seconds (%.2f pages/s)",
+                     scraped, elapsed, scraped / elapsed if elapsed > 0 else 0)
+        self.stats.log()
+        self.store.close()
+        self.manifest.close()
+
+    async def _crawl(self, frontier, follow_links, filter_, max_concurrency, per_domain_limit):
+        """
+        Runs max_concurrency workers over a shared queue of urls.
+            The frontier is read lazily: at most 2 * max_concurrency of its urls are queued at a time,
+            while the followed links are queued as soon as they are found.
+            Reading the frontier blocks (on the start urls, i.e. a MongoDB cursor, and the manifest),
+            so it is advanced in a thread instead of on the event loop.
+        :returns: the number of saved pages.
+        """
+        queue = asyncio.Queue()
+        slots = asyncio.Semaphore(2 * max_concurrency)
+
+        domain_limits = defaultdict(lambda: asyncio.Semaphore(per_domain_limit))
+        in_flight = set()
+        scraped = [0]
+
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+        connector = aiohttp.TCPConnector(
+            limit=max_concurrency,
+            limit_per_host=self.pool_size if self.pool_size > 0 else 0,
+            force_close=self.pool_size <= 0,
+            use_dns_cache=self.dns_cache_ttl > 0,
+            ttl_dns_cache=self.dns_cache_ttl if self.dns_cache_ttl > 0 else None)
+        async with aiohttp.ClientSession(headers=self.headers, timeout=timeout, connector=connector,
+                                         trace_configs=[self.stats.trace_config()]) as session:
+            workers = [
+                asyncio.create_task(self._crawl_worker(
+                    session, queue, slots, domain_limits, in_flight, scraped, follow_links, filter_))
+                for _ in range(max_concurrency)]
+            while (url := await asyncio.to_thread(next, frontier, None)) is not None:
+                await slots.acquire()
+                queue.put_nowait((url, True))
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return scraped[0]
+
+    async def _crawl_worker(self, session, queue, slots, domain_limits, in_flight, scraped, follow_links, filter_):
+        """
+        Fetches urls from the queue until cancelled.
+            Urls that were read from the frontier free a slot for the next one when they are done.
+        """
+        while True:
+            url, from_frontier = await queue.get()
+            try:
+                await self._crawl_one(session, queue, domain_limits, in_flight, scraped, url, follow_links, filter_)
+            finally:
+                if from_frontier:
+                    slots.release()
+                queue.task_done()
+
+    async def _crawl_one(self, session, queue, domain_limits, in_flight, scraped, url, follow_links, filter_):
+        """
+        Fetches, saves and (optionally) follows the links of a single url.
+        """
+        if filter_:
+            if self._check_filter(url):
+                self.manifest.update(url, CrawlStatus.FILTERED)
+                return
+
+        if url['url'] in self.already_scraped or url['url'] in in_flight:
+            logging.debug("Already scraped %s", url['url'])
+            return
+        in_flight.add(url['url'])
+
+        tld_extractor = tldextract.extract(url['url'])
+        domain = f"{tld_extractor.domain}.{tld_extractor.suffix}"
+
+        logging.debug('Scraping %s', url['url'])
+        try:
+            self._check_extension(url['url'])
+            async with domain_limits[domain]:
+                deadline = asyncio.timeout(self.download_timeout)
+                try:
+                    async with deadline:
+                        async with session.get(url['url']) as response:
+                            self._check_headers(response.headers)
+                            body = bytearray()
+                            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                                body += chunk
+                                self._check_size(len(body))
+                            # The body was streamed, so aiohttp can't guess its encoding (get_encoding raises)
+                            text = _decode_body(bytes(body), response.charset)
+                            final_url = str(response.url)
+                except TimeoutError as e:
+                    if deadline.expired():
+                        raise PageRejected("timeout", f"The download took longer than {self.download_timeout} seconds") from e
+                    raise
+        except Exception as e:
+            self._fetch_failed(url, e)
+            in_flight.discard(url['url'])
+            return
+
+        self._save_page(url, text)
+        in_flight.discard(url['url'])
+        scraped[0] += 1
+
+        if url["depth"] < 1 and follow_links:
+            found = await asyncio.to_thread(self._follow_links, text, final_url, domain, url)
+            for link in found:
+                queue.put_nowait((link, False))
 
     def scrape_one(self, url):
         """
         Scrapes one url and saves the page in a temp json file.
         """
         try:
-            request = self._request(url)
+            text, _ = self._request(url)
         except Exception as e:
             logging.error('Failed to fetch %s: %s', url, e)
             return
 
-        data = {'url':url, 'raw_html':request.text}
+        data = {'url':url, 'raw_html':text}
 
         with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False, encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False)
@@ -117,25 +354,125 @@ class Scraper():
         """
         Removes all data from the scrape_output_folder folder that contains any of the filter words.
         """
-        path = Path(self.scrape_output_folder)
-        for filename in Path.iterdir(path):
-            with open(Path(path, filename), 'r', encoding='utf-8') as fd:
-                f = json.load(fd)
-                if self._check_filter(f):
-                    f.close()
-                    filename.unlink()
+        removed = {}
+        for location, data in self.store:
+            if self._check_filter(data):
+                removed[location] = data['url']
+        moved = self.store.remove(set(removed))
 
-    def _save_to_json(self, data, filename):
-        logging.info('Saving scraped data from %s', data['url'])
-        Path(self.scrape_output_folder).mkdir(parents=True, exist_ok=True)
-        full_path = os.path.join(self.scrape_output_folder,filename)
-        with open(full_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False)
-            self.already_scraped.add(data['url'])
+        manifest = CrawlManifest(os.path.join(self.scrape_output_folder, MANIFEST_FILENAME))
+        manifest.set_status(removed.values(), CrawlStatus.FILTERED)
+        manifest.relocate(moved)
+        manifest.close()
+        logging.info("Pruned %s pages", len(removed))
+
+    def _save_page(self, url, raw_html):
+        """
+        Saves a scraped page in the page store,
+            as {domain}_{suffix}_{timestamp}.json if the store is json-based.
+        :param url: a dictionary {'label':..., 'url':..., 'depth':...}
+        :param raw_html: the downloaded page.
+        :returns: the registered domain of the url.
+        """
+        logging.info('Saving scraped data from %s', url['url'])
+        tld_extractor = tldextract.extract(url['url'])
+        data = {'label':url['label'],'url':url['url'], 'raw_html':raw_html}
+        timestamp = datetime.now().strftime('%Y-%m-%dT%H%M%S')
+        location = self.store.save(data, f"{tld_extractor.domain}_{tld_extractor.suffix}_{timestamp}")
+        self.already_scraped.add(url['url'])
+        if self.manifest is not None:
+            self.manifest.update(url, CrawlStatus.SCRAPED, location)
+        return f"{tld_extractor.domain}.{tld_extractor.suffix}"
+
+    def _create_session(self):
+        """
+        Creates the session of the synchronous crawler, which keeps up to pool_size
+            connections alive per host (for POOL_HOSTS hosts) and reports to self.stats.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=max(1, self.pool_size))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(self.headers)
+        session.hooks["response"].append(self.stats.session_hook)
+        return session
 
     def _request(self, url):
-        r = requests.get(url, timeout=5, headers=self.headers)
-        return r
+        """
+        Downloads a page, streaming the body so that non-HTML pages are rejected
+            from their headers, and downloads that grow past max_page_bytes
+            or take longer than download_timeout are aborted.
+
+            The body is read with a single socket read at a time (read1), with the socket timeout
+            lowered to the time that is left of download_timeout, so a server that sends
+            a byte at a time can't keep the download going past the deadline.
+        :raises PageRejected: if the page is rejected (or its download is aborted).
+        :returns: the page, decoded like the concurrent crawler does (see _decode_body),
+            and its url after redirects.
+        """
+        self._check_extension(url)
+        deadline = time.monotonic() + self.download_timeout
+        with self.session.get(url, timeout=(self.connect_timeout, self.read_timeout), stream=True) as r:
+            self._check_headers(r.headers)
+            connection = r.raw.connection
+            body = bytearray()
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PageRejected("timeout", f"The download took longer than {self.download_timeout} seconds")
+                    if connection is not None and connection.sock is not None:
+                        connection.sock.settimeout(min(self.read_timeout, remaining))
+                    chunk = r.raw.read1(CHUNK_SIZE, decode_content=True)
+                    if not chunk:
+                        break
+                    body += chunk
+                    self._check_size(len(body))
+            except ReadTimeoutError as e:
+                raise PageRejected("timeout", str(e)) from e
+            text = _decode_body(bytes(body), _header_charset(r.headers.get("Content-Type", "")))
+        return text, r.url
+
+    def _check_extension(self, url):
+        """
+        :raises PageRejected: if the url points to a binary file, judging by its extension.
+        """
+        if os.path.splitext(urlparse(url).path)[1].lower() in BINARY_EXTENSIONS:
+            raise PageRejected("binary_extension", "The url points to a binary file")
+
+    def _check_headers(self, headers):
+        """
+        Rejects a page from its response headers, before the body is read.
+        :raises PageRejected: if the page isn't HTML, or is announced to be larger than max_page_bytes.
+        """
+        content_type = headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type and content_type not in HTML_CONTENT_TYPES:
+            raise PageRejected("not_html", f"The content type is {content_type}")
+        content_length = headers.get("Content-Length", "")
+        if content_length.isdigit() and int(content_length) > self.max_page_bytes:
+            raise PageRejected("too_large", f"The page is {content_length} bytes")
+
+    def _check_size(self, size):
+        """
+        :raises PageRejected: if more than max_page_bytes have been downloaded.
+        """
+        if size > self.max_page_bytes:
+            raise PageRejected("too_large", f"The page is larger than {self.max_page_bytes} bytes")
+
+    def _fetch_failed(self, url, e):
+        """
+        Records a page that was rejected or couldn't be fetched, in the manifest and the crawl stats.
+        :param url: a dictionary {'label':..., 'url':..., 'depth':...}
+        :param e: the exception that stopped the download.
+        """
+        if isinstance(e, PageRejected):
+            logging.info('Rejected %s: %s', url['url'], e)
+            self.manifest.update(url, CrawlStatus.REJECTED)
+            self.stats.record_failure(e.reason)
+        else:
+            logging.error('Failed to fetch %s: %s', url['url'], e)
+            self.manifest.update(url, CrawlStatus.FAILED)
+            self.stats.record_failure("timeout" if isinstance(e, (requests.Timeout, TimeoutError)) else "error")
     
     def _check_filter(self, url):
         for filter_ in self.filter:
@@ -144,22 +481,81 @@ class Scraper():
                 return True
         return False
     
+    def _init_frontier(self, labeled_urls):
+        """
+        Opens the manifest and loads the already scraped urls.
+        :param labeled_urls: an iterable of dictionaries {'label':..., 'url':...}
+        :returns: a generator over the frontier (see _frontier).
+        """
+        Path(self.scrape_output_folder).mkdir(parents=True, exist_ok=True)
+        self.manifest = CrawlManifest(os.path.join(self.scrape_output_folder, MANIFEST_FILENAME))
+        self._get_already_scraped()
+        self.urls = deque()
+        return self._frontier(labeled_urls, self.manifest.last_rowid())
+
+    def _frontier(self, labeled_urls, resume_until):
+        """
+        Yields the start urls, which are read (and queued in the manifest) FRONTIER_BATCH_SIZE at a time,
+            followed by the urls that a previous (interrupted) crawl queued but never fetched.
+            The links in self.urls (found while crawling) are yielded as soon as they are added.
+        :param labeled_urls: an iterable of dictionaries {'label':..., 'url':...}
+        :param resume_until: the last rowid of the manifest before this crawl started.
+        """
+        def start_urls():
+            labeled_urls_iter = iter(labeled_urls)
+            while batch := [
+                {
+                    "label":item['label'], 
+                    "url": item['url'], 
+                    "depth": 0
+                } 
+                    for item in islice(labeled_urls_iter, FRONTIER_BATCH_SIZE)]:
+                self.manifest.queue(batch)
+                yield from batch
+
+        def resumed():
+            # The start urls have been crawled by now, so the urls that are
+            # still queued from before this crawl are the ones to resume
+            urls = self.manifest.frontier(until=resume_until)
+            if urls:
+                logging.info("Resuming %s queued urls from the previous crawl", len(urls))
+            yield from urls
+
+        for url in chain(start_urls(), resumed()):
+            yield url
+            while self.urls:
+                yield self.urls.popleft()
+
     def _get_already_scraped(self):
         """
-        Fetches all already scraped urls and returns them as a set.
+        Fetches all already scraped urls from the manifest and adds them to already_scraped.
+            Folders scraped before the manifest existed are indexed once, by reading every file.
+        """
+        if len(self.manifest) == 0:
+            self._index_scraped_files()
+        self.already_scraped |= self.manifest.urls(CrawlStatus.SCRAPED)
+        logging.info("Loaded %s already scraped urls from the manifest", len(self.already_scraped))
+
+    def _index_scraped_files(self):
+        """
+        Adds every page in scrape_output_folder (in any storage format) to the manifest.
         """
-        path = Path(self.scrape_output_folder)
-        for file_path in Path.iterdir(path):
-            with open(Path(file_path), 'r', encoding='utf-8') as f:
-                self.already_scraped.add(json.load(f)['url'])
-                logging.debug("Added %s to already_scraped", file_path)
+        for location, data in read_pages(self.scrape_output_folder):
+            self.manifest.update(
+                {'label': data.get('label'), 'url': data['url'], 'depth': None},
+                CrawlStatus.SCRAPED, location)
+            logging.debug("Added %s to the manifest", location)
 
-    def _follow_links(self, request, domain, url):
+    def _follow_links(self, raw_html, page_url, domain, url):
         """
-        Follows all links on a page and adds them to urls if they match the follow_queries.
+        Follows all links on a page and queues them in the manifest if they match the follow_queries.
+        :param raw_html: the already downloaded page.
+        :param page_url: the (final) url of the fetched page.
+        :returns: a list of the newly found urls.
         """
-        links = self._find_all_links(request)
+        links = self._find_all_links(raw_html, page_url)
         already_found = set()
+        found = []
         for link in links:
             tld_extractor = tldextract.extract(link)
             link_domain = f"{tld_extractor.domain}.{tld_extractor.suffix}"
@@ -167,19 +563,36 @@ class Scraper():
             for query in self.follow_queries:
                 if  (query in urlparse(link).path) and (link_domain == domain) and (link not in already_found) and (link not in self.already_scraped) and (link != url['url']):
                     logging.debug('Found link: %s', link)
-                    self.urls.append({'label':url['label'],'url': link, "depth": url["depth"] + 1})
+                    found.append({'label':url['label'],'url': link, "depth": url["depth"] + 1})
                     already_found.add(link)
+        if self.manifest is not None:
+            self.manifest.queue(found)
+        return found
 
-    def _find_all_links(self, request):
+    def _find_all_links(self, raw_html, page_url):
         """
-        Finds all links on a page and returns them as a set.
+        Finds all links on an already downloaded page and returns them as a set.
+            Relative links are resolved against the <base> tag, or the page url.
+        :param raw_html: the page body.
+        :param page_url: the (final) url of the page, after redirects.
         """
         try:
-            session = HTMLSession()
-            response = session.get(request.url)
-            links = response.html.absolute_links
+            parser = lxml_html.HTMLParser(encoding='utf-8')
+            document = lxml_html.document_fromstring(raw_html.encode('utf-8'), parser=parser)
         except Exception as e:
-            logging.error('Failed to fetch links: %s', e)
+            logging.error('Failed to parse links from %s: %s', page_url, e)
             return set()
-        return links
-    
\ No newline at end of file
+
+        base_url = page_url
+        for base in document.iter('base'):
+            if base.get('href'):
+                base_url = urljoin(page_url, base.get('href').strip())
+                break
+
+        hrefs = set()
+        for anchor in document.iter('a'):
+            href = (anchor.get('href') or '').strip()
+            if not href or href.startswith(('#', 'javascript:', 'mailto:')):
+                continue
+            hrefs.add(href)
+        return {urljoin(base_url, href) for href in hrefs}
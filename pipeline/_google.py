@@ -2,13 +2,22 @@
 This module provides a wrapper function to process input data, search for company URLs on Google,
 and write the updated data to an output file.
 """
+import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from typing import Annotated
 from pathlib import Path
+from urllib.parse import urlparse
 import typer
-from classes.google_api_wrapper import GoogleSearchAPI
+from definitions import ROOT_DIR
+from classes.cache import PersistentCache
+from classes.google_api_wrapper import GoogleSearchAPI, CACHE_PATH
+from classes.rate_limiter import TokenBucket
 from adapters.scb import SCBAdapter
 
+BLACKLIST_PATH = os.path.join(ROOT_DIR, "assets", "google_search_blacklist.txt")
+
 FILTER_LIST = [
     'aktiebolag',
     'handelsbolag'
@@ -49,6 +58,28 @@ BLACKLIST = [
 ]
 
 
+def _load_blacklist(path=BLACKLIST_PATH):
+    """
+    Merges BLACKLIST with the sites in the search engine blacklist file
+        (one domain per line, after a description line).
+    :returns: a set of lowercase domains.
+    """
+    blacklist = {domain.lower() for domain in BLACKLIST}
+    with open(path, encoding="utf-8") as f:
+        next(f, None)
+        blacklist.update(line.strip().lower() for line in f if line.strip())
+    return blacklist
+
+def _is_blacklisted(url, blacklist):
+    """
+    Checks if the host of a url, or any domain it belongs to, is in the blacklist,
+        i.e. https://sv.wikipedia.org/... matches wikipedia.org.
+        The lookups are set lookups, one per label of the host name.
+    """
+    host = urlparse(url if "//" in url else "//" + url).hostname or ""
+    labels = host.split(".")
+    return any(".".join(labels[i:]) in blacklist for i in range(len(labels)))
+
 def _filter(original, filter_list):
     """
     Google custom search API fails to find some "too detailed" terms,
@@ -60,43 +91,86 @@ def _filter(original, filter_list):
         name = name.replace(f,'')
     return name
 
-def main(regenerate_urls: Annotated[bool, typer.Argument()] = False, limit: Annotated[int, typer.Argument()] = 2):
+def main(
+        regenerate_urls: Annotated[bool, typer.Argument()] = False,
+        limit: Annotated[int, typer.Argument()] = 2,
+        workers: Annotated[int, typer.Argument(help="Number of searches sent at the same time.")] = 4,
+        rate_limit: Annotated[float, typer.Argument(help="Maximum average number of searches per second.")] = 1.0,
+        use_cache: Annotated[bool, typer.Argument(help="If true, every company name is only searched for once.")] = True,
+        write_batch_size: Annotated[int, typer.Argument(help="Number of url updates and deletions sent per bulk write.")] = 500):
     """
     Process the input data file, search for company URLs on Google, and update the DB.
 
     Args:
         regenerate_urls (bool): Flag indicating whether to regenerate URLs or not.
+        limit (int): The maximum number of companies searched for per SNI code.
+        workers (int): The number of searches sent at the same time.
+        rate_limit (float): The maximum average number of searches per second (for all workers).
+        use_cache (bool): If true, the search results are cached on disk (keyed on the normalized name),
+            so regenerating the URLs doesn't search for the same company twice.
+        write_batch_size (int): The number of url updates and deletions that are sent with one bulk write.
 
     Returns:
         None
     """
     scb_adapter = SCBAdapter(init_api=True)
     sni_codes = scb_adapter.fetch_codes()
-    
-    google = GoogleSearchAPI()
-    for code in sni_codes.keys():
-        count = 0
-        
-        data = scb_adapter.fetch_companies_from_db_by_sni(
-            code,
-            has_url = "BOTH" if regenerate_urls else "NO"
-        )
-        for company in data:
-            if count >= limit:
-                break
-            if 'name' in company.keys() and company["name"] != "":
-                name = _filter(company['name'], FILTER_LIST)
-                logging.debug("Searching on Google for %s", name)
-                company["url"] = google.search(name)
-                count += 1
-                
-                if (company["url"] and not any(bl in company["url"] for bl in BLACKLIST)):
-                    # If the url is found and does not contain, update the DB
+
+    cache = PersistentCache(CACHE_PATH) if use_cache else None
+    google = GoogleSearchAPI(rate_limiter=TokenBucket(rate_limit, workers), cache=cache)
+    blacklist = _load_blacklist()
+
+    def companies():
+        """
+        Yields the first `limit` companies (with names) of every SNI code.
+        """
+        seen = set()
+        for code in sni_codes.keys():
+            # Streamed, so only the companies up to the limit are read from the db
+            data = scb_adapter.iter_companies_from_db_by_sni(
+                code,
+                has_url = "BOTH" if regenerate_urls else "NO",
+                projection = {"name": 1, "org_nr": 1}
+            )
+            named = (company for company in data
+                     if company.get("name", "") != "" and company["org_nr"] not in seen)
+            for company in islice(named, limit):
+                # A company with several SNI codes is only searched for once
+                seen.add(company["org_nr"])
+                yield company
+
+    def resolve(company):
+        name = _filter(company['name'], FILTER_LIST)
+        logging.debug("Searching on Google for %s", name)
+        return company, google.search(name)
+
+    # The companies are resolved in chunks, so that at most a few chunks are read ahead of the searches
+    chunk_size = workers * 16
+    pending = companies()
+    errors = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            scb_adapter.buffered_company_writer(write_batch_size) as writer:
+        while chunk := list(islice(pending, chunk_size)):
+            for company, url in executor.map(resolve, chunk):
+                if url is None:
+                    # The search failed (i.e. the quota is used up), so the company is left as it is
+                    errors += 1
+                    continue
+                company["url"] = url
+                if (company["url"] and not _is_blacklisted(company["url"], blacklist)):
+                    # If the url is found and is not blacklisted, update the DB
                     logging.debug("Updating URL for %s to %s", company["name"], company["url"])
-                    scb_adapter.update_url_for_company(company["org_nr"], company["url"])
+                    writer.update_url_for_company(company["org_nr"], company["url"])
                 else:
                     logging.debug("No URL found for %s, or the url is in BLACKLIST. Deleting from DB", company["name"])
-                    scb_adapter.delete_company_from_db(company["org_nr"])
+                    writer.delete_company_from_db(company["org_nr"])
+
+    logging.info("Sent %s searches (%s cached results were reused)", google.requests_sent, google.cache_hits)
+    logging.info("Updated or deleted %s companies with %s bulk writes", writer.written, writer.round_trips)
+    if errors:
+        logging.error("The search failed for %s companies, they were left unchanged", errors)
+    if cache is not None:
+        cache.close()
 
 if __name__ == "__main__":
     from aux_functions.logger_config import conf_logger
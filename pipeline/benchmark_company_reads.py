@@ -0,0 +1,69 @@
+"""
+Benchmarks the batched company reads of the pipeline stages (see SCBAdapter._iter_companies)
+against the companies collection, and reports whether MongoDB sorts the batches in memory.
+Only reads from the database.
+"""
+import logging
+import time
+from pathlib import Path
+import typer
+from typing_extensions import Annotated
+from pymongo import ASCENDING
+from adapters.scb import SCBAdapter, READ_BATCH_SIZE, _has_url_query
+from classes.mongo import Schema
+
+def _plan_stages(explain):
+    """
+    :param explain: the result of a find cursor's explain().
+    :returns: the stages of the winning plan, from the top (i.e. ["LIMIT", "FETCH", "IXSCAN"]).
+    """
+    plan = explain["queryPlanner"]["winningPlan"]
+    # The slot based engine (MongoDB 7.0+) nests the plan
+    plan = plan.get("queryPlan", plan)
+    stages = []
+    while plan:
+        stages.append(plan["stage"])
+        plan = plan.get("inputStage") or next(iter(plan.get("inputStages", [])), None)
+    return stages
+
+def main(
+        sni_codes: Annotated[int, typer.Argument(help="Number of SNI codes (with the most companies) that are read.")] = 5,
+        batch_size: Annotated[int, typer.Argument(help="Number of companies fetched per query.")] = READ_BATCH_SIZE):
+    """
+    Streams the companies of the SNI codes with the most companies, with every has_url filter,
+    like the google and scrape stages do, and reports the companies per second
+    and the plan of a batch query (a SORT stage means that the batches are sorted in memory).
+
+    :param sni_codes (int): Number of SNI codes (with the most companies) that are read.
+    :param batch_size (int): Number of companies fetched per query.
+    """
+    scb_adapter = SCBAdapter()
+    companies = scb_adapter.mongo_client[Schema.DB][Schema.COMPANIES]
+    logging.info("The companies collection has about %s companies", companies.estimated_document_count())
+    largest = companies.aggregate([
+        {"$unwind": "$branch_codes"},
+        {"$group": {"_id": "$branch_codes", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": sni_codes}])
+
+    results = {}
+    for sni in largest:
+        for has_url in ("BOTH", "ONLY", "NO"):
+            query = {"branch_codes": sni["_id"], **_has_url_query(has_url)}
+            stages = _plan_stages(companies.find(query, {"_id": 1}).sort("_id", ASCENDING).limit(batch_size).explain())
+            start = time.perf_counter()
+            read = sum(1 for _ in scb_adapter.iter_companies_from_db_by_sni(sni["_id"], has_url, {"_id": 1}, batch_size))
+            seconds = time.perf_counter() - start
+            results[(sni["_id"], has_url)] = {
+                "companies": read,
+                "companies_per_second": round(read / seconds, 1) if seconds else 0.0,
+                "sorted_in_memory": "SORT" in stages,
+                "plan": stages,
+            }
+            logging.info("SNI %s (%s): %s", sni["_id"], has_url, results[(sni["_id"], has_url)])
+    return results
+
+if __name__ == "__main__":
+    from aux_functions.logger_config import conf_logger
+    conf_logger(Path(__file__).stem)
+    typer.run(main)
@@ -0,0 +1,59 @@
+"""
+Benchmarks the parser backends of the extraction on scraped pages,
+and reports the pages per second of each backend and the pages whose text differs.
+"""
+import logging
+import time
+from itertools import islice
+from pathlib import Path
+import typer
+from typing_extensions import Annotated
+from classes.extract import PARSERS, create_extractor
+from classes.page_store import read_pages
+from pipeline.extract import extract_text
+
+def main(
+        scraped_data_folder: Annotated[Path, typer.Argument(
+            exists=True, file_okay=False, dir_okay=True, help="The folder of the scraped pages.")] = "scraped_data",
+        max_pages: Annotated[int, typer.Argument(help="Number of pages that are extracted (0 for all).")] = 1000,
+        extract_meta: Annotated[bool, typer.Argument(help="If true, extracts the HTML meta-tags.")] = True,
+        extract_body: Annotated[bool, typer.Argument(help="If true, extracts the HTML body.")] = True,
+        p_only: Annotated[bool, typer.Argument(help="If true, extracts only the paragraphs from the HTML body.")] = False):
+    """
+    Extracts the same scraped pages with every parser backend (see classes.extract.PARSERS)
+    and reports the pages per second of each backend, and the pages whose extracted text
+    differs from the text of the first backend (html.parser).
+
+    :param scraped_data_folder (Path): The folder of the scraped pages (in any storage format).
+    :param max_pages (int): Number of pages that are extracted, or 0 for all pages. The pages are read
+        before the extraction is timed.
+    :param extract_meta (bool): If true, extracts the HTML meta-tags.
+    :param extract_body (bool): If true, extracts the HTML body.
+    :param p_only (bool): If true, extracts only the paragraphs from the HTML body.
+    """
+    pages = [data for _, data in islice(read_pages(scraped_data_folder), max_pages or None)]
+    logging.info("Read %s pages (%.1f MB of HTML)", len(pages), sum(len(page['raw_html']) for page in pages) / 1e6)
+
+    results = {}
+    texts = {}
+    for parser in PARSERS:
+        extractor = create_extractor(parser)
+        start = time.perf_counter()
+        texts[parser] = [extract_text(extractor, page, extract_meta, extract_body, p_only) for page in pages]
+        seconds = time.perf_counter() - start
+        results[parser] = {"pages": len(pages), "pages_per_second": round(len(pages) / seconds, 1) if seconds else 0.0}
+
+    for parser in PARSERS[1:]:
+        differing = [page['url'] for page, text, expected in zip(pages, texts[parser], texts[PARSERS[0]]) if text != expected]
+        results[parser]["differing_pages"] = len(differing)
+        for url in differing[:10]:
+            logging.info("The %s text of %s differs from the %s text", parser, url, PARSERS[0])
+
+    for parser, summary in results.items():
+        logging.info("%s: %s", parser, summary)
+    return results
+
+if __name__ == "__main__":
+    from aux_functions.logger_config import conf_logger
+    conf_logger(Path(__file__).stem)
+    typer.run(main)
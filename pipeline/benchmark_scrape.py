@@ -0,0 +1,101 @@
+"""
+Benchmarks the scraper against a local test server,
+and reports the connections opened per page and the time to first byte.
+"""
+import gzip
+import logging
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import typer
+from typing_extensions import Annotated
+from classes.scraper import Scraper, POOL_SIZE, DNS_CACHE_TTL
+
+def _test_server(links_per_site, latency):
+    """
+    Creates a keep-alive (HTTP/1.1) server on a free local port.
+        Every site /site{n}/ links to links_per_site "/om" pages,
+        and the pages are gzip-compressed if the client accepts it.
+    :param links_per_site: number of followable links on each start page.
+    :param latency: number of seconds the server waits before it responds.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # The headers and the body are written separately
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            site = self.path.strip("/").split("/")[0]
+            links = "".join(f'<a href="/{site}/om-{i}">Om oss {i}</a>' for i in range(links_per_site))
+            body = f"<html><body><h1>{self.path}</h1><p>{'Lorem ipsum dolor sit amet. ' * 50}</p>{links}</body></html>".encode("utf-8")
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            if self.close_connection:
+                # The client asked for it, and without the header it would reuse the closed connection
+                self.send_header("Connection", "close")
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 1024
+
+    server = Server(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    return server
+
+def main(
+        sites: Annotated[int, typer.Argument(help="Number of start pages.")] = 50,
+        links_per_site: Annotated[int, typer.Argument(help="Number of followed links on each start page.")] = 3,
+        concurrency: Annotated[int, typer.Argument(help="If above 0, the sites are crawled concurrently with this many requests in flight.")] = 0,
+        pool_size: Annotated[int, typer.Argument(help="Number of kept-alive connections per host.")] = POOL_SIZE,
+        latency_ms: Annotated[float, typer.Argument(help="Server latency per response, in milliseconds.")] = 5.0,
+        compare: Annotated[bool, typer.Argument(help="If true, also crawls with a new connection per request.")] = True):
+    """
+    Crawls a local test server (following the links on the start pages)
+    and reports the connections opened per page and the time to first byte distribution.
+
+    :param sites (int): Number of start pages.
+    :param links_per_site (int): Number of followed links on each start page.
+    :param concurrency (int): If above 0, scrape_all_async is benchmarked with this many requests in flight,
+        otherwise scrape_all.
+    :param pool_size (int): Number of kept-alive connections per host.
+    :param latency_ms (float): Server latency per response, in milliseconds.
+    :param compare (bool): If true, the crawl is repeated without keep-alive (pool size 0).
+    """
+    server = _test_server(links_per_site, latency_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    start_urls = [{'label': str(i), 'url': f"http://127.0.0.1:{server.server_port}/site{i}/"} for i in range(sites)]
+
+    results = {}
+    for size in ([0, pool_size] if compare else [pool_size]):
+        with tempfile.TemporaryDirectory() as output_folder:
+            scraper = Scraper(output_folder, pool_size=size, dns_cache_ttl=DNS_CACHE_TTL)
+            start = time.perf_counter()
+            if concurrency > 0:
+                scraper.scrape_all_async(start_urls, follow_links=True,
+                                         max_concurrency=concurrency, per_domain_limit=concurrency)
+            else:
+                scraper.scrape_all(start_urls, follow_links=True)
+            summary = scraper.stats.summary()
+            summary["pages_per_second"] = round(summary["pages"] / (time.perf_counter() - start), 1)
+            results[size] = summary
+    server.shutdown()
+
+    for size, summary in results.items():
+        logging.info("Pool size %s: %s", size, summary)
+    return results
+
+if __name__ == "__main__":
+    from aux_functions.logger_config import conf_logger
+    conf_logger(Path(__file__).stem)
+    typer.run(main)
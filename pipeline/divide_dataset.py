@@ -5,6 +5,7 @@ The smaller dataset will contain a percentage of companies with the same SNI cod
 """
 import logging
 import math
+from itertools import islice
 
 import typer
 from pathlib import Path
@@ -18,6 +19,7 @@ def main(
             percentage_training_split: Annotated[int, typer.Argument()] = 70,
             percentage_eval_split: Annotated[int, typer.Argument()] = 20,
             percentage_test_split: Annotated[int, typer.Argument()] = 10,
+            batch_size: Annotated[int, typer.Argument(help="Number of companies fetched and inserted per query.")] = 1000,
         ):
     """
     Divide the dataset into a smaller dataset and a validation dataset based on the SNI code of each company.
@@ -31,6 +33,9 @@ def main(
     :param percentage_test_split (int, optional):
         Percent of the entire dataset that should be used for testing.
         Defaults to 10%.
+    :param batch_size (int, optional):
+        Number of companies whose extracted data is fetched (and inserted) with one query.
+        Defaults to 1000.
     """
     
     if percentage_training_split + percentage_eval_split + percentage_test_split != 100:
@@ -40,7 +45,7 @@ def main(
     extract_adapter   = ExtractAdapter()
     train_adapter     = TrainAdapter()
 
-    nr_of_each_SNI = scb_adapter.aggregate_companies_by_sni()
+    nr_of_each_SNI = scb_adapter.iter_companies_by_sni(batch_size)
     
     stored_sni = {}
 
@@ -51,29 +56,39 @@ def main(
         nr_of_cross_validation_companies = math.floor(
             sni["count"] * (percentage_eval_split) / 100)
         nr_of_test_companies = math.floor(sni["count"] * (percentage_test_split) / 100)
-        
-        for company in sni['companies']:
-            company_scraped_data = extract_adapter.fetch_company_extracted_data(company)
-            if company_scraped_data is None:
-                continue
-            company_scraped_data.pop("_id")
-            
-            company_data = scb_adapter.fetch_company_by_id(company)
-            company_scraped_data["branch_codes"] = company_data["branch_codes"]
-            if company_data["branch_codes"][0] not in stored_sni.keys()  or stored_sni[company_data["branch_codes"][0]] < nr_of_cross_validation_companies:
-                #Move scraped data to cross-validation dataset
-                train_adapter.insert_to_dev_set(company_scraped_data)
-                if company_data["branch_codes"][0] not in stored_sni.keys():
-                    stored_sni[company_data["branch_codes"][0]] = 1
-                else:
+
+        # The companies are streamed, fetched and inserted in batches, but assigned in the original order
+        while batch := list(islice(sni['companies'], batch_size)):
+            scraped_data = extract_adapter.fetch_latest_extracted_data(batch)
+            companies = scb_adapter.fetch_companies_by_ids(list(scraped_data), {"branch_codes": 1})
+            dev_set, test_set, train_set = [], [], []
+
+            for company in batch:
+                company_scraped_data = scraped_data.get(company)
+                if company_scraped_data is None:
+                    continue
+                company_scraped_data.pop("_id")
+
+                company_data = companies[company]
+                company_scraped_data["branch_codes"] = company_data["branch_codes"]
+                if company_data["branch_codes"][0] not in stored_sni.keys()  or stored_sni[company_data["branch_codes"][0]] < nr_of_cross_validation_companies:
+                    #Move scraped data to cross-validation dataset
+                    dev_set.append(company_scraped_data)
+                    if company_data["branch_codes"][0] not in stored_sni.keys():
+                        stored_sni[company_data["branch_codes"][0]] = 1
+                    else:
+                        stored_sni[company_data["branch_codes"][0]] += 1
+                elif (stored_sni[company_data["branch_codes"][0]] <
+                       nr_of_cross_validation_companies + nr_of_test_companies):
+                    #Move scraped data to test dataset
+                    test_set.append(company_scraped_data)
                     stored_sni[company_data["branch_codes"][0]] += 1
-            elif (stored_sni[company_data["branch_codes"][0]] <
-                   nr_of_cross_validation_companies + nr_of_test_companies):
-                #Move scraped data to test dataset
-                train_adapter.insert_to_test_set(company_scraped_data)
-                stored_sni[company_data["branch_codes"][0]] += 1
-            else:
-                train_adapter.insert_to_train_set(company_scraped_data)
+                else:
+                    train_set.append(company_scraped_data)
+
+            train_adapter.insert_many_to_dev_set(dev_set)
+            train_adapter.insert_many_to_test_set(test_set)
+            train_adapter.insert_many_to_train_set(train_set)
 
     logging.info("Dataset division finished!")
 
@@ -1,79 +1,71 @@
+import time
+import numpy
 import typer
 import logging
 import spacy
 from pathlib import Path
 from typing_extensions import Annotated
 from adapters.train import TrainAdapter
+from classes.evaluator import ScoreMatrixEvaluator
 
+# Only the fields that are needed to evaluate are read from the test set
+TEST_SET_PROJECTION = {"company_id": 1, "branch_codes": 1, "data.data": 1}
 
-def evaluation(predictions: dict, true_label: str, top_n: int) -> dict:
+
+def cats_components(nlp: spacy.language.Language) -> set:
     """
-    Evaluate the model predictions on a data point.
-    
-    :param predictions (dict): the models predictions for the data point
-    :param true_label (str): the true label for the data point
-    :param top_n (int): the number of top predictions to evaluate
-    :return (dict): a dictionary with the results of the evaluation
-    """
-    results = {}
-    sorted_predictions = sorted(predictions.items(), key=lambda x: x[1], reverse=True)
-    logging.debug(f"Predictions: {sorted_predictions[0:top_n]}")
-    logging.debug(f"True label: {true_label}")     
-
-    for i,(label, _) in enumerate(sorted_predictions):
-        if is_correct_label(label, true_label):
-                if i == 0:
-                    results['correct_label'] = 1
-                    logging.debug("Correct label!")
-                if i < top_n:
-                    results[f'top_{top_n}_label'] = 1
-
-        if is_correct_category(label, true_label):
-            if i == 0:
-                results['correct_category'] = 1
-                logging.debug("Correct category!")
-            if i < top_n:
-                results[f'top_{top_n}_category'] = 1
-            results['weighted_category_score'] = 1 * (1/(i+1))
-            
-    return {'label': true_label, 'results': results}
-
-def is_correct_label(label: dict, true_label: dict) -> bool:
-    """Returns True if the label is correct."""
-    return label == true_label
-
-def is_correct_category(label: dict, true_label: dict) -> bool:
-    """Returns True if the category is correct."""
-    return label[:2] == true_label[:2]
-
-def load_data_and_model(model_path: Path) -> tuple[list, spacy.language.Language]:
-    """
-    Load test data and model
+    Get the components that are needed to predict doc.cats.
+
+    :param nlp (spacy.language.Language): the model
+    :return (set): the names of the components that assign doc.cats,
+        and of the shared components (i.e. tok2vec) that they listen to
+    """
+    needed = {name for name in nlp.pipe_names if "doc.cats" in nlp.get_pipe_meta(name).assigns}
+    for name, component in nlp.pipeline:
+        if needed & set(getattr(component, "listening_components", [])):
+            needed.add(name)
+    return needed
+
+def load_data_and_model(model_path: Path) -> tuple[object, spacy.language.Language]:
+    """
+    Load test data and model. The components that don't affect doc.cats are disabled.
     
     :param model_path (Path): the path to the model
-    :return (list,spacy.language.Language): the test data and the model
+    :return (pymongo.cursor.Cursor,spacy.language.Language): a cursor over the test data and the model
     """
     train_adapter = TrainAdapter()
-    test_data = [company for company in train_adapter.fetch_test_set()]
+    test_data = train_adapter.fetch_test_set(TEST_SET_PROJECTION)
     nlp = spacy.load(model_path)
+    needed = cats_components(nlp)
+    for name in nlp.pipe_names:
+        if name not in needed:
+            nlp.disable_pipe(name)
+    logging.info(f"Evaluating with the components {nlp.pipe_names}, disabled {nlp.disabled}")
     return test_data, nlp
 
-def update_label_results(total_results: dict, point_results: dict) -> dict:
+def test_texts(test_data, min_data_length: int, evaluator: ScoreMatrixEvaluator):
     """
-    Update total results with the results from the current data point.
-    
-    :param total_results (dict): the total results so far
-    :param point_results (dict): the results from the current data point
-    :return (dict): the updated total results
-    """
-    if point_results['label'] not in total_results:
-        total_results[point_results['label']] = point_results['results']
-    else:
-        for key in point_results['results']:
-            total_results[point_results['label']][key] = total_results[point_results['label']].get(key, 0) + point_results['results'][key]
-    if 'skipped' not in point_results['results'].keys():
-        total_results[point_results['label']]['label_count'] = total_results[point_results['label']].get('label_count', 0) + 1
-    return total_results
+    Combine all text data for each company into one string.
+    Companies with too short text are counted as skipped by the evaluator.
+
+    :param test_data (Iterable[dict]): the companies of the test set
+    :param min_data_length (int): the minimum length of the data to be evaluated
+    :param evaluator (ScoreMatrixEvaluator): the evaluator that counts the skipped companies
+    :return (Iterator[tuple[str, str]]): the text and the true label of each company to evaluate
+    """
+    for data_point in test_data:
+        label = data_point['branch_codes'][0]
+        text = "".join(" " + data['data'] for data in data_point['data'])
+        if len(text) > 1000000: # SpaCy has a limit of 1000000 characters per document.
+            text = text[:1000000]
+            logging.debug(f"Text for company_id: {data_point['company_id']}, " 
+                          f"Label: {label} is too long, cutting it to 1000000 characters")
+        elif len(text) < min_data_length:
+            logging.debug(f"Text for company_id: {data_point['company_id']}, "
+                          f"Label: {label} is too short, skipping it") 
+            evaluator.add_skipped(label)
+            continue
+        yield text, label
 
 def calculate_total_results(results: dict) -> dict:
     """ 
@@ -127,9 +119,49 @@ def log_results(results: dict, top_n: int):
         f"Category in top {top_n} predictions: {get_percentage(total_results.get(f'top_{top_n}_category', 0), total_results.get('total_items', 1))}%\n{' '*4}"
         f"Weighted category score: {round(total_results.get('weighted_category_score', 0), 3)}{' '*4}")
 
+def log_precision_recall(evaluator: ScoreMatrixEvaluator, confusions: int = 10):
+    """
+    Log the precision and recall of the top prediction per label, and the most common confusions.
+
+    :param evaluator (ScoreMatrixEvaluator): the evaluator with all predictions
+    :param confusions (int): the number of confusions (true label, predicted label) to log
+    """
+    logging.info(f"Precision and recall per label:")
+    for label, scores in sorted(evaluator.precision_recall().items()):
+        precision = f"{scores['precision']*100:.2f}%" if scores['precision'] is not None else "-"
+        recall = f"{scores['recall']*100:.2f}%" if scores['recall'] is not None else "-"
+        logging.info(f"Label {label}: Precision: {precision}, Recall: {recall}")
+
+    matrix = evaluator.confusion_matrix()
+    numpy.fill_diagonal(matrix, 0)
+    most_common = numpy.argsort(matrix, axis=None, kind="stable")[::-1][:confusions]
+    logging.info(f"Most common confusions (true label -> predicted label):")
+    for true, predicted in zip(*numpy.unravel_index(most_common, matrix.shape)):
+        if matrix[true, predicted] > 0:
+            logging.info(f"{evaluator.labels[true]} -> {evaluator.labels[predicted]}: {matrix[true, predicted]} companies")
+
+def log_speed(docs: int, seconds: float, batch_seconds: list[float], batch_size: int):
+    """
+    Log the number of documents per second and the latency of the batches.
+
+    :param docs (int): the number of evaluated documents
+    :param seconds (float): the total time of the evaluation
+    :param batch_seconds (list[float]): the time it took to get the predictions of each batch
+    :param batch_size (int): the number of documents per batch
+    """
+    batch_seconds = sorted(batch_seconds)
+
+    def percentile(p):
+        return round(1000 * batch_seconds[min(len(batch_seconds) - 1, int(p / 100 * len(batch_seconds)))], 1) if batch_seconds else 0.0
+
+    logging.info(f"Evaluated {docs} documents in {round(seconds, 2)} seconds ({round(docs/seconds if seconds > 0 else 0, 1)} documents/s)")
+    logging.info(f"Latency per batch of {batch_size} documents: p50 {percentile(50)} ms, p95 {percentile(95)} ms")
+
 def main(model_path: Annotated[Path, typer.Argument(..., dir_okay=True)] = "training/model-best",
         min_data_length: Annotated[int, typer.Argument()] = 300,
-        evaluate_top_n: Annotated[int, typer.Argument()] = 5
+        evaluate_top_n: Annotated[int, typer.Argument()] = 5,
+        batch_size: Annotated[int, typer.Argument(help="Number of documents per nlp.pipe batch.")] = 64,
+        n_process: Annotated[int, typer.Argument(help="Number of processes used by nlp.pipe.")] = 1
     ):
     """
     Evaluate the model on the test set.
@@ -137,30 +169,36 @@ def main(model_path: Annotated[Path, typer.Argument(..., dir_okay=True)] = "trai
     :param model_path (Path): the path to the model
     :param min_data_length (int): the minimum length of the data to be evaluated
     :param evaluate_top_n (int): the number of top predictions to evaluate
+    :param batch_size (int): the number of documents that the model predicts at a time
+    :param n_process (int): the number of processes that the model predicts with
     """
     logging.info("Starting evaluation")
     test_data, model = load_data_and_model(model_path)
-    label_results = dict()
-    
-    for data_point in test_data:
-        point_results = {'label': None, 'results': {}}
-        text = str()
-        """Combine all text data for the company into one string."""
-        for data in data_point['data']:
-            text += " " + data['data']
-        if len(text) > 1000000: # SpaCy has a limit of 1000000 characters per document.
-            text = text[:1000000]
-            logging.debug(f"Text for company_id: {data_point['company_id']}, " 
-                          f"Label: {data_point['branch_codes'][0]} is too long, cutting it to 1000000 characters")
-        elif len(text) < min_data_length:
-            logging.debug(f"Text for company_id: {data_point['company_id']}, "
-                          f"Label: {data_point['branch_codes'][0]} is too short, skipping it") 
-            point_results.update({'label': data_point['branch_codes'][0], 'results': {'skipped': 1}})
-        else:
-            point_results = evaluation(model(text).cats, data_point['branch_codes'][0], evaluate_top_n)
-        label_results = update_label_results(label_results, point_results)
+    evaluator = ScoreMatrixEvaluator(evaluate_top_n)
+
+    start = time.perf_counter()
+    batch_start = start
+    batch_seconds = []
+    docs = 0
+    texts = test_texts(test_data, min_data_length, evaluator)
+    for doc, label in model.pipe(texts, as_tuples=True, batch_size=batch_size, n_process=n_process):
+        evaluator.add(doc.cats, label)
+        docs += 1
+        if docs % batch_size == 0:
+            batch_seconds.append(time.perf_counter() - batch_start)
+            batch_start = time.perf_counter()
+    seconds = time.perf_counter() - start
+    if docs % batch_size != 0:
+        # The last batch isn't full
+        batch_seconds.append(time.perf_counter() - batch_start)
+
+    metrics_start = time.perf_counter()
+    label_results = evaluator.label_results()
+    logging.info(f"Computed the metrics in {round((time.perf_counter() - metrics_start)*1000, 1)} ms")
 
     log_results(label_results, evaluate_top_n)
+    log_precision_recall(evaluator)
+    log_speed(docs, seconds, batch_seconds, batch_size)
 
 if __name__ == '__main__':
     from aux_functions.logger_config import conf_logger
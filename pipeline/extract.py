@@ -1,14 +1,17 @@
 """
 This module runs the extraction scripts on the scraped data.
 """
-import os
-import json
 import logging
+import time
+from collections import deque
 from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool
 from pathlib import Path
 import typer
 from typing_extensions import Annotated
-from classes.extract import DataExtractor
+from classes.extract import DataExtractor, PARSERS, create_extractor
+from classes.page_store import read_pages
 from adapters.scb import SCBAdapter
 from adapters.extract import ExtractAdapter
 
@@ -28,6 +31,79 @@ def log_results(results: dict):
     logging.info("Average length of extracted data per label: %s", results['total_length']/len(results['labels']))
 
 
+_extractor = None
+_methods = None
+
+def _init_worker(parser: str, extract_meta: bool, extract_body: bool, p_only: bool):
+    """
+    Creates one DataExtractor per worker process, and keeps the extraction settings.
+    """
+    global _extractor, _methods
+    _extractor = create_extractor(parser)
+    _methods = (extract_meta, extract_body, p_only)
+
+def _extract_worker(pages: list) -> list:
+    """
+    Runs extract_text on a chunk of pages in a worker process.
+
+    :param pages (list): [{'url':..., 'raw_html':...}, ...]
+    :return (list): the extracted text (or None) of every page.
+    """
+    return [extract_text(_extractor, page, *_methods) for page in pages]
+
+def _extract_in_pool(pool: Pool, pages, workers: int, chunk_size: int):
+    """
+    Extracts pages in the worker processes, with at most 2 * workers chunks in flight,
+        so pages are only read as fast as they are extracted (and the results are consumed).
+        Only the url and raw HTML of a page are sent to a worker.
+
+    :param pages: an iterable of (scraped_item, company) tuples.
+    :return: a generator of (scraped_item without raw HTML, company, extracted text or None), in order.
+    """
+    def results(items, texts):
+        for (scraped_item, company), text in zip(items, texts.get()):
+            yield scraped_item, company, text
+
+    pages = iter(pages)
+    pending = deque()
+    while chunk := list(islice(pages, chunk_size)):
+        texts = pool.apply_async(_extract_worker, ([{'url': item['url'], 'raw_html': item['raw_html']} for item, _ in chunk],))
+        pending.append(([({'label': item['label'], 'url': item['url']}, company) for item, company in chunk], texts))
+        if len(pending) >= 2 * workers:
+            yield from results(*pending.popleft())
+    while pending:
+        yield from results(*pending.popleft())
+
+def extract_text(extractor: DataExtractor, scraped_item: dict, extract_meta: bool, extract_body: bool, p_only: bool):
+    """
+    Extracts the text of one scraped page.
+
+    :param extractor (DataExtractor): The extractor to use.
+    :param scraped_item (dict): A scraped page {'label':..., 'url':..., 'raw_html':...}
+    :param extract_meta (bool): If true, extracts the HTML meta-tags.
+    :param extract_body (bool): If true, extracts the HTML body.
+    :param p_only (bool): If true, extracts only the paragraphs from the HTML body.
+    :return (str): the extracted text, or None if the page couldn't be parsed.
+    """
+    extractor.create_soup_from_string(scraped_item['raw_html'])
+
+    if extractor.soup is None:
+        logging.error("Couldn't create soup from %s!", scraped_item['url'])
+        logging.error("Probably not a valid HTML file")
+        return None
+
+    extracted_text = extractor.extract(
+        p_only=p_only, 
+        extract_body=extract_body, 
+        extract_meta=extract_meta)
+
+    # Spacy has a limit of 1000000 characters,
+    # so we truncate the data if it exceeds this limit
+    if len(extracted_text) >= 1000000:
+        logging.debug("Extracted data for %s exceeds 1000000 characters, truncating", scraped_item['url'])
+        extracted_text = extracted_text[:1000000]
+    return extracted_text
+
 def main(    
             scraped_data_folder: Annotated[Path, typer.Argument(
                 exists=True, 
@@ -36,11 +112,16 @@ def main(
                 readable=True, 
                 resolve_path=True, 
                 formats=["json"], 
-                help="The path to the input scraped data file."
+                help="The path to the scraped data folder (json files and/or compressed shards)."
                 )],     
             extract_meta: Annotated[bool, typer.Argument()],
             extract_body: Annotated[bool, typer.Argument()],
-            p_only: Annotated[bool, typer.Argument()]):
+            p_only: Annotated[bool, typer.Argument()],
+            workers: Annotated[int, typer.Argument(help="Number of extraction processes.")] = 1,
+            chunk_size: Annotated[int, typer.Argument(help="Number of pages sent to a worker at a time.")] = 16,
+            parser: Annotated[str, typer.Argument(help=f"HTML parser backend, one of {PARSERS}.")] = "html.parser",
+            write_batch_size: Annotated[int, typer.Argument(help="Number of pages inserted per bulk write.")] = 500,
+            flush_interval: Annotated[float, typer.Argument(help="Maximum number of seconds between bulk writes.")] = 5.0):
     """
     Extracts text from raw HTML in the scraped data
     and inserts it into the database.
@@ -49,48 +130,40 @@ def main(
     :param extract_meta (bool): If true, extracts the HTML meta-tags.
     :param extract_body (bool): If true, extracts the HTML body.
     :param p_only (bool): If true, extracts only the paragraphs (<p>...</p>) from the HTML body.
+    :param workers (int): Number of processes that parse the pages.
+        The results are written by this process, in the same order as the serial run.
+    :param chunk_size (int): Number of pages sent to a worker at a time.
+        At most 2 * workers chunks are read ahead of the writes.
+    :param parser (str): The HTML parser backend ("html.parser" for BeautifulSoup, or "lxml").
+    :param write_batch_size (int): Number of pages buffered before they are inserted with one bulk write.
+    :param flush_interval (float): Maximum number of seconds that pages stay buffered.
     """
 
     scb_adapter = SCBAdapter()
-    extractor = DataExtractor()
+    extractor = create_extractor(parser)
     extract_adapter = ExtractAdapter()
 
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     methods = [extract_meta,extract_body,p_only]
     label_count = {"total_length": 0, "labels": {}}
 
-    logging.info("Starting extraction...")
-    for filename in os.listdir(scraped_data_folder):
-        logging.debug("Extracting data from file at %s", filename)
-
-        with open(os.path.join(scraped_data_folder,filename), 'r', encoding='utf-8') as f:
-            scraped_item = json.load(f)
+    def tasks():
+        for location, scraped_item in read_pages(scraped_data_folder):
+            logging.debug("Extracting data from %s", location)
 
             company = scb_adapter.fetch_company_by_org_nr(scraped_item['label'])
 
             if company is None:
                 logging.error("No company found for URL: %s", scraped_item["url"])
                 continue
+            yield scraped_item, company
 
-            extractor.create_soup_from_string(scraped_item['raw_html'])
-
-            if extractor.soup is None:
-                logging.error("Couldn't create soup from %s!", scraped_item['url'])
-                logging.error("Probably not a valid HTML file")
+    def write(results, writer):
+        for scraped_item, company, extracted_text in results:
+            if extracted_text is None:
                 continue
 
-            extracted_text = extractor.extract(
-                p_only=p_only, 
-                extract_body=extract_body, 
-                extract_meta=extract_meta)
-
-            # Spacy has a limit of 1000000 characters,
-            # so we truncate the data if it exceeds this limit
-            if len(extracted_text) >= 1000000:
-                logging.debug("Extracted data for company %s exceeds 1000000 characters, truncating", company['name'])
-                extracted_text = extracted_text[:1000000]
-
-            extract_adapter.insert_extracted_data(
+            writer.insert_extracted_data(
                 extracted_text,company['url'],
                 company['_id'],timestamp,methods)
             
@@ -98,7 +171,23 @@ def main(
             label_count['total_length'] = label_count.get('total_length', 0) + len(extracted_text)
             logging.debug("Added extracted data from %s", scraped_item["url"])
 
+    logging.info("Starting extraction with %s worker(s)...", workers)
+    start = time.perf_counter()
+    with extract_adapter.buffered_writer(write_batch_size, flush_interval) as writer:
+        if workers > 1:
+            with Pool(workers, initializer=_init_worker, initargs=(parser, extract_meta, extract_body, p_only)) as pool:
+                write(_extract_in_pool(pool, tasks(), workers, chunk_size), writer)
+        else:
+            write(((item, company, extract_text(extractor, item, extract_meta, extract_body, p_only))
+                   for item, company in tasks()), writer)
+    elapsed = time.perf_counter() - start
+
     logging.info("Extraction finished")
+    pages = sum(label_count['labels'].values())
+    logging.info("Extracted %s pages in %.1f seconds with %s worker(s): %.2f pages/s, %.2f pages/s per worker",
+                 pages, elapsed, workers, pages / elapsed if elapsed > 0 else 0,
+                 pages / elapsed / workers if elapsed > 0 else 0)
+    logging.info("Inserted %s pages with %s bulk writes", writer.written, writer.round_trips)
     log_results(label_count)
 
 
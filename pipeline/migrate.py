@@ -0,0 +1,26 @@
+"""
+Migrates the companies collection to the normalized url fields and creates its indexes.
+"""
+import logging
+from pathlib import Path
+import typer
+from typing_extensions import Annotated
+from adapters.scb import SCBAdapter
+
+def main(batch_size: Annotated[int, typer.Argument(help="Number of companies updated per bulk write.")] = 1000):
+    """
+    Removes companies with duplicate organization numbers (moving their extracted data to the kept company),
+    adds the domain, fqdn and has_url fields to the companies that don't have them, and creates the indexes
+    (including the unique org_nr index). Part of the fetch and all workflows, since running it again is cheap.
+
+    :param batch_size (int): Number of companies updated with one bulk write.
+    """
+    scb_adapter = SCBAdapter()
+    result = scb_adapter.migrate_companies(batch_size)
+    logging.info("Migration finished: %s duplicates removed, %s companies updated",
+                 result['duplicates'], result['updated'])
+
+if __name__ == "__main__":
+    from aux_functions.logger_config import conf_logger
+    conf_logger(Path(__file__).stem)
+    typer.run(main)
@@ -28,8 +28,10 @@ def main(model_path: Annotated[Path, typer.Argument(..., dir_okay=True)] = "trai
     
     sorted_predictions = sorted(predictions.items(), key=lambda x: x[1], reverse=True)
 
-    scb_adapter = SCBAdapter(init_api=True)
-    codes = scb_adapter.fetch_codes()
+    # The SNI codes are read from the reference table snapshot without checking it against the database,
+    # so no database connection is needed once a snapshot exists (the first run reads them from the database)
+    scb_adapter = SCBAdapter()
+    codes = scb_adapter.fetch_codes(trust_snapshot=True)
     print("\nTop 10 Predictions for the URL:")
     print(test_url)
     print(" ----------------- ")
@@ -3,48 +3,139 @@
     to the output paths, in spacy DocBin format.
 """
 import logging
+import time
 import spacy
 import typer
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from copy import copy
 from pathlib import Path
 from typing_extensions import Annotated
-from spacy.language import Language
-from spacy.tokens import DocBin
+from classes.docbin_writer import DocBinWriter
+from classes.doc_cache import DocCache
+from classes.corpus_reader import LABELS_FILENAME, write_labels
 from adapters.train import TrainAdapter
 from adapters.scb import SCBAdapter
+from definitions import ROOT_DIR
 
+# The docs of every data set are cached in {DOC_CACHE_DIR}/{split}.sqlite (see DocCache)
+DOC_CACHE_DIR = Path(ROOT_DIR) / "cache" / "preprocess"
 
-def create_doc_for_company(labels: dict, company: dict, nlp: Language,  min_data_length: int):
+# Only the fields that are needed to create the docs are read from the data sets
+DATA_SET_PROJECTION = {"company_id": 1, "branch_codes": 1, "data.data": 1}
+
+
+def company_text(company: dict, min_data_length: int):
     """
-    Create a spacy Doc object with the given labels and company data.
+    Concatenate all data points (data per url) into one text per company.
 
-    :param labels (dict): Dictionary of labels.
     :param company (dict): Company to process.
-    :param nlp (spacy.Language): Language model to use for processing.
     :param min_data_length (int): Minimum length of data to include in the document.
-    :return (spacy.Doc): Processed Doc object.
+    :return (str): The text, or None if it is too short.
     """
-    text = str()
+    text = "".join(" " + data_point["data"] for data_point in company["data"])
 
-    """
-    Concatenate all data points (data per url) into one document per company
-    """
-    for data_point in company["data"]:
-        text = text + " " + data_point["data"]
-    
     if len(text) >= 1000000: # Spacy has a limit of 1000000 characters per document
         text = text[:1000000]
         logging.debug(f"Truncated company text to 1000000 characters")
     if len(text) < min_data_length:
         logging.debug(f"Skipping company with too short text length: {len(text)}")
         return None
-    
+
     logging.debug("Processed company_id: %s, SNI: %s, document length: %s", company["company_id"], company['branch_codes'][0], len(text))
-    doc = nlp.make_doc(text)
-    labels_copy = copy(labels) # Copy needed to avoid reference to same dictionary
-    labels_copy[company["branch_codes"][0]] = 1
-    doc.cats = labels_copy
-    return doc
+    return text
+
+
+def preprocess_split(split: str, output_path: Path, labels: dict, min_data_length: int,
+                     n_process: int, batch_size: int, shard_size: int, dense_cats: bool = True,
+                     doc_cache_path: Path = None) -> dict:
+    """
+    Tokenizes one data set (streamed from the database) with nlp.pipe
+    and writes the docs to the output path as they are created.
+
+    :param split (str): "train", "dev" or "test".
+    :param output_path (Path): The output file, or directory of shards (see DocBinWriter).
+    :param labels (dict): Dictionary of labels.
+    :param dense_cats (bool): If true, doc.cats has every label (0 for all but the true label),
+        otherwise only the true label, which classes.corpus_reader fills in when the corpus is read.
+    :param min_data_length (int): Minimum length of data to include in the document.
+    :param n_process (int): Number of processes used by nlp.pipe.
+    :param batch_size (int): Number of texts per nlp.pipe batch.
+    :param shard_size (int): Number of docs per shard, or 0 to write a single file.
+    :param doc_cache_path (Path): If given, only the texts that aren't in this doc cache are tokenized,
+        the other docs are copied from the cache. Docs that aren't used are removed from the cache.
+    :return (dict): The label counts and total length of the docs, the number of docs (and of cached docs)
+        and the elapsed seconds.
+    """
+    start = time.perf_counter()
+    nlp = spacy.blank("sv")
+    nlp.max_length = 20000000
+    train_adapter = TrainAdapter()
+    companies = {
+        "train": train_adapter.fetch_train_set,
+        "dev": train_adapter.fetch_dev_set,
+        "test": train_adapter.fetch_test_set,
+    }[split](DATA_SET_PROJECTION)
+
+    cache = DocCache(doc_cache_path, nlp) if doc_cache_path is not None else None
+    # The docs in data set order: (key, label, text length) of a cached doc, or None for a doc that is tokenized
+    pending = deque()
+
+    def texts():
+        for company in companies:
+            text = company_text(company, min_data_length)
+            if text is None:
+                continue
+            label = company["branch_codes"][0]
+            key = cache.make_key(text) if cache is not None else None
+            if key is not None and key in cache:
+                pending.append((key, label, len(text)))
+            else:
+                pending.append(None)
+                yield text, (key, label)
+
+    def cats(label):
+        if dense_cats:
+            labels_copy = copy(labels) # Copy needed to avoid reference to same dictionary
+            labels_copy[label] = 1
+            return labels_copy
+        return {label: 1}
+
+    results = {"labels": {}, "total_length": 0, "cached_docs": 0}
+
+    def count(label, length):
+        results['labels'][label] = results['labels'].get(label, 0) + 1
+        results['total_length'] += length
+
+    def write_cached(writer):
+        # Writes the cached docs that come before the next tokenized doc
+        while pending and pending[0] is not None:
+            key, label, length = pending.popleft()
+            writer.merge(cache.get(key, cats(label)))
+            count(label, length)
+            results["cached_docs"] += 1
+
+    with DocBinWriter(output_path, shard_size) as writer:
+        for doc, (key, label) in nlp.pipe(texts(), as_tuples=True, n_process=n_process, batch_size=batch_size):
+            write_cached(writer)
+            pending.popleft()
+            doc.cats = cats(label)
+            if cache is not None:
+                writer.merge(cache.set(key, doc))
+            else:
+                writer.add(doc)
+            count(label, len(doc.text))
+        write_cached(writer)
+
+    if cache is not None:
+        evicted = cache.evict_unused()
+        cache.close()
+        logging.info("Copied %s %s documents from the doc cache, tokenized %s (removed %s unused documents from the cache)",
+                     results["cached_docs"], split, writer.docs - results["cached_docs"], evicted)
+    results["docs"] = writer.docs
+    results["seconds"] = time.perf_counter() - start
+    logging.info("Saved %s data to %s (%s documents, %s shards)", split, output_path, writer.docs, writer.shards)
+    return results
 
 
 def log_results(results: dict):
@@ -64,10 +155,15 @@ def log_results(results: dict):
 
 
 def main(
-        output_train_path: Annotated[Path, typer.Argument(...,dir_okay=False)],
-        output_dev_path: Annotated[Path, typer.Argument(...,dir_okay=False)],
-        output_test_path: Annotated[Path, typer.Argument(...,dir_okay=False)],
-        min_data_length: Annotated[int, typer.Argument()] = 300
+        output_train_path: Annotated[Path, typer.Argument(...,dir_okay=True)],
+        output_dev_path: Annotated[Path, typer.Argument(...,dir_okay=True)],
+        output_test_path: Annotated[Path, typer.Argument(...,dir_okay=True)],
+        min_data_length: Annotated[int, typer.Argument()] = 300,
+        n_process: Annotated[int, typer.Argument(help="Number of tokenizer processes per data set.")] = 1,
+        batch_size: Annotated[int, typer.Argument(help="Number of texts per tokenizer batch.")] = 64,
+        shard_size: Annotated[int, typer.Argument(help="Number of docs per .spacy shard (0 for a single file per data set).")] = 0,
+        parallel_splits: Annotated[bool, typer.Argument(help="If true, train, dev and test are processed at the same time.")] = False,
+        incremental: Annotated[bool, typer.Argument(help="If true, only new or changed texts are tokenized, the other docs are copied from the doc cache.")] = False
     ):
     """
     Preprocess the input data and save the processed documents to the output paths.
@@ -76,59 +172,60 @@ def main(
     :param output_dev_path (Path): Path to save the processed evaluation documents.
     :param output_test_path (Path): Path to save the processed test documents.
     :param min_data_length (int): Minimum length of data to include in the document.
+    :param n_process (int): Number of processes that nlp.pipe tokenizes each data set with.
+    :param batch_size (int): Number of texts sent to a tokenizer process at a time.
+    :param shard_size (int): If above 0, every output path is a directory of .spacy files
+        with this many docs each, which are written as they fill up
+        (spaCy reads the directory like a single file). Otherwise all docs of a data set
+        are kept in memory and written to a single file.
+    :param parallel_splits (bool): If true, the three data sets are processed in separate processes.
+    :param incremental (bool): If true, the docs are cached in DOC_CACHE_DIR (cache/preprocess), keyed on their text
+        and the tokenizer, and only the texts that aren't cached are tokenized. The docs that aren't in the
+        data sets any more are removed from the cache, and the folder can be deleted to clear it.
+        The corpora are still written in full, in data set order.
+
+    The train and dev docs only store their true label, and all labels are written once
+    to labels.json next to the training data (see classes.corpus_reader, which densifies
+    the labels for spacy train). The test docs keep all labels, for spacy benchmark.
     """
-    nlp = spacy.blank("sv")
-    nlp.max_length = 20000000
-    doc_train = DocBin()
-    doc_eval = DocBin()
-    doc_test = DocBin()
-
     scb_adapter = SCBAdapter(init_api=True)
-    train_adapter = TrainAdapter()
 
-    label_count = {"total_length": 0, "labels": {}}
     labels = {}
     for label in scb_adapter.fetch_codes():
         labels[label] = 0
 
-    for company in train_adapter.fetch_train_set():
-        doc = create_doc_for_company(labels, company, nlp, min_data_length)
-        if doc is not None:
-            doc_train.add(doc)
-            label_count['labels'][company['branch_codes'][0]] = label_count['labels'].get(company['branch_codes'][0], 0) + 1
-            label_count['total_length'] = label_count.get('total_length', 0) + len(doc.text)
-            
-    for company in train_adapter.fetch_dev_set():
-        doc = create_doc_for_company(labels, company, nlp, min_data_length)
-        if doc is not None:
-            doc_eval.add(doc)
-            label_count['labels'][company['branch_codes'][0]] = label_count['labels'].get(company['branch_codes'][0], 0) + 1
-            label_count['total_length'] = label_count.get('total_length', 0) + len(doc.text)
-    for company in train_adapter.fetch_test_set():
-        doc = create_doc_for_company(labels, company, nlp, min_data_length)
-        if doc is not None:
-            doc_test.add(doc)
-            label_count['labels'][company['branch_codes'][0]] = label_count['labels'].get(company['branch_codes'][0], 0) + 1
-            label_count['total_length'] = label_count.get('total_length', 0) + len(doc.text)
-
-    # Remove old corpus files
-    output_dev_path.unlink(missing_ok=True)
-    output_train_path.unlink(missing_ok=True)
-    output_test_path.unlink(missing_ok=True)
-    logging.debug("Removed old corpus files")
-
-    doc_train.to_disk(output_train_path)
-    logging.info("Saved training data to %s", output_train_path)
-    logging.info("Number of documents in training data: %s", len(doc_train))
-
-    doc_eval.to_disk(output_dev_path)
-    logging.info("Saved evaluation data to %s", output_dev_path)
-    logging.info("Number of documents in evaluation data: %s", len(doc_eval))
-
-    doc_test.to_disk(output_test_path)
-    logging.info("Saved test data to %s", output_test_path)
-    logging.info("Number of documents in test data: %s", len(doc_test))
+    labels_path = output_train_path.parent / LABELS_FILENAME
+    write_labels(labels_path, labels)
+    logging.info("Saved %s labels to %s", len(labels), labels_path)
+
+    splits = {"train": output_train_path, "dev": output_dev_path, "test": output_test_path}
+    arguments = (labels, min_data_length, n_process, batch_size, shard_size)
 
+    def split_arguments(split):
+        doc_cache_path = DOC_CACHE_DIR / f"{split}.sqlite" if incremental else None
+        return (split == "test", doc_cache_path)
+
+    start = time.perf_counter()
+    if parallel_splits:
+        with ProcessPoolExecutor(max_workers=len(splits)) as executor:
+            futures = {split: executor.submit(preprocess_split, split, path, *arguments, *split_arguments(split)) for split, path in splits.items()}
+            results = {split: future.result() for split, future in futures.items()}
+    else:
+        results = {split: preprocess_split(split, path, *arguments, *split_arguments(split)) for split, path in splits.items()}
+    elapsed = time.perf_counter() - start
+
+    label_count = {"total_length": 0, "labels": {}}
+    for split, result in results.items():
+        logging.info("Number of documents in %s data: %s (%.1f docs/s)",
+                     split, result["docs"], result["docs"] / result["seconds"] if result["seconds"] > 0 else 0)
+        for label, count in result["labels"].items():
+            label_count['labels'][label] = label_count['labels'].get(label, 0) + count
+        label_count['total_length'] += result["total_length"]
+
+    docs = sum(result["docs"] for result in results.values())
+    cores = n_process * (len(splits) if parallel_splits else 1)
+    logging.info("Preprocessed %s documents in %.1f seconds with %s process(es): %.1f docs/s, %.1f docs/s per core",
+                 docs, elapsed, cores, docs / elapsed if elapsed > 0 else 0, docs / elapsed / cores if elapsed > 0 else 0)
     logging.info("Preprocessing finished!")
     log_results(label_count)
 
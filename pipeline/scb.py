@@ -2,10 +2,37 @@
 Polls SCB
 """
 from pathlib import Path
+import typer
+from typing_extensions import Annotated
 from adapters.scb import SCBAdapter
 
+def main(
+            fetch_limit: Annotated[int, typer.Argument(help="Maximum number of companies fetched per SNI code.")] = 50,
+            workers: Annotated[int, typer.Argument(help="Number of SNI codes harvested at the same time (1 = serial).")] = 1,
+            rate_limit: Annotated[float, typer.Argument(help="Maximum average number of requests per second.")] = 1.0,
+            burst: Annotated[int, typer.Argument(help="Maximum number of requests sent at once.")] = 10,
+            use_cache: Annotated[bool, typer.Argument(help="Answer repeated count and fetch requests from the response cache.")] = True):
+    """
+    Fetches companies for every SNI code from the SCB API and stores them in the database.
+
+    :param fetch_limit (int): Maximum number of companies fetched per SNI code.
+    :param workers (int): If more than 1, harvests this many SNI codes concurrently,
+        with one client-certificate session per worker. The concurrent harvest
+        checkpoints every finished SNI code, and resumes from the checkpoints.
+    :param rate_limit (float): Maximum average number of requests per second, shared by all workers.
+    :param burst (int): Maximum number of requests that are sent at once.
+    :param use_cache (bool): If true, the responses to count and fetch requests are cached on disk,
+        so a re-run over an already harvested range sends almost no requests.
+    """
+    scb = SCBAdapter(init_api=True, use_cache=use_cache)
+    if workers > 1:
+        scb.fetch_all_companies_from_api_concurrently(
+            fetch_limit=fetch_limit, workers=workers,
+            rate_limit=rate_limit, burst=burst)
+    else:
+        scb.fetch_all_companies_from_api(fetch_limit=fetch_limit)
+
 if __name__ == "__main__":
     from aux_functions.logger_config import conf_logger
     conf_logger(Path(__file__).stem)
-    scb = SCBAdapter(init_api=True)
-    scb.fetch_all_companies_from_api(fetch_limit=50)
+    typer.run(main)
@@ -5,24 +5,40 @@ import logging
 import typer
 from annotated_types import Annotated
 from pathlib import Path
-from classes.scraper import Scraper
+from classes.scraper import Scraper, POOL_SIZE, DNS_CACHE_TTL, MAX_PAGE_BYTES, CONNECT_TIMEOUT, READ_TIMEOUT, DOWNLOAD_TIMEOUT
+from classes.page_store import StorageFormat
 from adapters.scb import SCBAdapter
 
 def main(
     scrape_output_folder: Path = typer.Argument(..., dir_okay=True),
     follow_links: Annotated[bool, typer.Argument(help="If true, the scraper will follow links on the start pages.")] = False,
-    filter_: Annotated[bool, typer.Argument(help="If true, the scraper will filter out certain urls.")] = False):
+    filter_: Annotated[bool, typer.Argument(help="If true, the scraper will filter out certain urls.")] = False,
+    concurrency: Annotated[int, typer.Argument(help="If above 0, the sites are crawled concurrently with this many requests in flight.")] = 0,
+    per_domain_limit: Annotated[int, typer.Argument(help="Maximum number of concurrent requests per domain (only used if concurrency is above 0).")] = 2,
+    storage_format: Annotated[StorageFormat, typer.Argument(help="json (one file per page) or sharded (gzip-compressed shards).")] = StorageFormat.JSON,
+    batch_size: Annotated[int, typer.Argument(help="Number of companies read from the db at a time.")] = 1000,
+    pool_size: Annotated[int, typer.Argument(help="Number of kept-alive connections per host (0 for a new connection per request).")] = POOL_SIZE,
+    dns_cache_ttl: Annotated[int, typer.Argument(help="Number of seconds that resolved host names are cached (only used if concurrency is above 0).")] = DNS_CACHE_TTL,
+    max_page_bytes: Annotated[int, typer.Argument(help="Pages larger than this are rejected, or their download is aborted.")] = MAX_PAGE_BYTES,
+    connect_timeout: Annotated[float, typer.Argument(help="Maximum number of seconds to wait for a connection.")] = CONNECT_TIMEOUT,
+    read_timeout: Annotated[float, typer.Argument(help="Maximum number of seconds to wait for the next data from a server.")] = READ_TIMEOUT,
+    download_timeout: Annotated[float, typer.Argument(help="Maximum number of seconds that a download may take in total.")] = DOWNLOAD_TIMEOUT):
 
     scb_adapter = SCBAdapter()
 
-    logging.info("Started fetching companies from db...")
-    companies = scb_adapter.fetch_all_companies_from_db(has_url="ONLY")
-    logging.info("Finished fetching companies from db...")
-    start_urls = [{'label':company['org_nr'], 'url':company["url"]} for company in companies]
+    # The companies are streamed from the db while the sites are crawled
+    companies = scb_adapter.iter_all_companies_from_db(
+        has_url="ONLY", projection={"org_nr": 1, "url": 1}, batch_size=batch_size)
+    start_urls = ({'label':company['org_nr'], 'url':company["url"]} for company in companies)
 
     logging.info("Started scraping...")
-    scraper = Scraper(scrape_output_folder)
-    scraper.scrape_all(start_urls,follow_links, filter_)
+    scraper = Scraper(scrape_output_folder, storage_format, pool_size, dns_cache_ttl,
+                      max_page_bytes, connect_timeout, read_timeout, download_timeout)
+    if concurrency > 0:
+        scraper.scrape_all_async(start_urls, follow_links, filter_,
+                                 max_concurrency=concurrency, per_domain_limit=per_domain_limit)
+    else:
+        scraper.scrape_all(start_urls,follow_links, filter_)
     logging.info("Finished scraping!")
 
 if __name__ == "__main__":
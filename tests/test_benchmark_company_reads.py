@@ -0,0 +1,15 @@
+"""
+Tests of the company reads benchmark's query plan report.
+"""
+from pipeline.benchmark_company_reads import _plan_stages
+
+
+def test_plan_stages():
+    index_order = {"queryPlanner": {"winningPlan": {
+        "stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}}}
+    assert _plan_stages(index_order) == ["LIMIT", "FETCH", "IXSCAN"]
+    # The slot based engine's plan, with an in-memory sort of two index scans
+    sorted_in_memory = {"queryPlanner": {"winningPlan": {"queryPlan": {
+        "stage": "SORT", "inputStage": {"stage": "FETCH", "inputStage": {
+            "stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "IXSCAN"}]}}}}}}
+    assert _plan_stages(sorted_in_memory) == ["SORT", "FETCH", "OR", "IXSCAN"]
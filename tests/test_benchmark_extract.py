@@ -0,0 +1,24 @@
+"""
+Tests of the extraction benchmark, on the golden pages saved like scraped pages.
+"""
+from classes.extract import PARSERS
+from classes.page_store import StorageFormat, open_page_store
+from pipeline.benchmark_extract import main
+from tests.test_extract import GOLDEN_PAGES
+
+
+def test_benchmark_reports_every_parser(tmp_path):
+    store = open_page_store(tmp_path, StorageFormat.SHARDED)
+    for i, path in enumerate(GOLDEN_PAGES):
+        store.save({"label": "01110", "url": f"https://example.se/{path.name}", "raw_html": path.read_text(encoding="utf-8")}, str(i))
+    store.close()
+
+    results = main(tmp_path, max_pages=0)
+    assert list(results) == list(PARSERS)
+    for parser in PARSERS:
+        assert results[parser]["pages"] == len(GOLDEN_PAGES)
+        assert results[parser]["pages_per_second"] > 0
+    for parser in PARSERS[1:]:
+        assert results[parser]["differing_pages"] == 0
+
+    assert main(tmp_path, max_pages=3)[PARSERS[0]]["pages"] == 3
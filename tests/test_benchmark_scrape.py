@@ -0,0 +1,22 @@
+"""
+Tests of the crawlers' kept-alive connections, with the scrape benchmark and its local server.
+"""
+import pytest
+from pipeline.benchmark_scrape import main
+
+SITES = 4
+LINKS_PER_SITE = 3
+POOL_SIZE = 4
+
+
+@pytest.mark.parametrize("concurrency", [0, POOL_SIZE])
+def test_connections_are_kept_alive(concurrency):
+    results = main(SITES, LINKS_PER_SITE, concurrency, POOL_SIZE, latency_ms=0.0, compare=True)
+    pages = SITES * (1 + LINKS_PER_SITE)
+    for summary in results.values():
+        assert summary["pages"] == pages
+        assert summary["failures"] == {}
+    # Without keep-alive every page opens a connection
+    assert results[0]["connections"] == pages
+    # With it, the synchronous crawler reuses one connection, and the concurrent one at most a pool
+    assert 1 <= results[POOL_SIZE]["connections"] <= (POOL_SIZE if concurrency else 1)
@@ -0,0 +1,54 @@
+"""
+Tests of the persistent cache's buffered access times.
+"""
+import time
+import classes.cache
+from classes.cache import PersistentCache
+
+
+def accessed(cache, key):
+    return cache.connection.execute("SELECT accessed FROM entries WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_hits_are_not_written_one_by_one(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes.cache, "ACCESS_BATCH_SIZE", 10)
+    cache = PersistentCache(tmp_path / "cache.sqlite")
+    for i in range(20):
+        cache.set(str(i), b"value")
+    changes = cache.connection.total_changes
+    for i in range(9):
+        assert cache.get(str(i)) == b"value"
+        assert cache.get(str(i)) == b"value"
+    assert cache.connection.total_changes == changes
+    # The tenth entry that is read writes the buffered access times
+    cache.get("9")
+    assert cache.connection.total_changes == changes + 10
+    cache.close()
+
+
+def test_evictions_see_the_buffered_hits(tmp_path):
+    cache = PersistentCache(tmp_path / "cache.sqlite", max_entries=3)
+    for key in "abc":
+        cache.set(key, key.encode())
+    since = time.time()
+    cache.get("a")
+    # The least recently used entry is b, since a was read
+    cache.set("d", b"d")
+    assert "a" in cache and "b" not in cache
+
+    assert cache.evict_unused(since) == 1
+    assert "a" in cache and "c" not in cache and "d" in cache
+    cache.close()
+
+
+def test_close_writes_the_buffered_hits(tmp_path):
+    cache = PersistentCache(tmp_path / "cache.sqlite")
+    cache.set("a", b"a")
+    written = accessed(cache, "a")
+    time.sleep(0.01)
+    cache.get("a")
+    cache.close()
+
+    cache = PersistentCache(tmp_path / "cache.sqlite")
+    assert accessed(cache, "a") > written
+    cache.close()
@@ -0,0 +1,52 @@
+"""
+Tests of the dense cats corpus reader against corpora with the dense cats stored in the docs.
+"""
+import random
+import pytest
+import spacy
+from spacy.training import Corpus
+from classes.corpus_reader import create_dense_cats_corpus, densify_cats, read_labels, write_labels
+from classes.docbin_writer import DocBinWriter
+
+
+def test_densify_cats():
+    labels = ["01110", "43320", "62010"]
+    assert list(densify_cats({"62010": 1}, labels).items()) == [("01110", 0), ("43320", 0), ("62010", 1)]
+    # A label that isn't in the index is dropped, like the dense cats never had it
+    assert densify_cats({"99999": 1}, labels) == {"01110": 0, "43320": 0, "62010": 0}
+
+
+def test_labels_round_trip(tmp_path):
+    labels = ["62010", "01110", "43320"]
+    write_labels(tmp_path / "corpus" / "labels.json", labels)
+    assert read_labels(tmp_path / "corpus" / "labels.json") == labels
+
+
+@pytest.mark.parametrize("shard_size", [0, 7])
+def test_examples_match_the_dense_corpus(tmp_path, shard_size):
+    rnd = random.Random(shard_size)
+    nlp = spacy.blank("sv")
+    labels = {f"{rnd.randint(1, 99):02d}{i:03d}": 0 for i in range(40)}
+    labels_path = tmp_path / "labels.json"
+    write_labels(labels_path, labels)
+
+    # The docs as preprocess writes them: with every label (the old format), or only the true label
+    with DocBinWriter(tmp_path / "dense.spacy", shard_size) as dense, \
+         DocBinWriter(tmp_path / "sparse.spacy", shard_size) as sparse:
+        for i in range(30):
+            label = rnd.choice(list(labels))
+            text = f"Företag {i} med kod {label}. " * rnd.randint(1, 5)
+            doc = nlp(text)
+            doc.cats = {**labels, label: 1}
+            dense.add(doc)
+            doc = nlp(text)
+            doc.cats = {label: 1}
+            sparse.add(doc)
+
+    expected = [example.to_dict() for example in Corpus(tmp_path / "dense.spacy")(nlp)]
+    read = create_dense_cats_corpus(tmp_path / "sparse.spacy", labels_path)
+    examples = [example.to_dict() for example in read(nlp)]
+    assert len(examples) == 30
+    assert examples == expected
+    # The same label order too, since the textcat components take their labels in that order
+    assert [list(example["doc_annotation"]["cats"]) for example in examples] == [list(labels)] * 30
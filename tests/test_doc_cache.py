@@ -0,0 +1,104 @@
+"""
+Tests of DocCache: cached docs against freshly tokenized docs. The cache stores DocBin's internals
+(tokens, spaces, span groups, flags and strings), so these tests catch a change of their layout.
+"""
+import spacy
+from spacy.tokens import DocBin
+from spacy.training import Corpus
+from classes.doc_cache import DocCache
+from classes.docbin_writer import DocBinWriter
+
+TEXTS = [
+    "Företaget AB säljer markiser och solskydd i Stockholm.",
+    "Hej på dig!  Två mellanslag,\tflikar\noch radbrytningar.\n\n",
+    "Emojis 😀 och tecken ☀ | #hashtag 08-123 45 67 info@företaget.se https://företaget.se/om-oss",
+    "",
+    "   ",
+    "漢字 и кириллица, ÅÄÖ åäö ÆØ æø",
+]
+CATS = {"43320": 1, "47520": 0}
+
+
+def fresh_doc(text):
+    # A new pipeline, so that no strings are shared with the cached docs
+    doc = spacy.blank("sv")(text)
+    doc.cats = dict(CATS)
+    return doc
+
+
+def read_doc(doc_bin):
+    docs = list(doc_bin.get_docs(spacy.blank("sv").vocab))
+    assert len(docs) == 1
+    return docs[0]
+
+
+def assert_same_doc(doc, expected):
+    assert doc.text == expected.text
+    assert [token.text for token in doc] == [token.text for token in expected]
+    assert [token.whitespace_ for token in doc] == [token.whitespace_ for token in expected]
+    assert doc.cats == expected.cats
+    assert (DocBin(docs=[doc]).tokens[0] == DocBin(docs=[expected]).tokens[0]).all()
+
+
+def test_cached_docs_are_the_tokenized_docs(tmp_path):
+    nlp = spacy.blank("sv")
+    cache = DocCache(tmp_path / "docs.sqlite", nlp)
+    for text in TEXTS:
+        key = cache.make_key(text)
+        assert key not in cache
+        assert cache.get(key, CATS) is None
+        doc = nlp(text)
+        doc.cats = dict(CATS)
+        assert_same_doc(read_doc(cache.set(key, doc)), fresh_doc(text))
+    cache.close()
+
+    # A later preprocessing run gets the docs from the cache
+    cache = DocCache(tmp_path / "docs.sqlite", spacy.blank("sv"))
+    for text in TEXTS:
+        key = cache.make_key(text)
+        assert key in cache
+        assert_same_doc(read_doc(cache.get(key, CATS)), fresh_doc(text))
+    assert cache.make_key(TEXTS[0] + " ") not in cache
+    cache.close()
+
+
+def test_changed_tokenizer_misses_the_cache(tmp_path):
+    cache = DocCache(tmp_path / "docs.sqlite", spacy.blank("sv"))
+    key = cache.make_key(TEXTS[0])
+    cache.set(key, fresh_doc(TEXTS[0]))
+    cache.close()
+
+    nlp = spacy.blank("sv")
+    nlp.tokenizer.add_special_case("AB", [{"ORTH": "A"}, {"ORTH": "B"}])
+    cache = DocCache(tmp_path / "docs.sqlite", nlp)
+    assert cache.make_key(TEXTS[0]) != key
+    assert cache.make_key(TEXTS[0]) not in cache
+    cache.close()
+
+
+def test_cached_and_tokenized_docs_are_read_like_tokenized_docs(tmp_path):
+    # spacy's Corpus skips empty docs (which preprocess doesn't write)
+    texts = [text for text in TEXTS if text]
+    nlp = spacy.blank("sv")
+    cache = DocCache(tmp_path / "docs.sqlite", nlp)
+    for text in texts[::2]:
+        cache.set(cache.make_key(text), nlp(text))
+
+    # Like preprocess: cached docs are merged, the others are tokenized (and cached)
+    with DocBinWriter(tmp_path / "train", shard_size=4) as writer:
+        for i, text in enumerate(texts):
+            cats = {"43320": i % 2, "47520": 1 - i % 2}
+            key = cache.make_key(text)
+            if key in cache:
+                writer.merge(cache.get(key, cats))
+            else:
+                doc = nlp(text)
+                doc.cats = cats
+                writer.merge(cache.set(key, doc))
+    cache.close()
+
+    examples = list(Corpus(tmp_path / "train")(spacy.blank("sv")))
+    assert [example.reference.text for example in examples] == texts
+    assert [example.reference.cats for example in examples] == [{"43320": i % 2, "47520": 1 - i % 2} for i in range(len(texts))]
+    for example, text in zip(examples, texts):
+        assert [token.text for token in example.reference] == [token.text for token in nlp(text)]
@@ -0,0 +1,67 @@
+"""
+Tests of DocBinWriter: its files and shards, read back like spacy train reads them.
+"""
+import pytest
+import spacy
+from spacy.tokens import DocBin
+from spacy.training import Corpus
+from classes.docbin_writer import DocBinWriter
+
+
+@pytest.fixture(scope="module")
+def nlp():
+    return spacy.blank("sv")
+
+
+def make_docs(nlp, n):
+    docs = []
+    for i in range(n):
+        doc = nlp(f"Företaget {i} säljer markiser  och solskydd.\n")
+        doc.cats = {"43320": float(i % 2), "47520": float(1 - i % 2)}
+        docs.append(doc)
+    return docs
+
+
+def read_corpus(nlp, path):
+    return [(example.reference.text, example.reference.cats) for example in Corpus(path)(nlp)]
+
+
+@pytest.mark.parametrize("shard_size, shards", [(0, 0), (10, 3), (25, 1), (100, 1)])
+def test_corpus_reads_the_docs_in_order(nlp, tmp_path, shard_size, shards):
+    docs = make_docs(nlp, 25)
+    path = tmp_path / "train.spacy"
+    with DocBinWriter(path, shard_size) as writer:
+        for doc in docs:
+            writer.add(doc)
+    assert writer.docs == 25
+    assert writer.shards == shards
+    if shard_size > 0:
+        assert sorted(shard.name for shard in path.iterdir()) == [f"{i:04d}.spacy" for i in range(shards)]
+    assert read_corpus(nlp, path) == [(doc.text, doc.cats) for doc in docs]
+
+
+def test_merged_doc_bins_are_read_like_added_docs(nlp, tmp_path):
+    docs = make_docs(nlp, 7)
+    with DocBinWriter(tmp_path / "merged", shard_size=3) as writer:
+        writer.add(docs[0])
+        writer.merge(DocBin(docs=docs[1:5]))
+        for doc in docs[5:]:
+            writer.merge(DocBin(docs=[doc]))
+    assert writer.docs == 7
+    assert read_corpus(nlp, tmp_path / "merged") == [(doc.text, doc.cats) for doc in docs]
+
+
+def test_existing_output_is_replaced(nlp, tmp_path):
+    path = tmp_path / "train.spacy"
+    with DocBinWriter(path, shard_size=2) as writer:
+        for doc in make_docs(nlp, 5):
+            writer.add(doc)
+    # A single file replaces the directory of shards, and fewer shards replace the old ones
+    with DocBinWriter(path) as writer:
+        writer.add(make_docs(nlp, 1)[0])
+    assert path.is_file()
+    with DocBinWriter(path, shard_size=2) as writer:
+        for doc in make_docs(nlp, 3):
+            writer.add(doc)
+    assert sorted(shard.name for shard in path.iterdir()) == ["0000.spacy", "0001.spacy"]
+    assert len(read_corpus(nlp, path)) == 3
@@ -0,0 +1,100 @@
+"""
+Tests of ScoreMatrixEvaluator against the per document evaluation that it replaced.
+"""
+import random
+import numpy
+import pytest
+from classes.evaluator import ScoreMatrixEvaluator
+
+
+def reference_evaluation(predictions, true_label, top_n):
+    """
+    The per document evaluation of pipeline/evaluate.py before ScoreMatrixEvaluator.
+    """
+    results = {}
+    sorted_predictions = sorted(predictions.items(), key=lambda x: x[1], reverse=True)
+    for i,(label, _) in enumerate(sorted_predictions):
+        if label == true_label:
+                if i == 0:
+                    results['correct_label'] = 1
+                if i < top_n:
+                    results[f'top_{top_n}_label'] = 1
+
+        if label[:2] == true_label[:2]:
+            if i == 0:
+                results['correct_category'] = 1
+            if i < top_n:
+                results[f'top_{top_n}_category'] = 1
+            results['weighted_category_score'] = 1 * (1/(i+1))
+
+    return {'label': true_label, 'results': results}
+
+
+def reference_update_label_results(total_results, point_results):
+    """
+    The per document aggregation of pipeline/evaluate.py before ScoreMatrixEvaluator.
+    """
+    if point_results['label'] not in total_results:
+        total_results[point_results['label']] = point_results['results']
+    else:
+        for key in point_results['results']:
+            total_results[point_results['label']][key] = total_results[point_results['label']].get(key, 0) + point_results['results'][key]
+    if 'skipped' not in point_results['results'].keys():
+        total_results[point_results['label']]['label_count'] = total_results[point_results['label']].get('label_count', 0) + 1
+    return total_results
+
+
+def random_evaluation(seed):
+    """
+    Evaluates random predictions with both implementations. The scores are drawn from a few levels
+        (or are continuous) so that ties are common, some true labels aren't labels of the model,
+        and some documents are skipped.
+    :returns: the evaluator, the reference label results and the (cats, true label) of every document.
+    """
+    rnd = random.Random(seed)
+    labels = rnd.sample([f"{a:02d}{b:03d}" for a in range(10, 30) for b in range(0, 200, 7)], rnd.randint(1, 40))
+    unknown = ["99999", "10abc", "77000"]
+    levels = rnd.choice([0, 1, 2, 5, 100])
+    top_n = rnd.randint(1, 6)
+    evaluator = ScoreMatrixEvaluator(top_n, chunk_size=rnd.choice([1, 3, 64, 4096]))
+    reference = {}
+    documents = []
+    for _ in range(rnd.randint(1, 400)):
+        true_label = rnd.choice(labels + unknown if rnd.random() < 0.1 else labels)
+        if rnd.random() < 0.1:
+            reference_update_label_results(reference, {'label': true_label, 'results': {'skipped': 1}})
+            evaluator.add_skipped(true_label)
+            continue
+        cats = {label: (rnd.randint(0, levels) / levels if levels else rnd.random()) for label in labels}
+        reference_update_label_results(reference, reference_evaluation(cats, true_label, top_n))
+        evaluator.add(cats, true_label)
+        documents.append((cats, true_label))
+    return evaluator, reference, documents
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_label_results_match_the_reference(seed):
+    evaluator, reference, _ = random_evaluation(seed)
+    results = evaluator.label_results()
+    assert results == reference
+    # The same types too (ints for counts, floats for scores), since they are logged and serialized
+    assert {label: {key: type(value) for key, value in values.items()} for label, values in results.items()} == \
+           {label: {key: type(value) for key, value in values.items()} for label, values in reference.items()}
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_confusion_matrix_counts_the_top_predictions(seed):
+    evaluator, _, documents = random_evaluation(seed)
+    labels = evaluator.labels or []
+    expected = numpy.zeros((len(labels), len(labels)), dtype=int)
+    for cats, true_label in documents:
+        if true_label in labels:
+            # The first of the labels with the highest score, like a stable sort
+            predicted = max(cats.items(), key=lambda item: item[1])[0]
+            expected[labels.index(true_label), labels.index(predicted)] += 1
+    assert (evaluator.confusion_matrix() == expected).all()
+
+    for i, label in enumerate(labels):
+        scores = evaluator.precision_recall()[label]
+        assert scores['precision'] == (expected[i, i] / expected[:, i].sum() if expected[:, i].sum() else None)
+        assert scores['recall'] == (expected[i, i] / expected[i].sum() if expected[i].sum() else None)
@@ -0,0 +1,223 @@
+"""
+Tests of DataExtractor against the implementations it replaced: the character filter on
+random strings, and the extracted text on a large generated page.
+"""
+import random
+from collections import Counter
+from pathlib import Path
+import pytest
+import regex as re
+from classes.extract import DataExtractor, create_extractor, PARSERS
+
+PARAGRAPHS = 70000
+# Stored pages that every parser backend must extract the same text from: company pages
+# (as written by common site builders and CMSs) and the documentation pages of this project
+GOLDEN_PAGES = sorted((Path(__file__).parent / "data" / "golden_pages").glob("*.html")) + \
+               sorted((Path(__file__).parent.parent / "docs").rglob("*.html"))
+
+
+def generated_page(paragraphs=PARAGRAPHS):
+    """
+    A page with over 100k text nodes: paragraphs with repeated texts, years, emojis and hashtags,
+        links, scripts and cookie banners, and meta tags. No two strings with years are
+        next to each other, since the old _filter_list skipped the string after a removed one.
+        The paragraphs are grouped in sections, since BeautifulSoup's decompose takes time
+        in proportion to the number of siblings of the removed tag.
+    """
+    parts = ['<html><head><title>Företaget AB</title>',
+             '<meta name="description" content="Vi säljer markiser">',
+             '<meta property="og:title" content="Företaget AB | Markiser">',
+             '<meta name="description" content="Vi säljer markiser">',
+             '<meta name="keywords" content="markiser, solskydd"></head><body>']
+    for i in range(paragraphs):
+        if i % 6 == 0:
+            parts.append("<section>")
+        match i % 6:
+            case 0:
+                parts.append(f"<p>Text {i % 5000} om <b>företaget</b></p>")
+            case 1:
+                parts.append(f"<p>{1990 + i % 30} grundades företaget</p>")
+            case 2:
+                parts.append(f"<div>Solskydd #{i % 7} 😀 <a href='/om'>Läs mer</a></div>")
+            case 3:
+                parts.append(f"<p>Markiser   i {i % 300} färger | Ring oss</p><script>var x = {i};</script>")
+            case 4:
+                parts.append(f"<div class='cookie-banner'>Vi använder kakor {i}</div><span>år {i % 40}</span>")
+            case 5:
+                parts.append(f"<li>Produkt {i}</li></section>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+# The character filters of DataExtractor before they were combined into character_filter
+REFERENCE_CHARACTER_FILTERS = [
+    re.compile(r'\s{2,}'),  # Remove multiple spaces
+    re.compile(r'\|+'),     # Remove pipes
+    re.compile(r'\n+'),     # Remove newlines
+    re.compile(r'\t+'),     # Remove tabs
+    re.compile(r'\r+'),     # Remove carriage returns
+    re.compile(r"#\w+"),    # Remove hashtags
+    re.compile("["          # Remove emojis and other symbols
+        u"\U0001F600-\U0001F64F"
+        u"\U0001F300-\U0001F5FF"
+        u"\U0001F680-\U0001F6FF"
+        u"\U0001F1E0-\U0001F1FF"
+        u"\U00002702-\U000027B0"
+        u"\U000024C2-\U0001F251"
+        u"\U0001f926-\U0001f937"
+        u"\U00010000-\U0010ffff"
+        u"\u2640-\u2642"
+        u"\u2600-\u2B55"
+        u"\u200d"
+        u"\u23cf"
+        u"\u23e9"
+        u"\u231a"
+        u"\ufe0f"
+        u"\u3030"
+        "]+", flags=re.UNICODE)
+]
+
+# Characters that the filters treat differently: word characters, hashtags, separators,
+# whitespace that is a symbol (the ideographic space), emojis and the ranges' edges
+ALPHABET = ['a', 'b', 'Å', '#', '#', ' ', ' ', '\n', '\t', '\r', '|', '😀', '\u3000', '漢', '\u200d', '\ufe0f',
+            '-', '2', '_', '\xa0', '☀', 'é', '\u24c2', '\u2b55', '\U0010ffff']
+
+
+def reference_filter_chars(text):
+    for character_filter in REFERENCE_CHARACTER_FILTERS:
+        text = character_filter.sub('', text)
+    return text
+
+
+def test_character_filter_matches_the_reference():
+    rnd = random.Random(0)
+    extractor = DataExtractor()
+    for _ in range(50000):
+        text = "".join(rnd.choices(ALPHABET, k=rnd.randint(0, 14)))
+        assert extractor._filter_chars(text) == reference_filter_chars(text), repr(text)
+
+
+def test_character_filter_matches_the_reference_on_extracted_text(page):
+    text = " ".join(extractor_for(page)._extract_body())
+    assert DataExtractor()._filter_chars(text) == reference_filter_chars(text)
+
+
+def reference_filter_list(extractor, lst):
+    """
+    DataExtractor._filter_list before the string pipeline: pops from the list it iterates over.
+    """
+    for i,value in enumerate(lst):
+        for filt in extractor.string_filter_list:
+            if filt.match(value):
+                lst.pop(i)
+
+
+def reference_extract(extractor, filter_=True, p_only=False, extract_meta=True, extract_body=True):
+    """
+    DataExtractor.extract before the string pipeline: duplicates were removed with set(),
+        so the order of the strings depended on the hash seed.
+    :returns: the extracted strings and the extracted text.
+    """
+    strings = []
+    if (extract_body or p_only):
+        body = extractor._extract_body(filter_, p_only)
+        if filter_:
+            reference_filter_list(extractor, body)
+            body = list(set(body))  # remove duplicates
+        strings += body
+
+    if extract_meta:
+        meta = extractor._extract_meta(filter_)
+        if filter_:
+            meta = list(set(meta))  # remove duplicates
+        strings += meta
+
+    s = ""
+    for item in strings:
+        s += item + " "
+    if filter_:
+        s = extractor._filter_chars(s)
+    return strings, s
+
+
+def extractor_for(page):
+    extractor = DataExtractor()
+    extractor.create_soup_from_string(page)
+    return extractor
+
+
+@pytest.fixture(scope="module")
+def large_page():
+    return generated_page()
+
+
+@pytest.fixture(scope="module")
+def page():
+    return generated_page(600)
+
+
+def check_extract(page, filter_, p_only):
+    """
+    Checks extract against reference_extract: the same strings and words,
+        with the strings in the order of the page instead of the order of a set.
+    """
+    reference = extractor_for(page)
+    reference_strings, reference_text = reference_extract(reference, filter_, p_only)
+    extractor = extractor_for(page)
+    strings = list(extractor._extract_strings(filter_, p_only, True, True))
+    text = extractor.extract(filter_, p_only)
+
+    assert Counter(strings) == Counter(reference_strings)
+    if filter_:
+        # The filtered tags are already removed, so the reference extractor gives the unfiltered strings in page order
+        body = list(dict.fromkeys(s for s in reference._extract_body(filter_, p_only) if not s[:4].isdigit()))
+        assert strings == body + list(dict.fromkeys(reference._extract_meta(filter_)))
+    else:
+        assert strings == reference_strings
+    # The character filter works on the joined text, so the words only differ in order
+    assert Counter(text.split(" ")) == Counter(reference_text.split(" "))
+
+
+def test_extract_matches_the_reference_on_a_large_page(large_page):
+    assert len(list(extractor_for(large_page).soup.strings)) > 100000
+    check_extract(large_page, filter_=True, p_only=False)
+
+
+@pytest.mark.parametrize("filter_, p_only", [(True, True), (False, False), (False, True)])
+def test_extract_matches_the_reference(page, filter_, p_only):
+    check_extract(page, filter_, p_only)
+
+
+def test_filter_list_removes_adjacent_matches():
+    extractor = DataExtractor()
+    strings = ["2013 grundat", "1999 flyttade", "Markiser", "2020", "2021", "2022", "Solskydd"]
+    assert list(extractor._filter_list(strings)) == ["Markiser", "Solskydd"]
+    # The old implementation skipped the string after every removed one
+    reference_filter_list(extractor, strings)
+    assert strings == ["1999 flyttade", "Markiser", "2021", "Solskydd"]
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_extract_is_the_same_for_every_parser(page, parser):
+    extractor = create_extractor(parser)
+    extractor.create_soup_from_string(page)
+    assert extractor.extract() == extractor_for(page).extract()
+
+
+def extracted(parser, page, method, *args):
+    extractor = create_extractor(parser)
+    extractor.create_soup_from_string(page)
+    result = getattr(extractor, method)(*args)
+    return result if isinstance(result, str) else list(result)
+
+
+@pytest.mark.parametrize("path", GOLDEN_PAGES, ids=lambda path: path.name)
+@pytest.mark.parametrize("parser", PARSERS[1:])
+def test_golden_pages_are_the_same_for_every_parser(path, parser):
+    page = path.read_text(encoding="utf-8")
+    for filter_ in (True, False):
+        # A fresh extractor for every call, since a filtered extraction removes tags
+        for method in ("_extract_body", "_extract_meta"):
+            assert extracted(parser, page, method, filter_) == extracted(PARSERS[0], page, method, filter_), (method, filter_)
+        assert extracted(parser, page, "extract", filter_) == extracted(PARSERS[0], page, "extract", filter_)
+    assert len(extracted(PARSERS[0], page, "_extract_body", True)) > 0
@@ -0,0 +1,29 @@
+"""
+Tests of the extract pipeline stage's worker pool.
+"""
+from multiprocessing import Pool
+from classes.extract import create_extractor
+from pipeline.extract import _extract_in_pool, _init_worker, extract_text
+
+SETTINGS = (False, True, False)
+
+
+def test_extract_in_pool_keeps_order_and_bounds_the_pages_in_flight():
+    read = 0
+
+    def pages():
+        nonlocal read
+        for i in range(100):
+            read += 1
+            yield {"label": "01110", "url": f"https://{i}.se/", "raw_html": f"<html><body><p>Sida {i}</p></body></html>"}, {"_id": i}
+
+    with Pool(2, initializer=_init_worker, initargs=("html.parser", *SETTINGS)) as pool:
+        results = _extract_in_pool(pool, pages(), workers=2, chunk_size=3)
+        first = next(results)
+        # At most 2 * workers chunks are read ahead
+        assert read <= 2 * 2 * 3
+        results = [first, *results]
+
+    extractor = create_extractor("html.parser")
+    expected = [(item, company, extract_text(extractor, item, *SETTINGS)) for item, company in pages()]
+    assert results == [({"label": item["label"], "url": item["url"]}, company, text) for item, company, text in expected]
@@ -0,0 +1,151 @@
+"""
+Tests of the Google search wrapper and the google pipeline stage, with a fake Custom Search service.
+"""
+from contextlib import contextmanager
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+import classes.google_api_wrapper as google_api_wrapper
+from classes.cache import PersistentCache
+from classes.google_api_wrapper import GoogleSearchAPI
+from pipeline import _google
+
+
+class FakeService():
+    """
+    Answers a search with the url in `results` (no items for ""),
+        or raises an HttpError with the status code in `errors`.
+    """
+    def __init__(self, results=None, errors=None):
+        self.results = results or {}
+        self.errors = errors or {}
+        self.queries = []
+
+    def cse(self):
+        return self
+
+    def list(self, q, **kwargs):
+        self.queries.append(q)
+        self._query = q
+        return self
+
+    def execute(self):
+        if self._query in self.errors:
+            raise HttpError(httplib2.Response({"status": self.errors[self._query]}), b"error")
+        url = self.results.get(self._query, "")
+        return {"items": [{"link": url}]} if url else {}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(google_api_wrapper.time, "sleep", lambda seconds: None)
+
+
+def search_api(service, **kwargs):
+    google = GoogleSearchAPI(**kwargs)
+    google._service = lambda: service
+    return google
+
+
+def test_search_returns_first_result():
+    google = search_api(FakeService(results={"bdx": "https://www.bdx.se/"}))
+    assert google.search("  BDX ") == "https://www.bdx.se/"
+    assert google.search("ssab") == ""
+
+
+def test_search_retries_quota_errors():
+    service = FakeService(errors={"bdx": 429})
+    google = search_api(service, max_retries=3)
+    assert google.search("bdx") is None
+    assert len(service.queries) == 4
+    assert google.requests_sent == 4
+
+
+def test_search_does_not_retry_client_errors():
+    service = FakeService(errors={"bdx": 400})
+    google = search_api(service, max_retries=3)
+    assert google.search("bdx") is None
+    assert len(service.queries) == 1
+
+
+def test_failed_search_is_not_cached(tmp_path):
+    cache = PersistentCache(tmp_path / "search.sqlite")
+    service = FakeService(errors={"bdx": 503})
+    google = search_api(service, cache=cache, max_retries=1)
+    assert google.search("bdx") is None
+    assert google.search("ssab") == ""
+
+    service.errors.clear()
+    service.results["bdx"] = "https://www.bdx.se/"
+    assert google.search("bdx") == "https://www.bdx.se/"
+    # The empty result is cached, so it isn't searched for again
+    assert google.search("ssab") == ""
+    assert google.cache_hits == 1
+    cache.close()
+
+
+def test_batch_search_keeps_query_order():
+    service = FakeService(results={f"company {i}": f"https://{i}.se/" for i in range(20)}, errors={"company 7": 429})
+    google = search_api(service, max_retries=0)
+    urls = google.batch_search([f"company {i}" for i in range(20)], workers=4)
+    assert urls == [f"https://{i}.se/" if i != 7 else None for i in range(20)]
+
+
+class FakeWriter():
+    def __init__(self):
+        self.updated = {}
+        self.deleted = []
+        self.written = 0
+        self.round_trips = 0
+
+    def update_url_for_company(self, org_nr, url):
+        self.updated[org_nr] = url
+
+    def delete_company_from_db(self, org_nr):
+        self.deleted.append(org_nr)
+
+
+class FakeSCBAdapter():
+    companies = {
+        "01110": [
+            {"org_nr": "1", "name": "Kvotbolaget AB"},
+            {"org_nr": "2", "name": "Okänt Aktiebolag"},
+        ],
+        "01120": [
+            {"org_nr": "3", "name": "Hemsidan AB"},
+            {"org_nr": "4", "name": "Facebooksidan AB"},
+        ],
+    }
+
+    def __init__(self, init_api=True):
+        self.writer = FakeWriter()
+
+    def fetch_codes(self):
+        return {code: code for code in self.companies}
+
+    def iter_companies_from_db_by_sni(self, code, has_url, projection):
+        return iter(self.companies[code])
+
+    @contextmanager
+    def buffered_company_writer(self, batch_size):
+        yield self.writer
+
+
+def test_google_stage_only_deletes_companies_without_results(monkeypatch):
+    service = FakeService(
+        results={"hemsidan ab": "https://www.hemsidan.se/", "facebooksidan ab": "https://www.facebook.com/hemsidan"},
+        errors={"kvotbolaget ab": 429})
+    adapters = []
+
+    def scb_adapter(init_api=True):
+        adapters.append(FakeSCBAdapter(init_api))
+        return adapters[-1]
+
+    monkeypatch.setattr(_google, "SCBAdapter", scb_adapter)
+    monkeypatch.setattr(GoogleSearchAPI, "_service", lambda self: service)
+    _google.main(regenerate_urls=False, limit=2, workers=2, rate_limit=1000, use_cache=False)
+
+    writer = adapters[0].writer
+    assert writer.updated == {"3": "https://www.hemsidan.se/"}
+    # The company whose search failed is left untouched
+    assert sorted(writer.deleted) == ["2", "4"]
@@ -0,0 +1,73 @@
+"""
+Tests of the sharded page store: reading, removing and recovering from corrupt records.
+"""
+import gzip
+import json
+import random
+from classes.page_store import ShardedPageStore, READ_SIZE
+
+
+def page(i, size=100):
+    # Random text, so that the pages don't compress to nothing
+    text = random.Random(i).randbytes(size // 2).hex()
+    return {"label": str(i), "url": f"https://{i}.se/", "raw_html": f"<p>{i}</p>{text}"}
+
+
+def save_pages(folder, pages, shard_size=1024 * 1024):
+    store = ShardedPageStore(folder, shard_size)
+    locations = [store.save(data, "name") for data in pages]
+    store.close()
+    return locations
+
+
+def read_all(folder):
+    return list(ShardedPageStore(folder))
+
+
+def test_read_pages_in_several_shards(tmp_path):
+    # Pages that are larger than a read, in shards of a few pages each
+    pages = [page(i, size=i * READ_SIZE // 3) for i in range(10)]
+    locations = save_pages(tmp_path, pages, shard_size=2 * READ_SIZE)
+    assert len({location.split(":")[0] for location in locations}) > 1
+
+    assert read_all(tmp_path) == list(zip(locations, pages))
+    store = ShardedPageStore(tmp_path)
+    assert [store.read(location) for location in locations] == pages
+
+
+def test_remove_pages(tmp_path):
+    pages = [page(i) for i in range(5)]
+    locations = save_pages(tmp_path, pages)
+    store = ShardedPageStore(tmp_path)
+    moved = store.remove({locations[1], locations[3]})
+    assert [data for _, data in store] == [pages[0], pages[2], pages[4]]
+    assert [store.read(moved.get(locations[i], locations[i])) for i in (0, 2, 4)] == [pages[0], pages[2], pages[4]]
+
+
+def test_truncated_record_is_cut_off_before_appending(tmp_path):
+    pages = [page(i) for i in range(3)]
+    save_pages(tmp_path, pages)
+    shard = next(tmp_path.iterdir())
+    size = shard.stat().st_size
+    # A crash in the middle of writing a record
+    record = gzip.compress(json.dumps(page(3)).encode("utf-8"))
+    with open(shard, "ab") as f:
+        f.write(record[:len(record) // 2])
+
+    assert [data for _, data in read_all(tmp_path)] == pages
+    later = [page(i) for i in range(4, 6)]
+    locations = save_pages(tmp_path, later)
+    assert [data for _, data in read_all(tmp_path)] == pages + later
+    assert locations[0] == f"{shard.name}:{size}:{locations[0].rsplit(':', 1)[1]}"
+    assert shard.stat().st_size == size + sum(int(location.rsplit(":", 1)[1]) for location in locations)
+
+
+def test_corrupt_record_is_skipped(tmp_path):
+    pages = [page(i, size=1000) for i in range(4)]
+    locations = save_pages(tmp_path, pages)
+    shard, offset, length = locations[1].rsplit(":", 2)
+    with open(tmp_path / shard, "r+b") as f:
+        f.seek(int(offset) + int(length) // 2)
+        f.write(b"\0" * 20)
+
+    assert read_all(tmp_path) == [(locations[i], pages[i]) for i in (0, 2, 3)]
@@ -0,0 +1,83 @@
+"""
+Tests of the token bucket rate limiter.
+"""
+import threading
+import time
+import pytest
+import classes.rate_limiter as rate_limiter
+from classes.rate_limiter import TokenBucket
+
+
+class FakeClock():
+    """
+    A clock that only moves when it is slept on. The tests use rates whose waits are
+        exact binary fractions, since the clock doesn't move on by itself after a rounded down wait.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+def test_burst_up_to_the_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=10)
+    for _ in range(10):
+        bucket.acquire()
+    assert clock.now == 0
+    bucket.acquire()
+    assert clock.now == pytest.approx(0.5)
+    assert bucket.waited == pytest.approx(0.5)
+
+
+def test_average_rate(clock):
+    bucket = TokenBucket(rate=4, capacity=3)
+    for _ in range(103):
+        bucket.acquire()
+    # The first 3 requests are a burst, the other 100 come at the rate
+    assert clock.now == pytest.approx(100 / 4)
+
+
+def test_tokens_refill_while_idle(clock):
+    bucket = TokenBucket(rate=1, capacity=4)
+    for _ in range(4):
+        bucket.acquire()
+    clock.sleep(2.5)
+    bucket.acquire(2)
+    assert clock.now == pytest.approx(2.5)
+    # Half a token is left, and the capacity caps a request for more tokens than it holds
+    bucket.acquire(10)
+    assert clock.now == pytest.approx(2.5 + 3.5)
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_rate_is_shared_between_threads():
+    bucket = TokenBucket(rate=50, capacity=5)
+
+    def worker():
+        for _ in range(5):
+            bucket.acquire()
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    # 40 requests: a burst of 5, and 35 at 50 per second
+    assert 35 / 50 * 0.9 <= elapsed < 35 / 50 + 0.5
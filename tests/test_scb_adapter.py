@@ -0,0 +1,120 @@
+"""
+Tests of the SCB adapter's companies migration and reference table snapshot,
+with an in-memory MongoDB (mongomock).
+"""
+import mongomock
+import pymongo
+import pytest
+import adapters.scb
+import classes.mongo
+from adapters.scb import SCBAdapter, CompaniesNotMigrated
+from classes.mongo import Schema
+
+
+def adapter(monkeypatch, client):
+    monkeypatch.setattr(classes.mongo, "get_client", lambda: client)
+    return SCBAdapter()
+
+
+@pytest.fixture
+def scb(monkeypatch, tmp_path):
+    monkeypatch.setattr(SCBAdapter, "_migrated", False)
+    monkeypatch.setattr(SCBAdapter, "_reference_tables", {})
+    monkeypatch.setattr(adapters.scb, "REFERENCE_SNAPSHOT_PATH", str(tmp_path / "scb_reference_tables.json"))
+    return adapter(monkeypatch, mongomock.MongoClient())
+
+
+def test_unmigrated_companies_fail_loudly(scb):
+    companies = scb.mongo_client[Schema.DB][Schema.COMPANIES]
+    companies.insert_one({"org_nr": "1", "url": "https://www.bdx.se/", "branch_codes": ["01110"]})
+
+    # Without the has_url field the query would silently match nothing
+    with pytest.raises(CompaniesNotMigrated):
+        list(scb.iter_all_companies_from_db(has_url="ONLY"))
+    with pytest.raises(CompaniesNotMigrated):
+        scb.get_company_by_url("https://www.bdx.se/")
+    assert len(list(scb.iter_all_companies_from_db(has_url="BOTH"))) == 1
+
+    assert scb.migrate_companies() == {"duplicates": 0, "updated": 1}
+    assert scb.get_company_by_url("https://bdx.se/om-oss")["org_nr"] == "1"
+    assert [company["org_nr"] for company in scb.iter_companies_from_db_by_sni("01110", has_url="ONLY")] == ["1"]
+
+
+def test_migration_moves_the_extracted_data_of_duplicates(scb):
+    db = scb.mongo_client[Schema.DB]
+    first, with_url, other = db[Schema.COMPANIES].insert_many([
+        {"org_nr": "1", "url": ""},
+        {"org_nr": "1", "url": "https://www.bdx.se/"},
+        {"org_nr": "2", "url": "https://www.ssab.se/"},
+    ]).inserted_ids
+    db[Schema.EXTRACTED_DATA].insert_many([
+        {"company_id": first, "data": ["first"]},
+        {"company_id": with_url, "data": ["with url"]},
+        {"company_id": other, "data": ["other"]},
+    ])
+
+    assert scb.migrate_companies(batch_size=1) == {"duplicates": 1, "updated": 2}
+    assert [company["_id"] for company in db[Schema.COMPANIES].find({"org_nr": "1"})] == [with_url]
+    assert sorted(data["data"][0] for data in db[Schema.EXTRACTED_DATA].find({"company_id": with_url})) == ["first", "with url"]
+    assert db[Schema.EXTRACTED_DATA].count_documents({"company_id": first}) == 0
+
+    # Running it again finds nothing to do
+    assert scb.migrate_companies() == {"duplicates": 0, "updated": 0}
+
+
+def test_reference_snapshot_is_only_used_for_the_same_database(scb, monkeypatch):
+    municipalities = scb.mongo_client[Schema.DB][Schema.MUNICIPALITIES]
+    municipalities.insert_one({"code": "0114", "name": "Upplands Väsby"})
+    assert scb._fetch_municipalities() == {"0114": "Upplands Väsby"}
+
+    # A new process reads the snapshot, as long as the collection has as many documents
+    monkeypatch.setattr(SCBAdapter, "_reference_tables", {})
+    municipalities.update_one({"code": "0114"}, {"$set": {"name": "Väsby"}})
+    assert scb._fetch_municipalities() == {"0114": "Upplands Väsby"}
+
+    # ...and reads the database when it has changed
+    monkeypatch.setattr(SCBAdapter, "_reference_tables", {})
+    municipalities.insert_one({"code": "0115", "name": "Vallentuna"})
+    assert scb._fetch_municipalities() == {"0114": "Väsby", "0115": "Vallentuna"}
+
+    # Another database with as many documents doesn't get the snapshot
+    monkeypatch.setattr(SCBAdapter, "_reference_tables", {})
+    monkeypatch.setenv("MONGO_CONNECTION", "mongodb://other-server")
+    other = adapter(monkeypatch, mongomock.MongoClient())
+    other.mongo_client[Schema.DB][Schema.MUNICIPALITIES].insert_many([{"code": "0180", "name": "Stockholm"}, {"code": "1480", "name": "Göteborg"}])
+    assert other._fetch_municipalities() == {"0180": "Stockholm", "1480": "Göteborg"}
+
+
+def test_trusted_snapshot_needs_no_database(scb, monkeypatch):
+    scb.mongo_client[Schema.DB][Schema.SNI].insert_one({"sni_code": "01110", "description": "Odling av spannmål"})
+    assert scb.fetch_codes() == {"01110": "Odling av spannmål"}
+
+    # A new process (i.e. predict) without a reachable database
+    monkeypatch.setattr(SCBAdapter, "_reference_tables", {})
+    offline = adapter(monkeypatch, pymongo.MongoClient("mongodb://127.0.0.1:1", serverSelectionTimeoutMS=100))
+    assert offline.fetch_codes(trust_snapshot=True) == {"01110": "Odling av spannmål"}
+    monkeypatch.setattr(SCBAdapter, "_reference_tables", {})
+    with pytest.raises(pymongo.errors.ServerSelectionTimeoutError):
+        offline.fetch_codes()
+
+
+def test_company_indexes_end_with_the_id(scb):
+    companies = scb.mongo_client[Schema.DB][Schema.COMPANIES]
+    # The indexes of earlier versions are replaced
+    companies.create_index("has_url")
+    companies.create_index([("branch_codes", 1), ("has_url", 1)])
+    companies.insert_many([
+        {"org_nr": "1", "url": "https://www.bdx.se/", "branch_codes": ["01110"]},
+        {"org_nr": "2", "url": " ", "branch_codes": ["01110"]},
+        {"org_nr": "3", "branch_codes": ["01110", "43320"]},
+    ])
+    scb.migrate_companies()
+
+    keys = [index["key"] for index in companies.index_information().values()]
+    assert [("has_url", 1), ("_id", 1)] in keys
+    assert [("branch_codes", 1), ("has_url", 1), ("_id", 1)] in keys
+    assert [("has_url", 1)] not in keys
+    assert [("branch_codes", 1), ("has_url", 1)] not in keys
+
+    assert [company["org_nr"] for company in scb.iter_companies_from_db_by_sni("01110", has_url="NO", batch_size=1)] == ["2", "3"]
+    assert [company["org_nr"] for company in scb.iter_all_companies_from_db(has_url="ONLY")] == ["1"]
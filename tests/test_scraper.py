@@ -0,0 +1,130 @@
+"""
+Tests of the crawler against a local HTTP server.
+"""
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from classes.crawl_manifest import CrawlManifest
+from classes.page_store import read_pages
+from classes.scraper import Scraper, _decode_body, _header_charset
+
+SWEDISH = "<html><body><p>Hej på dig, ÅÄÖ åäö</p></body></html>"
+LATIN_1 = '<html><head><meta charset="iso-8859-1"></head><body><p>Åäö latin</p></body></html>'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Serves html pages without a charset in the Content-Type header,
+        and /drip, which sends a byte at a time without ever finishing in time.
+    """
+    pages = {
+        "/utf8": SWEDISH.encode("utf-8"),
+        "/latin1": LATIN_1.encode("latin-1"),
+    }
+
+    def do_GET(self):
+        if self.path == "/drip":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            try:
+                for _ in range(100):
+                    self.wfile.write(b"x")
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            except OSError:
+                pass
+            return
+        body = self.pages[self.path.split("?")[0]]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def saved_pages(folder):
+    return {data["url"].rsplit("/", 1)[1]: data["raw_html"] for _, data in read_pages(folder)}
+
+
+def test_decode_body():
+    assert _decode_body(SWEDISH.encode("utf-8")) == SWEDISH
+    assert _decode_body(SWEDISH.encode("latin-1"), "iso-8859-1") == SWEDISH
+    assert _decode_body(LATIN_1.encode("latin-1")) == LATIN_1
+    # An unknown charset falls back to the page's own declaration, or utf-8
+    assert _decode_body(SWEDISH.encode("utf-8"), "no-such-charset") == SWEDISH
+    assert _decode_body(b"<p>\xff</p>") == "<p>�</p>"
+
+
+def test_header_charset():
+    assert _header_charset("text/html; charset=utf-8") == "utf-8"
+    assert _header_charset('text/html;Charset="ISO-8859-1"') == "ISO-8859-1"
+    assert _header_charset("text/html") is None
+    assert _header_charset("") is None
+
+
+@pytest.mark.parametrize("crawl", ["scrape_all", "scrape_all_async"])
+def test_crawl_decodes_pages_without_charset(server, tmp_path, crawl):
+    scraper = Scraper(tmp_path)
+    getattr(scraper, crawl)([{"label": "1", "url": f"{server}/utf8"}, {"label": "2", "url": f"{server}/latin1"}])
+    assert saved_pages(tmp_path) == {"utf8": SWEDISH, "latin1": LATIN_1}
+    assert not scraper.stats.failures
+
+
+@pytest.mark.parametrize("crawl", ["scrape_all", "scrape_all_async"])
+def test_download_timeout_stops_a_dripping_server(server, tmp_path, crawl):
+    # Every byte arrives well within the read timeout, but the download would take 10 seconds
+    scraper = Scraper(tmp_path, read_timeout=5, download_timeout=1)
+    start = time.monotonic()
+    getattr(scraper, crawl)([{"label": "1", "url": f"{server}/drip"}])
+    assert time.monotonic() - start < 3
+    assert scraper.stats.failures == {"timeout": 1}
+    assert saved_pages(tmp_path) == {}
+
+
+def test_async_crawl_reads_the_frontier_off_the_event_loop(server, tmp_path):
+    scraper = Scraper(tmp_path)
+    scraper.manifest = CrawlManifest(tmp_path / "manifest.sqlite")
+
+    def frontier():
+        # Like a slow database cursor
+        for i in range(3):
+            time.sleep(0.3)
+            yield {"label": str(i), "url": f"{server}/utf8?page={i}", "depth": 0}
+
+    async def crawl():
+        # The longest time that the event loop was blocked while crawling
+        longest = 0
+        async def heartbeat():
+            nonlocal longest
+            while True:
+                start = time.monotonic()
+                await asyncio.sleep(0.01)
+                longest = max(longest, time.monotonic() - start)
+        task = asyncio.create_task(heartbeat())
+        await asyncio.sleep(0)
+        scraped = await scraper._crawl(frontier(), False, False, max_concurrency=2, per_domain_limit=2)
+        task.cancel()
+        return scraped, longest
+
+    scraped, longest = asyncio.run(crawl())
+    scraper.store.close()
+    scraper.manifest.close()
+    assert scraped == 3
+    assert longest < 0.2